@@ -0,0 +1,287 @@
+"""
+Benchmark de punta a punta: simulador -> broker -> mqtt_listener -> MySQL -> backend /ws.
+
+Levanta el generador de carga (simulador_sensores.py) y al mismo tiempo:
+  - consulta MySQL por las filas nuevas: throughput sostenido de ingesta y
+    latencia publicación -> fila en la BD (hora de la fila = `ts` del dispositivo)
+  - escucha el /ws del backend: latencia publicación -> entrega al dashboard
+
+Todo debe apuntar a servicios locales (broker, MySQL y backend de prueba),
+no a producción: siempre corre en modo carga del simulador (broker en
+localhost y tópico iot-bench/carga por defecto; un broker remoto solo con
+--permitir-broker-remoto). El listener de prueba va con
+MQTT_BROKER=localhost MQTT_TOPIC=iot-bench/carga. Ejemplo:
+    python benchmark.py --dispositivos 200 --tasa 5 \
+        --procesos 4 --duracion 60 --semilla 1 --salida bench.json \
+        --comparar bench_anterior.json
+
+La medición del /ws usa el paquete `websockets` (pip install websockets);
+sin él, correr con --ws-url '' para medir solo la BD.
+
+Con STORAGE_MODE=narrow la latencia a BD tiene precisión de milisegundos;
+en per_table depende de la precisión de `hora_medicion`.
+Con --comparar, termina con código 1 si el throughput baja o el p99 sube
+más de --tolerancia respecto al reporte anterior.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from datetime import datetime
+
+import mysql.connector
+from dotenv import load_dotenv
+
+try:
+    # Solo para medir el /ws del backend (--ws-url)
+    import websockets
+except ImportError:
+    websockets = None
+
+import simulador_sensores as sim
+
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": int(os.getenv("DB_PORT", 3306)),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME"),
+}
+STORAGE_MODE = os.getenv("STORAGE_MODE", "per_table")
+
+
+def percentiles(values):
+    """
+    p50/p90/p99/max en milisegundos (rango más cercano, sin numpy).
+    """
+    if not values:
+        return {"muestras": 0}
+    ordered = sorted(values)
+
+    def pick(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+
+    return {
+        "muestras": len(ordered),
+        "p50_ms": round(pick(50), 1),
+        "p90_ms": round(pick(90), 1),
+        "p99_ms": round(pick(99), 1),
+        "max_ms": round(ordered[-1], 1),
+    }
+
+
+# -------------------------------
+# OBSERVADORES
+# -------------------------------
+
+class DbWatcher:
+    """
+    Sigue las filas nuevas por id (arranca del máximo actual) y, para cada
+    una, mide cuánto después de su `ts` de dispositivo apareció en la BD.
+    """
+
+    def __init__(self, tables, poll_interval):
+        self.tables = tables
+        self.poll_interval = poll_interval
+        self.latencies_ms = []
+        self.rows = 0
+        self.first_seen = None
+        self.last_seen = None
+        self._last_ids = {}
+
+    def _queries(self):
+        if STORAGE_MODE == "narrow":
+            return {"mediciones": "SELECT id, ts FROM mediciones WHERE id > %s ORDER BY id LIMIT 20000"}
+        return {
+            t: f"SELECT id, hora_medicion FROM {t} WHERE id > %s ORDER BY id LIMIT 20000"
+            for t in self.tables
+        }
+
+    def _poll(self, conn, start_wall):
+        cursor = conn.cursor()
+        now = time.time()
+        for table, query in self._queries().items():
+            if table not in self._last_ids:
+                cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+                self._last_ids[table] = cursor.fetchone()[0]
+                continue
+            cursor.execute(query, (self._last_ids[table],))
+            for row_id, ts in cursor.fetchall():
+                self._last_ids[table] = row_id
+                device_ts = ts.timestamp()
+                if device_ts < start_wall:
+                    continue
+                self.rows += 1
+                self.latencies_ms.append(max(0.0, (now - device_ts) * 1000))
+                self.first_seen = self.first_seen or now
+                self.last_seen = now
+        conn.commit()
+        cursor.close()
+
+    async def run(self, stop: asyncio.Event, start_wall: float):
+        conn = await asyncio.to_thread(mysql.connector.connect, **DB_CONFIG, use_pure=True)
+        try:
+            while not stop.is_set():
+                await asyncio.to_thread(self._poll, conn, start_wall)
+                try:
+                    await asyncio.wait_for(stop.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+            await asyncio.to_thread(self._poll, conn, start_wall)
+        finally:
+            conn.close()
+
+    def report(self):
+        span = (self.last_seen - self.first_seen) if self.first_seen and self.last_seen else 0.0
+        return {
+            "filas": self.rows,
+            "filas_por_segundo": round(self.rows / span, 1) if span else 0.0,
+            "latencia_publicacion_a_bd": percentiles(self.latencies_ms),
+        }
+
+
+class WsWatcher:
+    """
+    Se conecta al /ws del backend y mide, por cada lectura nueva que llega
+    en un snapshot, cuánto después de su hora de dispositivo se entregó.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.latencies_ms = []
+        self.messages = 0
+        self.error = None
+        self._seen = {}
+
+    async def run(self, stop: asyncio.Event, start_wall: float):
+        try:
+            async with websockets.connect(self.url) as ws:
+                while not stop.is_set():
+                    try:
+                        raw = await asyncio.wait_for(ws.recv(), 0.5)
+                    except asyncio.TimeoutError:
+                        continue
+                    now = time.time()
+                    self.messages += 1
+                    data = json.loads(raw)
+                    for sensor, point in data.items():
+                        if not isinstance(point, dict) or "id" not in point:
+                            continue
+                        if self._seen.get(sensor) == point["id"] or not point.get("time"):
+                            continue
+                        self._seen[sensor] = point["id"]
+                        device_ts = datetime.fromisoformat(point["time"]).timestamp()
+                        if device_ts >= start_wall:
+                            self.latencies_ms.append(max(0.0, (now - device_ts) * 1000))
+        except (OSError, websockets.WebSocketException) as e:
+            self.error = str(e)
+
+    def report(self):
+        result = {
+            "mensajes": self.messages,
+            "latencia_publicacion_a_ws": percentiles(self.latencies_ms),
+        }
+        if self.error:
+            result["error"] = self.error
+        return result
+
+
+# -------------------------------
+# CORRIDA
+# -------------------------------
+
+async def correr(args):
+    stop = asyncio.Event()
+    start_wall = time.time()
+
+    db = DbWatcher(list(sim.SENSORES), args.poll)
+    ws = WsWatcher(args.ws_url) if args.ws_url else None
+
+    tasks = [asyncio.create_task(db.run(stop, start_wall))]
+    if ws:
+        tasks.append(asyncio.create_task(ws.run(stop, start_wall)))
+
+    # El generador corre en sus propios procesos
+    carga = await asyncio.to_thread(sim.correr_carga, args)
+
+    # Tiempo extra para que termine de llegar lo que ya se publicó
+    await asyncio.sleep(args.drenado)
+    stop.set()
+    await asyncio.gather(*tasks)
+
+    reporte = {
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "storage_mode": STORAGE_MODE,
+        "carga": carga,
+        "ingesta": db.report(),
+    }
+    if ws:
+        reporte["websocket"] = ws.report()
+    return reporte
+
+
+def comparar(actual, anterior, tolerancia):
+    """
+    Regresa la lista de regresiones (vacía si todo bien).
+    """
+    regresiones = []
+    tp_antes = anterior.get("ingesta", {}).get("filas_por_segundo", 0)
+    tp_ahora = actual["ingesta"]["filas_por_segundo"]
+    if tp_antes and tp_ahora < tp_antes * (1 - tolerancia):
+        regresiones.append(f"throughput {tp_ahora} < {tp_antes} filas/s")
+
+    for seccion, clave in (("ingesta", "latencia_publicacion_a_bd"), ("websocket", "latencia_publicacion_a_ws")):
+        antes = anterior.get(seccion, {}).get(clave, {}).get("p99_ms")
+        ahora = actual.get(seccion, {}).get(clave, {}).get("p99_ms")
+        if antes and ahora and ahora > antes * (1 + tolerancia):
+            regresiones.append(f"{clave} p99 {ahora} ms > {antes} ms")
+    return regresiones
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de punta a punta del pipeline IoT")
+    parser.add_argument("--ws-url", default="ws://127.0.0.1:8000/ws", help="'' para no medir WS")
+    parser.add_argument("--poll", type=float, default=0.2, help="segundos entre consultas a la BD")
+    parser.add_argument("--drenado", type=float, default=5.0, help="segundos de espera al final")
+    parser.add_argument("--salida", help="archivo JSON con el reporte")
+    parser.add_argument("--comparar", help="reporte anterior para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.2)
+    # Mismas opciones que el simulador (--broker, --dispositivos, --tasa, ...)
+    args, resto = parser.parse_known_args()
+    if args.ws_url and websockets is None:
+        parser.error(
+            "medir el /ws necesita el paquete websockets (pip install websockets); "
+            "con --ws-url '' se mide solo la BD"
+        )
+    sim_args = sim.parse_args(resto, carga=True)
+    sim_args.silencioso = True
+    if not sim_args.duracion:
+        sim_args.duracion = 30
+    for k, v in vars(args).items():
+        setattr(sim_args, k, v)
+
+    reporte = asyncio.run(correr(sim_args))
+    print(json.dumps(reporte, indent=2, ensure_ascii=False))
+
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=2, ensure_ascii=False)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(reporte, json.load(f), args.tolerancia)
+        for r in regresiones:
+            print(f"❌ Regresión: {r}")
+        if regresiones:
+            sys.exit(1)
+        print("✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    mp.freeze_support()
+    main()
@@ -1,41 +1,73 @@
+"""
+Simulador de sensores / generador de carga MQTT.
+
+Sin argumentos se comporta como siempre: un dispositivo publicando al
+broker público cada 1.5 s.
+
+Con más de un dispositivo es modo carga: por defecto publica a un broker
+en localhost y a un tópico de pruebas (CARGA_TOPIC), no al de producción,
+y se niega a usar un broker que no sea local o de red privada salvo con
+--permitir-broker-remoto. El listener de prueba se levanta con
+MQTT_BROKER=localhost MQTT_TOPIC=iot-bench/carga y una BD de pruebas.
+    python simulador_sensores.py --dispositivos 500 \
+        --tasa 2 --procesos 4 --duracion 60 --semilla 42 --reporte carga.json
+
+Cada dispositivo usa su propio random.Random derivado de la semilla, así
+dos corridas con la misma semilla publican exactamente los mismos valores.
+
+Con --formato binario cada mensaje lleva --lote lecturas en el formato
+compacto de iot-mqtt/formato_binario.py en lugar de un JSON por lectura.
+"""
+import argparse
+import ipaddress
+import multiprocessing as mp
+import os
+import queue
 import time
 import json
 import random
+import socket
+import sys
+from pathlib import Path
 from paho.mqtt import client as mqtt
 
 # --- Configuración del broker ---
-BROKER = "test.mosquitto.org"
-PORT = 1883
+BROKER = os.getenv("MQTT_BROKER", "test.mosquitto.org")
+PORT = int(os.getenv("MQTT_PORT", 1883))
 TOPIC = "umisumi/test/message"  # mismo tópico que tu listener
+DEVICE_ID = "simulador-1"       # columna `device` en la tabla `mediciones`
+
+# --- Modo carga: nunca contra el broker/tópico de producción por defecto ---
+CARGA_BROKER = os.getenv("CARGA_MQTT_BROKER", "localhost")
+CARGA_TOPIC = os.getenv("CARGA_MQTT_TOPIC", "iot-bench/carga")
 
 # --- Configuración de los "sensores" simulados ---
-SENSORES = {
-    "humedad": {
-        "min": 30,
-        "max": 80,
-        "unit": "%"
-    },
-    "temperatura": {
-        "min": 18,
-        "max": 32,
-        "unit": "C"
-    },
-    "presion": {
-        "min": 980,
-        "max": 1030,
-        "unit": "hPa"
-    },
-    "luz": {
-        "min": 0,
-        "max": 1023,
-        "unit": "adc"
-    },
-    "gas": {
-        "min": 100,
-        "max": 400,
-        "unit": "ppm"
-    },
-}
+# Sale del registro compartido con el listener y el backend (../sensores.json);
+# se simula dentro del rango "simulacion" de cada sensor, o su rango válido.
+SENSORS_FILE = os.getenv(
+    "SENSORS_FILE", str(Path(__file__).resolve().parent.parent / "sensores.json")
+)
+
+
+def cargar_sensores(path=SENSORS_FILE):
+    with open(path, encoding="utf-8") as f:
+        registro = json.load(f)
+    return {
+        nombre: {
+            "min": cfg.get("simulacion", cfg)["min"],
+            "max": cfg.get("simulacion", cfg)["max"],
+            "unit": cfg["unit"],
+            "id": cfg.get("id"),
+        }
+        for nombre, cfg in registro.items()
+    }
+
+
+SENSORES = cargar_sensores()
+
+# Formato binario: el mismo módulo que decodifica el listener (../iot-mqtt)
+sys.path.append(str(Path(__file__).resolve().parent.parent / "iot-mqtt"))
+from formato_binario import encode as empacar_binario
 
 
 def on_connect(client, userdata, flags, rc):
@@ -45,53 +77,233 @@ def on_connect(client, userdata, flags, rc):
         print("⚠️ Error al conectar. Código:", rc)
 
 
-def crear_cliente():
+def crear_cliente(broker=BROKER, port=PORT):
     client = mqtt.Client()
     client.on_connect = on_connect
-    client.connect(BROKER, PORT, keepalive=60)
+    client.connect(broker, port, keepalive=60)
     return client
 
 
-def generar_valor(sensor_cfg):
-    return round(random.uniform(sensor_cfg["min"], sensor_cfg["max"]), 2)
+def generar_valor(sensor_cfg, rng=random):
+    return round(rng.uniform(sensor_cfg["min"], sensor_cfg["max"]), 2)
 
 
-def main():
-    client = crear_cliente()
-    client.loop_start()  # mantiene la conexión
+def nombre_dispositivo(indice, total):
+    # Con un solo dispositivo conservamos el id de siempre
+    return DEVICE_ID if total == 1 else f"sim-{indice:05d}"
+
+
+# -------------------------------
+# GENERADOR DE CARGA
+# -------------------------------
+
+def correr_proceso(args, indices, resultados=None):
+    """
+    Publica por los dispositivos `indices` a `args.tasa` mensajes/s cada uno
+    (en binario, cada mensaje lleva `args.lote` lecturas).
+    Un solo cliente MQTT por proceso; los envíos se agendan contra el reloj
+    (no con sleep fijo) para que la tasa no se vaya atrasando.
+    """
+    client = crear_cliente(args.broker, args.port)
+    client.loop_start()
+
+    tipos = list(SENSORES)
+    dispositivos = [
+        {
+            "id": nombre_dispositivo(i, args.dispositivos),
+            "rng": random.Random(args.semilla * 1_000_003 + i),
+            "siguiente_sensor": i % len(tipos),
+        }
+        for i in indices
+    ]
+    intervalo = 1.0 / (args.tasa * len(dispositivos))
+    detallado = not args.silencioso and args.dispositivos == 1
+
+    binario = args.formato == "binario"
+    lote = args.lote if binario else 1
+
+    enviados = 0
+    lecturas = 0
+    errores = 0
+    inicio = time.monotonic()
+    fin = inicio + args.duracion if args.duracion else None
+    siguiente = inicio
+    turno = 0
 
     try:
-        while True:
-            for sensor_type, cfg in SENSORES.items():
-                valor = generar_valor(cfg)
+        while fin is None or time.monotonic() < fin:
+            disp = dispositivos[turno % len(dispositivos)]
+            turno += 1
+            ahora_ms = int(time.time() * 1000)
 
+            muestras = []
+            for _ in range(lote):
+                sensor_type = tipos[disp["siguiente_sensor"]]
+                disp["siguiente_sensor"] = (disp["siguiente_sensor"] + 1) % len(tipos)
+                muestras.append((sensor_type, generar_valor(SENSORES[sensor_type], disp["rng"])))
+
+            if binario:
+                mensaje = empacar_binario(
+                    disp["id"],
+                    [(SENSORES[t]["id"], 0, v) for t, v in muestras],
+                    ahora_ms,
+                )
+                payload = {"device": disp["id"], "lecturas": dict(muestras), "bytes": len(mensaje)}
+            else:
+                sensor_type, valor = muestras[0]
                 # 👇 ESTE ES EL JSON QUE VE TU LISTENER
                 payload = {
-                    "type": sensor_type,          # 👈 AHORA SE LLAMA "type"
-                    "value": valor,               # lo conviertes a float en el listener
-                    "unit": cfg["unit"],
-                    "ts": int(time.time())
+                    "type": sensor_type,
+                    "device": disp["id"],
+                    "value": valor,
+                    "unit": SENSORES[sensor_type]["unit"],
+                    # En milisegundos para poder medir latencia de punta a punta
+                    "ts": ahora_ms,
                 }
+                mensaje = json.dumps(payload)
 
-                result = client.publish(TOPIC, json.dumps(payload))
-                status = result[0]
-
-                if status == 0:
-                    print(f"📡 Enviado a {TOPIC}: {payload}")
-                else:
-                    print(f"❌ Error al publicar en {TOPIC}: {payload}")
-
-                time.sleep(1.5)
+            result = client.publish(args.topic, mensaje, qos=args.qos)
+            if result[0] == 0:
+                enviados += 1
+                lecturas += lote
+                if detallado:
+                    print(f"📡 Enviado a {args.topic}: {payload}")
+            else:
+                errores += 1
+                if detallado:
+                    print(f"❌ Error al publicar en {args.topic}: {payload}")
 
-            time.sleep(6)
+            siguiente += intervalo
+            espera = siguiente - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
 
     except KeyboardInterrupt:
-        print("\n🛑 Simulador detenido por el usuario.")
+        pass
     finally:
         client.loop_stop()
         client.disconnect()
-        print("🔌 Desconectado del broker.")
+        if resultados is not None:
+            resultados.put({
+                "dispositivos": len(dispositivos),
+                "enviados": enviados,
+                "lecturas": lecturas,
+                "errores": errores,
+                "segundos": time.monotonic() - inicio,
+            })
+
+
+def correr_carga(args):
+    """
+    Reparte los dispositivos entre `args.procesos` procesos y junta sus conteos.
+    """
+    procesos = max(1, min(args.procesos, args.dispositivos))
+    resultados = mp.Queue()
+    workers = []
+    for p in range(procesos):
+        indices = list(range(p, args.dispositivos, procesos))
+        w = mp.Process(target=correr_proceso, args=(args, indices, resultados), daemon=True)
+        w.start()
+        workers.append(w)
+
+    # Se leen los conteos antes de join(): un proceso con datos pendientes
+    # en la cola no termina hasta que alguien los saca
+    parciales = []
+    while len(parciales) < len(workers):
+        try:
+            parciales.append(resultados.get(timeout=1))
+        except queue.Empty:
+            if not any(w.is_alive() for w in workers):
+                break
+        except KeyboardInterrupt:
+            # Los hijos también reciben el Ctrl+C y mandan sus conteos
+            print("\n🛑 Simulador detenido por el usuario.")
+    for w in workers:
+        w.join()
+
+    enviados = sum(r["enviados"] for r in parciales)
+    segundos = max((r["segundos"] for r in parciales), default=0.0)
+    return {
+        "broker": f"{args.broker}:{args.port}",
+        "topic": args.topic,
+        "dispositivos": args.dispositivos,
+        "procesos": procesos,
+        "tasa_por_dispositivo": args.tasa,
+        "semilla": args.semilla,
+        "formato": args.formato,
+        "enviados": enviados,
+        "lecturas": sum(r["lecturas"] for r in parciales),
+        "errores": sum(r["errores"] for r in parciales),
+        "segundos": round(segundos, 3),
+        "mensajes_por_segundo": round(enviados / segundos, 1) if segundos else 0.0,
+    }
+
+
+def es_broker_local(host):
+    """
+    True si `host` resuelve a loopback o a una dirección de red privada.
+    """
+    try:
+        infos = socket.getaddrinfo(host, None)
+    except socket.gaierror:
+        return False
+    for info in infos:
+        ip = ipaddress.ip_address(info[4][0].split("%")[0])
+        if not (ip.is_loopback or ip.is_private):
+            return False
+    return bool(infos)
+
+
+def parse_args(argv=None, carga=None):
+    """
+    `carga`: forzar (True) el modo carga; None = solo con más de un dispositivo.
+    """
+    parser = argparse.ArgumentParser(description="Simulador de sensores / generador de carga MQTT")
+    parser.add_argument("--broker", help=f"por defecto {BROKER}; en modo carga {CARGA_BROKER}")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--topic", help=f"por defecto {TOPIC}; en modo carga {CARGA_TOPIC}")
+    parser.add_argument(
+        "--permitir-broker-remoto", action="store_true",
+        help="en modo carga, permitir un broker que no sea local/red privada",
+    )
+    parser.add_argument("--dispositivos", type=int, default=1, help="dispositivos simulados")
+    parser.add_argument("--tasa", type=float, default=1 / 1.5, help="mensajes/s por dispositivo")
+    parser.add_argument("--procesos", type=int, default=1, help="procesos publicadores")
+    parser.add_argument("--duracion", type=float, default=0, help="segundos (0 = hasta Ctrl+C)")
+    parser.add_argument("--semilla", type=int, default=0, help="semilla para valores reproducibles")
+    parser.add_argument("--formato", default="json", choices=("json", "binario"))
+    parser.add_argument("--lote", type=int, default=len(SENSORES), help="lecturas por mensaje binario")
+    parser.add_argument("--qos", type=int, default=0, choices=(0, 1, 2))
+    parser.add_argument("--reporte", help="guarda el resumen en JSON")
+    parser.add_argument("--silencioso", action="store_true", help="no imprimir cada mensaje")
+    args = parser.parse_args(argv)
+
+    if carga is None:
+        carga = args.dispositivos > 1
+    if carga:
+        args.broker = args.broker or CARGA_BROKER
+        args.topic = args.topic or CARGA_TOPIC
+        if not args.permitir_broker_remoto and not es_broker_local(args.broker):
+            parser.error(
+                f"el broker {args.broker} no es local; una prueba de carga contra un broker "
+                "público (o producción) satura a todos los que lo usan. "
+                "Usa --permitir-broker-remoto si de verdad es lo que quieres."
+            )
+    else:
+        args.broker = args.broker or BROKER
+        args.topic = args.topic or TOPIC
+    return args
+
+
+def main():
+    args = parse_args()
+    resumen = correr_carga(args)
+    print("📊 " + json.dumps(resumen, ensure_ascii=False))
+    if args.reporte:
+        with open(args.reporte, "w", encoding="utf-8") as f:
+            json.dump(resumen, f, indent=2, ensure_ascii=False)
+    print("🔌 Desconectado del broker.")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -59,6 +59,18 @@ MqttClient mqttClient(wifiClient);
 const char broker[] = "test.mosquitto.org";
 int port = 1883;
 const char topic[] = "umisumi/test/message";
+const char deviceId[] = "arduino-sensores-casa-1";  // también va como "device" en el JSON
+
+// 1 = un solo mensaje binario con las 5 lecturas (ver iot-mqtt/formato_binario.py)
+// 0 = un JSON por lectura, como antes
+#define USAR_BINARIO 0
+
+// Ids de sensor del formato binario (deben coincidir con "id" en sensores.json)
+#define ID_TEMPERATURA 1
+#define ID_HUMEDAD     2
+#define ID_PRESION     3
+#define ID_LUZ         4
+#define ID_GAS         5
 
 // ========================================================
 //  NOTAS PARA LA MELODÍA GREAT FAIRY'S FOUNTAIN
@@ -91,6 +103,7 @@ int notesGF = sizeof(melodyGF) / sizeof(melodyGF[0]);
 //  PROTOTIPO FUNCIÓN MQTT
 // ========================================================
 void enviarJSON(const char* type, float value);
+void enviarBinario(const uint8_t* ids, const float* valores, uint8_t n);
 
 // ========================================================
 //  SETUP
@@ -168,7 +181,7 @@ void setup() {
   // ---------------------------------
   // MQTT
   // ---------------------------------
-  mqttClient.setId("arduino-sensores-casa-1");
+  mqttClient.setId(deviceId);
 
   Serial.print("Connecting to MQTT broker: ");
   Serial.println(broker);
@@ -198,7 +211,9 @@ void setup() {
 // ========================================================
 void enviarJSON(const char* type, float value) {
   mqttClient.beginMessage(topic);
-  mqttClient.print("{\"type\":\"");
+  mqttClient.print("{\"device\":\"");
+  mqttClient.print(deviceId);
+  mqttClient.print("\",\"type\":\"");
   mqttClient.print(type);
   mqttClient.print("\",\"value\":");
   mqttClient.print(value);
@@ -206,6 +221,41 @@ void enviarJSON(const char* type, float value) {
   mqttClient.endMessage();
 }
 
+// ========================================================
+//  FUNCIÓN PARA ENVIAR VARIAS LECTURAS EN BINARIO
+//  Cabecera: 0xA5, versión 1, n (uint16), ts base en ms (uint64, 0 = sin reloj),
+//  largo del device + device. Por lectura: id (uint8), ms desde el ts base
+//  (uint32) y valor float32. Todo little-endian (igual que el MCU).
+// ========================================================
+void enviarBinario(const uint8_t* ids, const float* valores, uint8_t n) {
+  uint8_t buf[128];  // 13 + device (23) + 9 por lectura
+  size_t len = 0;
+  uint8_t largoDevice = strlen(deviceId);
+
+  buf[len++] = 0xA5;
+  buf[len++] = 1;
+  buf[len++] = n;
+  buf[len++] = 0;
+  memset(buf + len, 0, 8);  // sin RTC: el listener usa la hora del servidor
+  len += 8;
+  buf[len++] = largoDevice;
+  memcpy(buf + len, deviceId, largoDevice);
+  len += largoDevice;
+
+  for (uint8_t i = 0; i < n; i++) {
+    uint32_t offsetMs = 0;
+    buf[len++] = ids[i];
+    memcpy(buf + len, &offsetMs, 4);
+    len += 4;
+    memcpy(buf + len, &valores[i], 4);
+    len += 4;
+  }
+
+  mqttClient.beginMessage(topic, (unsigned long)len);
+  mqttClient.write(buf, len);
+  mqttClient.endMessage();
+}
+
 // ========================================================
 //  LOOP
 // ========================================================
@@ -297,11 +347,17 @@ void loop() {
   // ======================================================
   // ENVÍO POR MQTT (MISMO FORMATO QUE TU CÓDIGO VIEJO)
   // ======================================================
+#if USAR_BINARIO
+  const uint8_t ids[] = { ID_GAS, ID_HUMEDAD, ID_LUZ, ID_TEMPERATURA, ID_PRESION };
+  const float valores[] = { (float)lecturaMQ2, (float)porcentajeLluvia, (float)luzPercent, temp, press };
+  enviarBinario(ids, valores, 5);
+#else
   enviarJSON("gas", lecturaMQ2);
   enviarJSON("humedad", porcentajeLluvia);
   enviarJSON("luz", luzPercent);
   enviarJSON("temperatura", temp);
   enviarJSON("presion", press);
+#endif
 
   delay(1000);
 }
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Logs y perfilador compartidos por el listener (iot-mqtt) y el backend
+(iot-backend). Las métricas no van aquí: cada proceso define las suyas en
+su propio observabilidad.py, que importa este módulo.
+
+- Logs: `logging` con un QueueHandler; el formateo y la escritura a stdout
+  los hace un hilo aparte, así que loguear no frena al hilo de paho ni al
+  event loop. Nivel con LOG_LEVEL y formato con LOG_FORMAT=text|json.
+- Perfilador: SamplingProfiler, muestrea las pilas de todos los hilos y
+  las regresa en formato "collapsed" (flamegraph.pl / speedscope). Cada
+  proceso decide cómo prenderlo (SIGUSR1 en el listener, endpoints en el
+  backend).
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+from collections import Counter as StackCounter
+from typing import Optional
+
+# -------------------------------
+# LOGS
+# -------------------------------
+
+_STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Una línea JSON por evento; lo que venga en `extra=` va como campo.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        data.update({k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS})
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class KeyValueFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in _STANDARD_ATTRS}
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Encola el record tal cual: el mensaje se arma (y se formatea) en el
+    hilo del QueueListener, no en el que loguea. Si la cola está llena se
+    descarta en lugar de bloquear.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(
+    process_name: Optional[str] = None, logger_name: Optional[str] = None
+) -> logging.handlers.QueueListener:
+    """
+    Configura el logger `logger_name` (None = el raíz) del proceso. Con un
+    logger con nombre no se propaga al raíz, así no se pisa con lo que
+    configure otro (p. ej. uvicorn). Regresa el QueueListener para
+    detenerlo al salir (así se escribe lo que quede en la cola).
+    """
+    if os.getenv("LOG_FORMAT", "text") == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        prefix = f"[{process_name}] " if process_name else ""
+        formatter = KeyValueFormatter(f"%(asctime)s %(levelname)s {prefix}%(name)s: %(message)s")
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(formatter)
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=10000)
+    logger = logging.getLogger(logger_name)
+    logger.handlers[:] = [DroppingQueueHandler(log_queue)]
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    if logger_name:
+        logger.propagate = False
+
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=False)
+    listener.start()
+    return listener
+
+
+# -------------------------------
+# PERFILADOR POR MUESTREO
+# -------------------------------
+
+class SamplingProfiler:
+    """
+    Cada `interval` segundos toma la pila de todos los hilos
+    (sys._current_frames) y cuenta cuántas veces aparece cada una.
+    No instrumenta nada: apagado no cuesta, prendido cuesta una muestra
+    por intervalo.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._stacks: StackCounter = StackCounter()
+        self._samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    @property
+    def samples(self) -> int:
+        """
+        Muestras tomadas desde el último start().
+        """
+        return self._samples
+
+    def start(self):
+        if self.running:
+            return
+        self._stacks.clear()
+        self._samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        """
+        Detiene el muestreo y regresa las pilas en formato collapsed
+        ("a;b;c 42" por línea, la más frecuente primero).
+        """
+        if not self.running:
+            return ""
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        return "\n".join(f"{stack} {n}" for stack, n in self._stacks.most_common()) + "\n"
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                parts = []
+                while frame is not None and len(parts) < self.max_depth:
+                    code = frame.f_code
+                    parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                parts.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(parts))] += 1
+            self._samples += 1
@@ -0,0 +1,52 @@
+from typing import Any, Callable
+
+
+def lttb(
+    points: list[dict[str, Any]],
+    threshold: int,
+    x: Callable[[dict[str, Any]], float],
+    y: Callable[[dict[str, Any]], float],
+) -> list[dict[str, Any]]:
+    """
+    Largest-Triangle-Three-Buckets: reduce una serie ordenada a `threshold`
+    puntos conservando la forma (picos y valles) mejor que promediar.
+
+    Siempre conserva el primer y el último punto. Los puntos que se regresan
+    son los originales (no interpolados), así la gráfica sigue mostrando
+    lecturas reales.
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    # Los extremos no cuentan: repartimos los n-2 puntos internos en threshold-2 cubetas
+    every = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # Promedio de la siguiente cubeta (tercer vértice del triángulo)
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_x = sum(x(p) for p in points[next_start:next_end]) / span
+        avg_y = sum(y(p) for p in points[next_start:next_end]) / span
+
+        # Punto de la cubeta actual que forma el triángulo más grande
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = x(points[a]), y(points[a])
+        max_area = -1.0
+        chosen = start
+        for j in range(start, end):
+            px, py = x(points[j]), y(points[j])
+            area = abs((ax - avg_x) * (py - ay) - (ax - px) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                chosen = j
+
+        sampled.append(points[chosen])
+        a = chosen
+
+    sampled.append(points[-1])
+    return sampled
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Optional
+
+log = logging.getLogger("iot.hub")
+
+
+class Subscriber:
+    """
+    Un cliente de /ws. La cola es acotada: si el cliente es lento se tira
+    el frame más viejo, total el siguiente trae los valores más nuevos.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def offer(self, message: str):
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+                self.dropped += 1
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait(message)
+
+
+class LatestHub:
+    """
+    Hub de "últimos valores" compartido por todos los WebSockets.
+
+    Una sola tarea consulta la BD cada `interval` segundos (o alguien le
+    empuja un snapshot con `publish`), lo serializa una vez y lo reparte a
+    todos los suscriptores, solo si cambió respecto al anterior.
+    """
+
+    def __init__(
+        self,
+        fetch_snapshot: Callable[[], Awaitable[Optional[dict[str, Any]]]],
+        interval: float = 2.0,
+        queue_size: int = 8,
+    ):
+        self._fetch_snapshot = fetch_snapshot
+        self.interval = interval
+        self.queue_size = queue_size
+        self._subscribers: set[Subscriber] = set()
+        self._last_message: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # -------------------------------
+    # CICLO DE VIDA
+    # -------------------------------
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                snapshot = await self._fetch_snapshot()
+                if snapshot is not None:
+                    self.publish(snapshot)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error("Error actualizando snapshot: %s", e)
+            await asyncio.sleep(self.interval)
+
+    # -------------------------------
+    # SUSCRIPCIONES
+    # -------------------------------
+
+    def subscribe(self) -> Subscriber:
+        sub = Subscriber(self.queue_size)
+        # El cliente nuevo arranca con el último snapshot conocido
+        if self._last_message is not None:
+            sub.offer(self._last_message)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        self._subscribers.discard(sub)
+
+    @property
+    def client_count(self) -> int:
+        return len(self._subscribers)
+
+    def max_queue_depth(self) -> int:
+        """
+        Frames pendientes del cliente más atrasado (para las métricas).
+        """
+        return max((sub.queue.qsize() for sub in self._subscribers), default=0)
+
+    def publish(self, snapshot: dict[str, Any]) -> bool:
+        """
+        Serializa una sola vez y reparte. Regresa False si no hubo cambios.
+        """
+        message = json.dumps(snapshot, separators=(",", ":"))
+        if message == self._last_message:
+            return False
+        self._last_message = message
+        for sub in self._subscribers:
+            sub.offer(message)
+        return True
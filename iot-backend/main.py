@@ -1,17 +1,35 @@
-from datetime import datetime
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from decimal import Decimal
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+import hashlib
+import json
+import logging
 import os
-from typing import Any, Optional, List
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, NamedTuple, Optional, List
 import asyncio
 
-import mysql.connector
+import aiomysql
 from dotenv import load_dotenv
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from mysql.connector import Error
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from downsample import lttb
+from live_hub import LatestHub
+from observabilidad import (
+    DB_ERRORS, DB_POOL_FREE, DB_POOL_SIZE, DB_QUERY_SECONDS, HTTP_SECONDS, WS_CLIENTS,
+    WS_DROPPED, WS_QUEUE_DEPTH, SamplingProfiler, register_cache_collector, setup_logging,
+)
+from read_cache import ReadCache
 
 load_dotenv()
 
+log = logging.getLogger("iot.api")
+
 DB_CONFIG = {
     "host": os.getenv("DB_HOST", "localhost"),
     "port": int(os.getenv("DB_PORT", 3306)),
@@ -20,7 +38,98 @@ DB_CONFIG = {
     "database": os.getenv("DB_NAME"),
 }
 
-app = FastAPI()
+# Pool async compartido (se crea al arrancar la app)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))
+
+# Caché de lecturas: se invalida por sensor cuando el hub ve un dato nuevo
+CACHE_TTL = float(os.getenv("CACHE_TTL", 5))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 256))
+
+# Debe coincidir con el STORAGE_MODE del listener:
+# "per_table" (una tabla por sensor) o "narrow" (tabla única `mediciones`)
+STORAGE_MODE = os.getenv("STORAGE_MODE", "per_table")
+
+# Registro único de sensores compartido con el listener y el simulador
+SENSORS_FILE = os.getenv(
+    "SENSORS_FILE", str(Path(__file__).resolve().parent.parent / "sensores.json")
+)
+with open(SENSORS_FILE, encoding="utf-8") as f:
+    SENSORS: dict[str, dict[str, Any]] = json.load(f)
+
+SENSOR_TABLES = tuple(SENSORS)
+
+# Cada cuánto el hub revisa la BD y cuántos frames guarda por cliente lento
+WS_POLL_INTERVAL = float(os.getenv("WS_POLL_INTERVAL", 2))
+WS_QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", 8))
+# Máximo de lecturas por sensor que se reenvían al reconectar con ?cursor=
+WS_RESUME_LIMIT = int(os.getenv("WS_RESUME_LIMIT", 200))
+
+# Alertas abiertas que viajan en cada snapshot de /ws (las genera el listener)
+WS_ALERTS_LIMIT = int(os.getenv("WS_ALERTS_LIMIT", 50))
+
+# Límite de puntos que regresa /history (agregado o LTTB)
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", 5000))
+# Máximo de lecturas crudas que mode=lttb carga en memoria; si el rango
+# tiene más, LTTB corre sobre el min/max de cada cubeta (de los rollups
+# cuando el ancho lo permite)
+LTTB_MAX_ROWS = int(os.getenv("LTTB_MAX_ROWS", 50000))
+
+# Rollups que mantiene el listener (rollup_1m, rollup_1h, rollup_1d). Solo
+# tienen lo que llegó después de prenderlos; lo anterior se llena con
+# `python rollups.py --backfill` (iot-mqtt). Mientras un rollup no cubra el
+# rango pedido se lee de las lecturas crudas (ver rollup_covers)
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1") == "1"
+# Cada cuánto se vuelve a revisar desde cuándo tiene datos cada rollup
+ROLLUP_COVERAGE_TTL = float(os.getenv("ROLLUP_COVERAGE_TTL", 300))
+ROLLUP_LEVELS = (("1d", 86400), ("1h", 3600), ("1m", 60))
+# Rango mínimo (segundos) a partir del cual las estadísticas salen de cada rollup
+ROLLUP_STATS_MIN_SPAN = (("1d", 60 * 86400), ("1h", 2 * 86400), ("1m", 2 * 3600))
+# Anchos de cubeta "redondos" para cuando el cliente no pide uno
+NICE_BUCKETS = (
+    1, 2, 5, 10, 15, 30,
+    60, 120, 300, 600, 900, 1800,
+    3600, 7200, 10800, 21600, 43200, 86400,
+)
+
+# Expone POST /debug/profiler/start|stop (solo para diagnóstico, no en producción abierta)
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+
+
+db_pool: Optional[aiomysql.Pool] = None
+# (sensor, nivel) -> (expira, primera cubeta del rollup, primera lectura cruda)
+rollup_coverage: dict[tuple[str, str], tuple[float, Optional[datetime], Optional[datetime]]] = {}
+cache = ReadCache(ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES)
+profiler = SamplingProfiler() if PROFILER_ENABLED else None
+
+register_cache_collector(lambda: (cache.hits, cache.misses))
+DB_POOL_SIZE.set_function(lambda: db_pool.size if db_pool else 0)
+DB_POOL_FREE.set_function(lambda: db_pool.freesize if db_pool else 0)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db_pool
+    log_listener = setup_logging()
+    db_pool = await aiomysql.create_pool(
+        host=DB_CONFIG["host"],
+        port=DB_CONFIG["port"],
+        user=DB_CONFIG["user"],
+        password=DB_CONFIG["password"],
+        db=DB_CONFIG["database"],
+        minsize=DB_POOL_MIN,
+        maxsize=DB_POOL_MAX,
+        autocommit=True,
+    )
+    await hub.start()
+    yield
+    await hub.stop()
+    db_pool.close()
+    await db_pool.wait_closed()
+    log_listener.stop()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "http://localhost:3000",
@@ -33,14 +142,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Para que el frontend pueda leer los validadores de delta sync
+    expose_headers=["ETag", "Last-Modified"],
 )
 
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Etiqueta por plantilla de ruta ("/history/{sensor}"), no por URL, para
+    # no crear una serie por cada valor de los parámetros
+    route = request.scope.get("route")
+    handler = getattr(route, "path", None) or getattr(request.scope.get("endpoint"), "__name__", "unmatched")
+    HTTP_SECONDS.labels(handler, request.method, response.status_code).observe(
+        time.perf_counter() - started
+    )
+    return response
+
 # -------------------------------
 # FUNCIONES DE BASE DE DATOS
 # -------------------------------
 
-def get_connection():
-    return mysql.connector.connect(**DB_CONFIG, use_pure=True)
+async def fetch_all(query: str, params: tuple = ()) -> List[dict[str, Any]]:
+    """
+    Ejecuta un SELECT con una conexión del pool. Si la BD falla regresa [].
+    """
+    started = time.perf_counter()
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(query, params)
+                return list(await cursor.fetchall())
+    except aiomysql.Error as e:
+        DB_ERRORS.labels("fetch_all").inc()
+        log.error("MySQL: %s", e)
+        return []
+    finally:
+        DB_QUERY_SECONDS.labels("fetch_all").observe(time.perf_counter() - started)
+
+async def fetch_one(query: str, params: tuple = ()) -> Optional[dict[str, Any]]:
+    rows = await fetch_all(query, params)
+    return rows[0] if rows else None
 
 def normalize_row(row: dict[str, Any]) -> dict[str, Any]:
     if row is None:
@@ -62,110 +204,812 @@ def normalize_row(row: dict[str, Any]) -> dict[str, Any]:
         "time": time_value,
     }
 
-def get_latest_measurement(table_name: str) -> Optional[dict[str, Any]]:
-    conn = None
-    cursor = None
+def latest_rows_query(table_name: str) -> tuple[str, tuple]:
+    """
+    SELECT de las últimas N mediciones de un sensor según el STORAGE_MODE.
+    El LIMIT va como último parámetro.
+    """
+    if STORAGE_MODE == "narrow":
+        # Usa el índice (sensor_type, ts): orden por hora del dispositivo
+        return (
+            """
+            SELECT id, valor AS value, ts AS time
+            FROM mediciones
+            WHERE sensor_type = %s
+            ORDER BY ts DESC, id DESC
+            LIMIT %s;
+            """,
+            (table_name,),
+        )
+    return (
+        f"""
+        SELECT id, valor AS value, hora_medicion AS time
+        FROM {table_name}
+        ORDER BY id DESC
+        LIMIT %s;
+        """,
+        (),
+    )
+
+def normalize_alert(row: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "id": row["id"],
+        "device": row["device"],
+        "sensor": row["sensor_type"],
+        "rule": row["regla"],
+        "severity": row["severidad"],
+        "message": row["mensaje"],
+        "value": float(row["valor"]),
+        "start": row["inicio"].isoformat(),
+        "end": row["fin"].isoformat() if row["fin"] else None,
+    }
+
+ALERT_COLUMNS = "id, device, sensor_type, regla, severidad, mensaje, valor, inicio, fin"
+
+async def get_latest_measurement(table_name: str) -> Optional[dict[str, Any]]:
+    query, params = latest_rows_query(table_name)
+    row = await fetch_one(query, params + (1,))
+    return normalize_row(row) if row else None
+
+async def get_latest_snapshot() -> Optional[dict[str, Any]]:
+    """
+    Último valor de cada sensor (y las alertas abiertas, en "alertas")
+    usando una sola conexión del pool.
+    Regresa None si la BD no responde (el hub conserva el snapshot anterior).
+    """
+    started = time.perf_counter()
     try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-        query = f"""
-            SELECT id, valor AS value, hora_medicion AS time
-            FROM {table_name}
-            ORDER BY id DESC
-            LIMIT 1;
-        """
-        cursor.execute(query)
-        row = cursor.fetchone()
-        return normalize_row(row) if row else None
-    except Error as e:
-        print(f"[MySQL Error] {e}")
+        async with db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                snapshot = {}
+                for table_name in SENSOR_TABLES:
+                    query, params = latest_rows_query(table_name)
+                    await cursor.execute(query, params + (1,))
+                    row = await cursor.fetchone()
+                    snapshot[table_name] = normalize_row(row) if row else None
+                try:
+                    await cursor.execute(
+                        f"SELECT {ALERT_COLUMNS} FROM alertas WHERE fin IS NULL "
+                        "ORDER BY inicio DESC LIMIT %s;",
+                        (WS_ALERTS_LIMIT,),
+                    )
+                    snapshot["alertas"] = [normalize_alert(r) for r in await cursor.fetchall()]
+                except aiomysql.ProgrammingError:
+                    # La tabla la crea el listener; todavía no existe
+                    snapshot["alertas"] = []
+                return snapshot
+    except aiomysql.Error as e:
+        DB_ERRORS.labels("snapshot").inc()
+        log.error("MySQL: %s", e)
         return None
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
-
-def get_measurements(table_name: str, limit: int = 200) -> List[dict[str, Any]]:
-    conn = None
-    cursor = None
-    try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-        # Traemos las últimas `limit` mediciones y luego las ordenamos cronológicamente
+        DB_QUERY_SECONDS.labels("snapshot").observe(time.perf_counter() - started)
+
+async def get_measurements(table_name: str, limit: int = 200) -> List[dict[str, Any]]:
+    # Traemos las últimas `limit` mediciones y luego las ordenamos cronológicamente
+    query, params = latest_rows_query(table_name)
+    rows = await fetch_all(query, params + (limit,))
+    normalized = [normalize_row(r) for r in rows]
+    # Las devolvemos ascendente en el tiempo
+    normalized.reverse()
+    return normalized
+
+async def get_measurements_since(
+    table_name: str, since: datetime, limit: int = 200
+) -> List[dict[str, Any]]:
+    """
+    Hasta `limit` mediciones posteriores a `since`, en orden cronológico.
+    """
+    source, time_col, params = series_source(table_name)
+    query = f"""
+        SELECT id, valor AS value, {time_col} AS time
+        FROM {source} AND {time_col} > %s
+        ORDER BY {time_col}, id
+        LIMIT %s;
+    """
+    rows = await fetch_all(query, params + (since, limit))
+    return [normalize_row(r) for r in rows]
+
+async def get_measurements_after_id(
+    table_name: str, since_id: int, limit: int = 200
+) -> List[dict[str, Any]]:
+    """
+    Las lecturas con id > `since_id` (las que el cliente todavía no tiene),
+    a lo más las `limit` más nuevas, en orden de llegada.
+    """
+    if STORAGE_MODE == "narrow":
+        query = """
+            SELECT id, valor AS value, ts AS time
+            FROM mediciones
+            WHERE sensor_type = %s AND id > %s
+            ORDER BY id DESC
+            LIMIT %s;
+        """
+        params = (table_name, since_id, limit)
+    else:
         query = f"""
             SELECT id, valor AS value, hora_medicion AS time
             FROM {table_name}
+            WHERE id > %s
             ORDER BY id DESC
             LIMIT %s;
         """
-        cursor.execute(query, (limit,))
-        rows = cursor.fetchall() or []
-        normalized = [normalize_row(r) for r in rows]
-        # Las devolvemos ascendente en el tiempo
-        normalized.reverse()
-        return normalized
-    except Error as e:
-        print(f"[MySQL Error] {e}")
-        return []
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        params = (since_id, limit)
+    rows = await fetch_all(query, params)
+    normalized = [normalize_row(r) for r in rows]
+    normalized.reverse()
+    return normalized
+
+def series_source(table_name: str) -> tuple[str, str, tuple]:
+    """
+    (FROM ... WHERE <filtro del sensor>, columna de tiempo, parámetros)
+    según el STORAGE_MODE. Se le pueden agregar condiciones con AND.
+    En modo per_table conviene un índice sobre hora_medicion en cada tabla.
+    """
+    if STORAGE_MODE == "narrow":
+        return "mediciones WHERE sensor_type = %s", "ts", (table_name,)
+    return f"{table_name} WHERE 1 = 1", "hora_medicion", ()
+
+def normalize_bucket(row: dict[str, Any]) -> dict[str, Any]:
+    def as_float(v):
+        return float(v) if isinstance(v, Decimal) else v
+
+    time_value = row.get("time")
+    if isinstance(time_value, datetime):
+        time_value = time_value.isoformat()
+
+    return {
+        "time": time_value,
+        "min": as_float(row.get("min")),
+        "max": as_float(row.get("max")),
+        "avg": as_float(row.get("avg")),
+        "count": int(row.get("count") or 0),
+    }
+
+def rollup_level_for(bucket_seconds: int) -> Optional[tuple[str, int]]:
+    """
+    El rollup más grueso cuyas cubetas caben exactas en `bucket_seconds`.
+    """
+    if not ROLLUPS_ENABLED:
+        return None
+    for level, size in ROLLUP_LEVELS:
+        if bucket_seconds >= size and bucket_seconds % size == 0:
+            return level, size
+    return None
+
+def truncate_to_level(t: datetime, level: str) -> datetime:
+    """
+    Inicio de la cubeta del rollup que contiene `t` (misma regla que el listener):
+    así la cubeta parcial del inicio del rango también cuenta.
+    """
+    if level == "1d":
+        return t.replace(hour=0, minute=0, second=0, microsecond=0)
+    if level == "1h":
+        return t.replace(minute=0, second=0, microsecond=0)
+    return t.replace(second=0, microsecond=0)
+
+def ceil_to_level(t: datetime, level: str, size: int) -> datetime:
+    """
+    Inicio de la primera cubeta completa a partir de `t`.
+    """
+    floor = truncate_to_level(t, level)
+    return floor if floor == t else floor + timedelta(seconds=size)
+
+async def rollup_covers(table_name: str, level: str, start: datetime) -> bool:
+    """
+    True si rollup_{level} tiene todas las lecturas crudas desde `start`.
+    Un rollup recién prendido (sin --backfill) empieza en el deploy: para
+    rangos que van más atrás se usan las lecturas crudas en lugar de
+    regresar datos parciales sin avisar.
+    """
+    key = (table_name, level)
+    entry = rollup_coverage.get(key)
+    if entry is None or entry[0] < time.monotonic():
+        source, time_col, params = series_source(table_name)
+        row = await fetch_one(
+            f"""
+            SELECT
+                (SELECT MIN(bucket) FROM rollup_{level} WHERE sensor_type = %s) AS rollup_start,
+                (SELECT MIN({time_col}) FROM {source}) AS raw_start;
+            """,
+            (table_name,) + params,
+        )
+        if row is None:
+            # Falló la consulta (p. ej. no existe la tabla del rollup)
+            return False
+        entry = (time.monotonic() + ROLLUP_COVERAGE_TTL, row["rollup_start"], row["raw_start"])
+        rollup_coverage[key] = entry
+
+    _, rollup_start, raw_start = entry
+    if raw_start is None:
+        # Sin crudas (o ya las borró la retención): el rollup es lo que hay
+        return True
+    if rollup_start is None:
+        return False
+    return rollup_start <= truncate_to_level(max(start, raw_start), level)
+
+def nice_bucket(seconds: int) -> int:
+    """
+    Redondea hacia arriba a un ancho "redondo" (que además sirve para rollups).
+    """
+    for width in NICE_BUCKETS:
+        if seconds <= width:
+            return width
+    return -(-seconds // 86400) * 86400
+
+def bucket_query(
+    table_name: str, start: datetime, end: datetime, bucket_seconds: int, use_rollups: bool = True
+) -> tuple[str, tuple]:
+    rollup = rollup_level_for(bucket_seconds) if use_rollups else None
+    if rollup is None:
+        source, time_col, params = series_source(table_name)
+        query = f"""
+            SELECT
+                FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP({time_col}) / %s) * %s) AS time,
+                MIN(valor) AS min,
+                MAX(valor) AS max,
+                AVG(valor) AS avg,
+                COUNT(*) AS count
+            FROM {source} AND {time_col} >= %s AND {time_col} < %s
+            GROUP BY time
+            ORDER BY time;
+        """
+        return query, (bucket_seconds, bucket_seconds) + params + (start, end)
+
+    level, size = rollup
+    start = truncate_to_level(start, level)
+    if bucket_seconds == size:
+        query = f"""
+            SELECT bucket AS time, min_valor AS min, max_valor AS max,
+                   sum_valor / count_valor AS avg, count_valor AS count
+            FROM rollup_{level}
+            WHERE sensor_type = %s AND bucket >= %s AND bucket < %s
+            ORDER BY bucket;
+        """
+        return query, (table_name, start, end)
+    query = f"""
+        SELECT
+            FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP(bucket) / %s) * %s) AS time,
+            MIN(min_valor) AS min,
+            MAX(max_valor) AS max,
+            SUM(sum_valor) / SUM(count_valor) AS avg,
+            SUM(count_valor) AS count
+        FROM rollup_{level}
+        WHERE sensor_type = %s AND bucket >= %s AND bucket < %s
+        GROUP BY time
+        ORDER BY time;
+    """
+    return query, (bucket_seconds, bucket_seconds, table_name, start, end)
+
+async def get_buckets(
+    table_name: str, start: datetime, end: datetime, bucket_seconds: int
+) -> List[dict[str, Any]]:
+    """
+    min/max/avg/count por cubeta de `bucket_seconds` dentro de [start, end).
+    Si el ancho es múltiplo de 1m/1h/1d (y el rollup cubre el rango) se lee
+    de los rollups en vez de las lecturas crudas.
+    """
+    use_rollups = await bucket_rollups_usable(table_name, start, bucket_seconds)
+    query, params = bucket_query(table_name, start, end, bucket_seconds, use_rollups)
+    return [normalize_bucket(r) for r in await fetch_all(query, params)]
+
+async def bucket_rollups_usable(table_name: str, start: datetime, bucket_seconds: int) -> bool:
+    rollup = rollup_level_for(bucket_seconds)
+    return rollup is not None and await rollup_covers(table_name, rollup[0], start)
+
+def stats_level(start: datetime, end: datetime) -> Optional[tuple[str, int]]:
+    """
+    Entre más largo el rango, más grueso el rollup (menos filas que sumar).
+    """
+    if not ROLLUPS_ENABLED:
+        return None
+    span = (end - start).total_seconds()
+    sizes = dict(ROLLUP_LEVELS)
+    for level, min_span in ROLLUP_STATS_MIN_SPAN:
+        if span >= min_span:
+            return level, sizes[level]
+    return None
+
+def stats_query(
+    table_name: str, start: datetime, end: datetime, rollup: Optional[tuple[str, int]] = None
+) -> tuple[str, tuple]:
+    """
+    Con `rollup`, las cubetas completas dentro de [start, end) salen del
+    rollup y los pedazos de cubeta de cada orilla de las lecturas crudas,
+    así el resultado es exacto y no incluye nada fuera del rango.
+    """
+    source, time_col, params = series_source(table_name)
+    full_start = full_end = None
+    if rollup is not None:
+        level, size = rollup
+        full_start = ceil_to_level(start, level, size)
+        full_end = truncate_to_level(end, level)
+
+    if full_start is None or full_start >= full_end:
+        query = f"""
+            SELECT MIN(valor) AS min, MAX(valor) AS max,
+                   AVG(valor) AS avg, COUNT(*) AS count
+            FROM {source} AND {time_col} >= %s AND {time_col} < %s;
+        """
+        return query, params + (start, end)
+
+    query = f"""
+        SELECT MIN(min) AS min, MAX(max) AS max,
+               SUM(total) / SUM(count) AS avg, SUM(count) AS count
+        FROM (
+            SELECT MIN(min_valor) AS min, MAX(max_valor) AS max,
+                   SUM(sum_valor) AS total, SUM(count_valor) AS count
+            FROM rollup_{level}
+            WHERE sensor_type = %s AND bucket >= %s AND bucket < %s
+            UNION ALL
+            SELECT MIN(valor), MAX(valor), SUM(valor), COUNT(*)
+            FROM {source}
+              AND (({time_col} >= %s AND {time_col} < %s) OR ({time_col} >= %s AND {time_col} < %s))
+        ) AS partes;
+    """
+    return query, (table_name, full_start, full_end) + params + (start, full_start, full_end, end)
+
+async def get_stats(table_name: str, start: datetime, end: datetime) -> dict[str, Any]:
+    """
+    min/max/avg/count de todas las lecturas en [start, end).
+    Rangos largos se calculan sobre los rollups (si lo cubren).
+    """
+    rollup = stats_level(start, end)
+    if rollup is not None and not await rollup_covers(table_name, rollup[0], start):
+        rollup = None
+    query, params = stats_query(table_name, start, end, rollup)
+    row = await fetch_one(query, params) or {"count": 0}
+    row["time"] = start
+    return normalize_bucket(row)
+
+async def get_extremes(table_name: str, start: datetime, end: datetime) -> List[dict[str, Any]]:
+    """
+    Mínimo y máximo de cada cubeta como puntos sueltos (sin id, con la hora
+    de inicio de su cubeta), a lo más LTTB_MAX_ROWS. Conservan los picos y
+    valles de la serie para que LTTB los pueda elegir.
+    """
+    span = (end - start).total_seconds()
+    bucket = nice_bucket(max(-(-int(span) // (LTTB_MAX_ROWS // 2)), 1))
+    use_rollups = await bucket_rollups_usable(table_name, start, bucket)
+    query, params = bucket_query(table_name, start, end, bucket, use_rollups)
+    points = []
+    for row in await fetch_all(query, params):
+        for value in sorted((row["min"], row["max"])):
+            points.append({"id": None, "value": value, "time": row["time"]})
+    return points
+
+async def get_range(
+    table_name: str, start: datetime, end: datetime, max_points: Optional[int] = None
+) -> List[dict[str, Any]]:
+    """
+    Lecturas crudas dentro de [start, end), en orden cronológico.
+    Con `max_points` se reducen con LTTB conservando la forma de la serie;
+    nunca se cargan más de LTTB_MAX_ROWS lecturas (ver get_extremes).
+    """
+    source, time_col, params = series_source(table_name)
+    query = f"""
+        SELECT id, valor AS value, {time_col} AS time
+        FROM {source} AND {time_col} >= %s AND {time_col} < %s
+        ORDER BY {time_col}, id
+        {"LIMIT %s" if max_points else ""};
+    """
+    if max_points:
+        params += (start, end, LTTB_MAX_ROWS + 1)
+    else:
+        params += (start, end)
+    rows = await fetch_all(query, params)
+    if max_points and len(rows) > LTTB_MAX_ROWS:
+        rows = await get_extremes(table_name, start, end)
+    if max_points and len(rows) > max_points:
+        # LTTB necesita x numérica: usamos el datetime antes de normalizar.
+        # Con rangos grandes tarda; se hace fuera del event loop
+        rows = await asyncio.to_thread(
+            lttb,
+            rows,
+            max_points,
+            lambda r: r["time"].timestamp(),
+            lambda r: float(r["value"]),
+        )
+    return [normalize_row(r) for r in rows]
 
 # -------------------------------
 # ENDPOINTS REST PARA HISTÓRICO
 # -------------------------------
 
-@app.get("/temperatura")
-def list_temperatura(limit: int = 200):
-    return get_measurements("temperatura", limit)
+class CachedBody(NamedTuple):
+    """
+    Respuesta ya serializada + validadores HTTP. Se guarda en la caché para no
+    volver a normalizar ni serializar filas que no cambiaron.
+    """
+    body: bytes
+    etag: str
+    last_modified: Optional[datetime]
+
+def dump_json(data: Any) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode()
+
+def make_etag(*parts: bytes) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(part)
+    return f'W/"{digest.hexdigest()}"'
+
+def rows_last_modified(rows: Any) -> Optional[datetime]:
+    """
+    Hora de la lectura más reciente de una lista de filas (para Last-Modified).
+    """
+    if not isinstance(rows, list):
+        return None
+    times = [r.get("time") for r in rows if isinstance(r, dict) and r.get("time")]
+    try:
+        return max(datetime.fromisoformat(t) for t in times) if times else None
+    except ValueError:
+        return None
+
+async def cached_body(key: tuple, loader: Callable[[], Awaitable[Any]]) -> CachedBody:
+    async def build() -> CachedBody:
+        data = await loader()
+        body = dump_json(data)
+        return CachedBody(body, make_etag(body), rows_last_modified(data))
+
+    return await cache.get_or_load(key + ("body",), build)
+
+def to_columnar(rows: List[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "id": [r["id"] for r in rows],
+        "time": [r["time"] for r in rows],
+        "value": [r["value"] for r in rows],
+    }
+
+async def cached_series(
+    sensor: str,
+    limit: int,
+    since: Optional[datetime] = None,
+    since_id: Optional[int] = None,
+    fmt: str = "rows",
+) -> CachedBody:
+    """
+    Una serie de lecturas crudas ya serializada:
+      - since_id: solo lo posterior a ese id (delta sync)
+      - since: solo lo posterior a esa hora
+      - ninguno: las últimas `limit`
+    """
+    if since_id is not None:
+        key = (sensor, "after", since_id, limit)
+        load = lambda: get_measurements_after_id(sensor, since_id, limit)
+    elif since is not None:
+        key = (sensor, "since", since, limit)
+        load = lambda: get_measurements_since(sensor, since, limit)
+    else:
+        key = (sensor, "latest", limit)
+        load = lambda: get_measurements(sensor, limit)
+
+    if fmt == "columnar":
+        async def load_columnar():
+            return to_columnar(await load())
+        return await cached_body(key + (fmt,), load_columnar)
+    return await cached_body(key, load)
+
+def not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+            # HTTP solo tiene segundos; la hora guardada es local sin zona
+            return last_modified.astimezone().replace(microsecond=0) <= since
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def validator_headers(etag: str, last_modified: Optional[datetime]) -> dict[str, str]:
+    # no-cache: el navegador guarda la respuesta pero siempre revalida (304 si no cambió)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(
+            last_modified.astimezone(timezone.utc), usegmt=True
+        )
+    return headers
+
+def cached_response(request: Request, cached: CachedBody) -> Response:
+    headers = validator_headers(cached.etag, cached.last_modified)
+    if not_modified(request, cached.etag, cached.last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached.body, media_type="application/json", headers=headers)
+
+def parse_cursor(cursor: Optional[str]) -> dict[str, int]:
+    """
+    "temperatura:120,humedad:98" -> {"temperatura": 120, "humedad": 98}
+    """
+    result: dict[str, int] = {}
+    if not cursor:
+        return result
+    for part in cursor.split(","):
+        name, sep, last_id = part.strip().partition(":")
+        if not sep or name not in SENSOR_TABLES or not last_id.isdigit():
+            raise ValueError(f"cursor inválido: {part}")
+        result[name] = int(last_id)
+    return result
+
+def check_sensor(sensor: str):
+    if sensor not in SENSOR_TABLES:
+        raise HTTPException(status_code=404, detail=f"Sensor desconocido: {sensor}")
+
+def to_local_naive(t: Optional[datetime]) -> Optional[datetime]:
+    # Las tablas guardan hora local sin zona
+    if t is not None and t.tzinfo is not None:
+        return t.astimezone().replace(tzinfo=None)
+    return t
+
+def resolve_range(start: Optional[datetime], end: Optional[datetime]) -> tuple[datetime, datetime]:
+    start = to_local_naive(start)
+    end = to_local_naive(end)
+    # Por defecto: últimas 24 horas
+    end = end or datetime.now()
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start debe ser menor que end")
+    return start, end
+
+@app.get("/sensors")
+async def list_sensors():
+    """
+    El registro de sensores (unidad y rango válido) para el frontend.
+    """
+    return SENSORS
+
+@app.get("/measurements")
+async def bulk_measurements(
+    request: Request,
+    types: Optional[str] = Query(None, description="sensores separados por coma; vacío = todos"),
+    since: Optional[datetime] = None,
+    cursor: Optional[str] = Query(None, description="último id por sensor: temperatura:120,humedad:98"),
+    limit: int = Query(200, ge=1, le=HISTORY_MAX_POINTS),
+    fmt: str = Query("rows", alias="format", pattern="^(rows|columnar)$"),
+):
+    """
+    Varias series en una sola respuesta, en lugar de una petición por sensor.
+      - sin `since`/`cursor`: las últimas `limit` lecturas de cada sensor
+      - con `cursor`: solo lo posterior al último id que ya tiene el cliente
+      - con `since`: hasta `limit` lecturas posteriores a `since`
+      - format=columnar: {"sensor": {"id": [...], "time": [...], "value": [...]}}
+    Si nada cambió desde el ETag/Last-Modified que manda el cliente, regresa 304.
+    """
+    names = [t.strip() for t in types.split(",") if t.strip()] if types else list(SENSOR_TABLES)
+    for name in names:
+        check_sensor(name)
+    names = list(dict.fromkeys(names))
+    since = to_local_naive(since)
+    try:
+        cursors = parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Todo sale de la caché ya serializado: se junta antes de mandar para
+    # poder calcular un ETag de la respuesta completa
+    series = await asyncio.gather(*[
+        cached_series(name, limit, since=since, since_id=cursors.get(name), fmt=fmt)
+        for name in names
+    ])
+    etag = make_etag(*(s.etag.encode() for s in series))
+    modified = [s.last_modified for s in series if s.last_modified is not None]
+    last_modified = max(modified) if modified else None
+    headers = validator_headers(etag, last_modified)
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    async def body() -> AsyncIterator[bytes]:
+        yield b"{"
+        for i, (name, cached) in enumerate(zip(names, series)):
+            prefix = b"," if i else b""
+            yield prefix + dump_json(name) + b":" + cached.body
+        yield b"}"
+
+    return StreamingResponse(body(), media_type="application/json", headers=headers)
+
+@app.get("/history/{sensor}")
+async def history(
+    request: Request,
+    sensor: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    mode: str = Query("buckets", pattern="^(buckets|lttb)$"),
+    bucket: Optional[int] = Query(None, ge=1, description="segundos por cubeta"),
+    max_points: int = Query(500, ge=3),
+):
+    """
+    Histórico por rango de tiempo sin mandar cada lectura cruda:
+      - mode=buckets: min/max/avg/count por cubeta de `bucket` segundos
+        (si no se da, se elige para no pasar de `max_points` cubetas)
+      - mode=lttb: lecturas reales reducidas a `max_points` con LTTB
+    """
+    check_sensor(sensor)
+    # La llave usa los parámetros tal cual llegaron: "últimas 24 h" (sin start/end)
+    # es la misma llave para todos aunque `now` cambie
+    key = (sensor, "history", mode, start, end, bucket, max_points)
+    start, end = resolve_range(start, end)
+    max_points = min(max_points, HISTORY_MAX_POINTS)
+
+    if mode == "lttb":
+        cached = await cached_body(key, lambda: get_range(sensor, start, end, max_points))
+        return cached_response(request, cached)
+
+    span = (end - start).total_seconds()
+    min_bucket = -(-int(span) // max_points)  # ceil
+    if bucket is None or bucket < min_bucket:
+        bucket = nice_bucket(max(min_bucket, 1))
+    cached = await cached_body(key, lambda: get_buckets(sensor, start, end, bucket))
+    return cached_response(request, cached)
 
-@app.get("/humedad")
-def list_humedad(limit: int = 200):
-    return get_measurements("humedad", limit)
+@app.get("/history/{sensor}/stats")
+async def history_stats(
+    request: Request,
+    sensor: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    """
+    min/max/avg/count de todo el rango (lo que calculaba EstadisticasWidget).
+    """
+    check_sensor(sensor)
+    key = (sensor, "stats", start, end)
+    start, end = resolve_range(start, end)
+    cached = await cached_body(key, lambda: get_stats(sensor, start, end))
+    return cached_response(request, cached)
 
-@app.get("/presion")
-def list_presion(limit: int = 200):
-    return get_measurements("presion", limit)
+@app.get("/alerts")
+async def list_alerts(
+    active: bool = Query(False, description="solo las que siguen abiertas"),
+    sensor: Optional[str] = None,
+    device: Optional[str] = None,
+    since: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+):
+    """
+    Alertas que generó el motor del listener, las más recientes primero.
+    """
+    conditions, params = [], []
+    if active:
+        conditions.append("fin IS NULL")
+    if sensor:
+        check_sensor(sensor)
+        conditions.append("sensor_type = %s")
+        params.append(sensor)
+    if device:
+        conditions.append("device = %s")
+        params.append(device)
+    if since:
+        conditions.append("inicio > %s")
+        params.append(to_local_naive(since))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    rows = await fetch_all(
+        f"SELECT {ALERT_COLUMNS} FROM alertas {where} ORDER BY inicio DESC LIMIT %s;",
+        tuple(params) + (limit,),
+    )
+    return [normalize_alert(r) for r in rows]
 
-@app.get("/luz")
-def list_luz(limit: int = 200):
-    return get_measurements("luz", limit)
+@app.get("/metrics")
+async def metrics():
+    """
+    Métricas en formato Prometheus.
+    """
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
-@app.get("/gas")
-def list_gas(limit: int = 200):
-    return get_measurements("gas", limit)
+if PROFILER_ENABLED:
+    @app.post("/debug/profiler/start")
+    async def profiler_start():
+        profiler.start()
+        log.info("Perfilador encendido")
+        return {"running": True}
+
+    @app.post("/debug/profiler/stop", response_class=PlainTextResponse)
+    async def profiler_stop():
+        """
+        Pilas muestreadas en formato collapsed (flamegraph.pl / speedscope).
+        """
+        # join() del hilo del perfilador: fuera del event loop
+        stacks = await asyncio.to_thread(profiler.stop)
+        log.info("Perfilador apagado")
+        return PlainTextResponse(stacks)
+
+# Va al final: "/{sensor}" atraparía cualquier ruta de un segmento declarada después
+@app.get("/{sensor}")
+async def list_sensor(
+    request: Request,
+    sensor: str,
+    limit: int = Query(200, ge=1, le=HISTORY_MAX_POINTS),
+    since_id: Optional[int] = Query(None, ge=0, description="solo lecturas con id mayor"),
+    since: Optional[datetime] = None,
+):
+    """
+    Últimas `limit` lecturas de un sensor (antes /temperatura, /humedad, ...).
+    Con `since_id` o `since` solo regresa lo nuevo; con ETag/Last-Modified, 304.
+    """
+    check_sensor(sensor)
+    cached = await cached_series(sensor, limit, since=to_local_naive(since), since_id=since_id)
+    return cached_response(request, cached)
 
 # -------------------------------
 # WEBSOCKET TIEMPO REAL
 # -------------------------------
 
+# Último id que vio el hub por sensor, para saber qué entradas de la caché tirar
+_last_seen_ids: dict[str, Any] = {}
+
+async def fetch_latest_snapshot() -> Optional[dict[str, Any]]:
+    snapshot = await get_latest_snapshot()
+    if snapshot is None:
+        return None
+    for table_name in SENSOR_TABLES:
+        row = snapshot[table_name]
+        latest_id = row["id"] if row else None
+        if _last_seen_ids.get(table_name) != latest_id:
+            _last_seen_ids[table_name] = latest_id
+            cache.invalidate(table_name)
+    return snapshot
+
+hub = LatestHub(fetch_latest_snapshot, interval=WS_POLL_INTERVAL, queue_size=WS_QUEUE_SIZE)
+WS_CLIENTS.set_function(lambda: hub.client_count)
+WS_QUEUE_DEPTH.set_function(hub.max_queue_depth)
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    print("[WS] Cliente conectado")
+    # Primero nos suscribimos para no perder nada entre el resume y lo en vivo
+    sub = hub.subscribe()
+    log.info("Cliente /ws conectado (%d activos)", hub.client_count)
 
-    try:
+    async def send_loop():
+        while True:
+            message = await sub.queue.get()
+            await websocket.send_text(message)
+
+    async def receive_loop():
+        # No esperamos mensajes del cliente; solo detectamos que se fue
         while True:
-            payload = {
-                "temperatura": get_latest_measurement("temperatura"),
-                "humedad": get_latest_measurement("humedad"),
-                "presion": get_latest_measurement("presion"),
-                "luz": get_latest_measurement("luz"),
-                "gas": get_latest_measurement("gas"),
-            }
+            await websocket.receive_text()
+
+    async def send_resume():
+        # Reconexión: /ws?cursor=temperatura:120,humedad:98 reenvía lo que el
+        # cliente se perdió, en un mensaje {"resume": {"sensor": [filas...]}}
+        try:
+            cursors = parse_cursor(websocket.query_params.get("cursor"))
+        except ValueError as e:
+            log.warning("Cursor de /ws inválido: %s", e)
+            return
+        if not cursors:
+            return
+        parts = []
+        for name, last_id in cursors.items():
+            cached = await cached_series(name, WS_RESUME_LIMIT, since_id=last_id)
+            parts.append(dump_json(name) + b":" + cached.body)
+        await websocket.send_text((b'{"resume":{' + b",".join(parts) + b"}}").decode())
 
-            await websocket.send_json(payload)
-            await asyncio.sleep(2)  # intervalo de actualización
+    tasks = []
+    try:
+        await send_resume()
+        tasks = [asyncio.create_task(send_loop()), asyncio.create_task(receive_loop())]
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
 
     except WebSocketDisconnect:
-        print("[WS] Cliente desconectado")
+        log.info("Cliente /ws desconectado")
 
     except Exception as e:
-        print(f"[WS] Error inesperado: {e}")
+        log.exception("Error inesperado en /ws: %s", e)
         try:
             await websocket.close()
         except:
-            pass
\ No newline at end of file
+            pass
+
+    finally:
+        for task in tasks:
+            task.cancel()
+        hub.unsubscribe(sub)
+        if sub.dropped:
+            WS_DROPPED.inc(sub.dropped)
+            log.warning("Cliente /ws lento: %d frames descartados", sub.dropped)
@@ -0,0 +1,76 @@
+"""
+Logs, métricas y perfilador del backend. Logs y perfilador vienen de
+comun/observabilidad_comun.py (compartido con el listener); aquí solo van
+las métricas del backend.
+
+- Logs: solo el logger "iot", fuera del event loop. LOG_LEVEL y
+  LOG_FORMAT=text|json, igual que en el listener.
+- Métricas: formato Prometheus en GET /metrics.
+- Perfilador: con PROFILER_ENABLED=1, POST /debug/profiler/start y
+  POST /debug/profiler/stop (regresa las pilas en formato "collapsed").
+"""
+import logging.handlers
+import sys
+from pathlib import Path
+from typing import Callable
+
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily
+
+# Logs y perfilador son los mismos que en el listener: ../comun/
+sys.path.append(str(Path(__file__).resolve().parent.parent / "comun"))
+import observabilidad_comun  # noqa: E402
+from observabilidad_comun import SamplingProfiler  # noqa: E402,F401
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    Solo toca el logger "iot" (uvicorn configura los suyos).
+    """
+    return observabilidad_comun.setup_logging(logger_name="iot")
+
+
+# -------------------------------
+# MÉTRICAS
+# -------------------------------
+
+HTTP_SECONDS = Histogram(
+    "iot_http_request_seconds",
+    "Duración de las peticiones HTTP hasta el inicio de la respuesta",
+    ["handler", "method", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_QUERY_SECONDS = Histogram(
+    "iot_db_query_seconds",
+    "Duración de las consultas a MySQL (incluye esperar conexión del pool)",
+    ["query"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+DB_ERRORS = Counter("iot_db_errors_total", "Consultas a MySQL que fallaron", ["query"])
+
+DB_POOL_SIZE = Gauge("iot_db_pool_connections", "Conexiones abiertas en el pool de aiomysql")
+DB_POOL_FREE = Gauge("iot_db_pool_free_connections", "Conexiones libres en el pool de aiomysql")
+WS_CLIENTS = Gauge("iot_ws_clients", "Clientes conectados a /ws")
+WS_QUEUE_DEPTH = Gauge("iot_ws_send_queue_max_depth", "Frames pendientes en la cola del cliente /ws más atrasado")
+WS_DROPPED = Counter("iot_ws_dropped_frames_total", "Frames descartados por clientes /ws lentos")
+
+
+class CacheCollector:
+    """
+    Expone los contadores que ya lleva ReadCache, sin tocar su camino caliente.
+    """
+
+    def __init__(self, get_counts: Callable[[], tuple[int, int]]):
+        self._get_counts = get_counts
+
+    def collect(self):
+        hits, misses = self._get_counts()
+        family = CounterMetricFamily("iot_read_cache", "Consultas a la caché de lecturas", labels=["result"])
+        family.add_metric(["hit"], hits)
+        family.add_metric(["miss"], misses)
+        yield family
+
+
+def register_cache_collector(get_counts: Callable[[], tuple[int, int]]):
+    REGISTRY.register(CacheCollector(get_counts))
+
@@ -0,0 +1,77 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class ReadCache:
+    """
+    Caché en memoria para lecturas de la BD: TTL corto, tamaño acotado (LRU).
+
+    - Las llaves son tuplas cuyo primer elemento es la tabla/sensor, así
+      `invalidate(tabla)` tira todo lo de ese sensor cuando llega un dato nuevo.
+    - Si varias peticiones piden la misma llave que no está, solo una consulta
+      la BD y las demás esperan ese mismo resultado (single-flight).
+    """
+
+    def __init__(self, ttl: float = 5.0, max_entries: int = 256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple[float, Any]]" = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        # Cambia con cada invalidate(); un resultado que se empezó a cargar
+        # antes de la invalidación ya no se guarda
+        self._generation: dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_or_load(self, key: tuple, loader: Callable[[], Awaitable[Any]]) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires, value = entry
+            if expires > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        # La carga corre en su propia tarea: si el cliente que la pidió se va
+        # (su handler se cancela), los demás que la esperan no se caen con él
+        generation = self._generation.get(key[0], 0)
+        task = asyncio.ensure_future(self._load(key, loader, generation))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._load_done(key, t))
+        return await asyncio.shield(task)
+
+    async def _load(self, key: tuple, loader: Callable[[], Awaitable[Any]], generation: int) -> Any:
+        value = await loader()
+        if self._generation.get(key[0], 0) == generation:
+            self._store(key, value)
+        return value
+
+    def _load_done(self, key: tuple, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Que nadie se quede con "exception was never retrieved" si todos se fueron
+        if not task.cancelled():
+            task.exception()
+
+    def _store(self, key: tuple, value: Any):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, table: Hashable):
+        self._generation[table] = self._generation.get(table, 0) + 1
+        for key in [k for k in self._entries if k[0] == table]:
+            del self._entries[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
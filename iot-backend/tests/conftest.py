@@ -0,0 +1,5 @@
+import os
+import sys
+
+# main.py y compañía son módulos sueltos en iot-backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
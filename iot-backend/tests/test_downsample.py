@@ -0,0 +1,42 @@
+import math
+
+import pytest
+
+from downsample import lttb
+
+
+def series(n):
+    return [{"t": float(i), "v": math.sin(i / 10)} for i in range(n)]
+
+
+def reduce(points, threshold):
+    return lttb(points, threshold, lambda p: p["t"], lambda p: p["v"])
+
+
+def test_keeps_endpoints_and_returns_threshold_points():
+    points = series(1000)
+    sampled = reduce(points, 50)
+    assert len(sampled) == 50
+    assert sampled[0] is points[0]
+    assert sampled[-1] is points[-1]
+
+
+def test_returns_original_points_in_order():
+    points = series(500)
+    sampled = reduce(points, 40)
+    ids = [id(p) for p in points]
+    positions = [ids.index(id(p)) for p in sampled]
+    assert positions == sorted(positions)
+    assert len(set(positions)) == len(positions)
+
+
+@pytest.mark.parametrize("n, threshold", [(10, 10), (10, 20), (0, 5), (10, 2)])
+def test_passes_through_when_nothing_to_reduce(n, threshold):
+    points = series(n)
+    assert reduce(points, threshold) == points
+
+
+def test_keeps_a_spike():
+    points = [{"t": float(i), "v": 0.0} for i in range(1000)]
+    points[537]["v"] = 100.0
+    assert points[537] in reduce(points, 20)
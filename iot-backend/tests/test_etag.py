@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from read_cache import ReadCache
+
+T0 = datetime(2026, 1, 1, 12, 0)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    buckets = [{"time": T0.isoformat(), "min": 1.0, "max": 2.0, "avg": 1.5, "count": 3}]
+
+    async def get_buckets(sensor, start, end, bucket):
+        return buckets
+
+    monkeypatch.setattr(main, "cache", ReadCache())
+    monkeypatch.setattr(main, "get_buckets", get_buckets)
+    # Sin `with`: no corre el lifespan (no hay BD)
+    return TestClient(main.app), buckets
+
+
+def url():
+    return f"/history/temperatura?start={T0.isoformat()}&end={(T0 + timedelta(hours=1)).isoformat()}"
+
+
+def test_if_none_match_returns_304(client):
+    client, _ = client
+    first = client.get(url())
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+
+    again = client.get(url(), headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"] == etag
+
+
+def test_stale_etag_gets_full_body(client):
+    client, buckets = client
+    etag = client.get(url()).headers["etag"]
+
+    buckets[0] = dict(buckets[0], max=9.0)
+    main.cache.invalidate("temperatura")
+    changed = client.get(url(), headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()[0]["max"] == 9.0
+
+
+def test_if_none_match_list_and_wildcard(client):
+    client, _ = client
+    etag = client.get(url()).headers["etag"]
+    assert client.get(url(), headers={"If-None-Match": f'W/"otro", {etag}'}).status_code == 304
+    assert client.get(url(), headers={"If-None-Match": "*"}).status_code == 304
+
+
+def test_if_modified_since(client):
+    client, _ = client
+    last_modified = client.get(url()).headers["last-modified"]
+    assert client.get(url(), headers={"If-Modified-Since": last_modified}).status_code == 304
+    assert client.get(
+        url(), headers={"If-Modified-Since": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    ).status_code == 200
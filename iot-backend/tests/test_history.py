@@ -0,0 +1,58 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import main
+
+T0 = datetime(2026, 1, 1)
+
+
+def rows(n):
+    return [{"id": i, "value": float(i % 7), "time": T0 + timedelta(seconds=i)} for i in range(n)]
+
+
+def test_nice_bucket_rounds_up_to_round_widths():
+    assert main.nice_bucket(1) == 1
+    assert main.nice_bucket(7) == 10
+    assert main.nice_bucket(61) == 120
+    assert main.nice_bucket(4000) == 7200
+    assert main.nice_bucket(86401) == 2 * 86400
+
+
+def test_get_range_reduces_with_lttb(monkeypatch):
+    queries = []
+
+    async def fetch_all(query, params=()):
+        queries.append((query, params))
+        return rows(1000)
+
+    monkeypatch.setattr(main, "fetch_all", fetch_all)
+    result = asyncio.run(main.get_range("temperatura", T0, T0 + timedelta(hours=1), max_points=100))
+    assert len(result) == 100
+    assert result[0]["id"] == 0 and result[-1]["id"] == 999
+    # Nunca se piden más de LTTB_MAX_ROWS + 1 filas
+    assert "LIMIT %s" in queries[0][0]
+    assert queries[0][1][-1] == main.LTTB_MAX_ROWS + 1
+
+
+def test_get_range_over_cap_uses_bucket_extremes(monkeypatch):
+    monkeypatch.setattr(main, "LTTB_MAX_ROWS", 100)
+    monkeypatch.setattr(main, "ROLLUPS_ENABLED", False)
+    queries = []
+
+    async def fetch_all(query, params=()):
+        queries.append(query)
+        if len(queries) == 1:
+            return rows(101)
+        return [
+            {"time": T0 + timedelta(minutes=m), "min": -m, "max": m, "avg": 0, "count": 60}
+            for m in range(40)
+        ]
+
+    monkeypatch.setattr(main, "fetch_all", fetch_all)
+    result = asyncio.run(main.get_range("temperatura", T0, T0 + timedelta(hours=1), max_points=500))
+    assert len(queries) == 2
+    assert "GROUP BY time" in queries[1]
+    # min y max de cada cubeta, sin id
+    assert len(result) == 80
+    assert {r["id"] for r in result} == {None}
+    assert [r["value"] for r in result[2:4]] == [-1, 1]
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+import read_cache
+from read_cache import ReadCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_hit_and_ttl_expiry(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(read_cache.time, "monotonic", lambda: now[0])
+    cache = ReadCache(ttl=5)
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        return len(loads)
+
+    async def scenario():
+        assert await cache.get_or_load(("t", 1), loader) == 1
+        now[0] += 4
+        assert await cache.get_or_load(("t", 1), loader) == 1
+        now[0] += 2
+        assert await cache.get_or_load(("t", 1), loader) == 2
+
+    run(scenario())
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_single_flight_shares_one_load():
+    cache = ReadCache()
+    loads = []
+
+    async def loader():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return "valor"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_load(("t",), loader) for _ in range(5)))
+
+    assert run(scenario()) == ["valor"] * 5
+    assert len(loads) == 1
+
+
+def test_cancelled_first_caller_does_not_fail_other_waiters():
+    cache = ReadCache()
+    release = None
+
+    async def loader():
+        await release.wait()
+        return "valor"
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        first = asyncio.ensure_future(cache.get_or_load(("t",), loader))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_load(("t",), loader))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert run(scenario()) == "valor"
+    # La carga terminó y quedó guardada aunque quien la empezó se fue
+    assert len(cache) == 1
+
+
+def test_loader_error_reaches_every_waiter_and_is_not_cached():
+    cache = ReadCache()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("BD caída")
+
+    async def scenario():
+        return await asyncio.gather(
+            *(cache.get_or_load(("t",), failing) for _ in range(3)), return_exceptions=True
+        )
+
+    results = run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(calls) == 1
+    assert len(cache) == 0
+
+
+def test_invalidate_drops_entries_of_that_table_only():
+    cache = ReadCache()
+
+    async def scenario():
+        await cache.get_or_load(("temperatura", 1), lambda: asyncio.sleep(0, "a"))
+        await cache.get_or_load(("humedad", 1), lambda: asyncio.sleep(0, "b"))
+        cache.invalidate("temperatura")
+
+    run(scenario())
+    assert len(cache) == 1
+
+
+def test_load_started_before_invalidate_is_not_stored():
+    cache = ReadCache()
+    release = None
+
+    async def stale():
+        await release.wait()
+        return "viejo"
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        pending = asyncio.ensure_future(cache.get_or_load(("t",), stale))
+        await asyncio.sleep(0)
+        cache.invalidate("t")
+        release.set()
+        # El que ya esperaba recibe su valor, pero no se guarda
+        assert await pending == "viejo"
+        return await cache.get_or_load(("t",), lambda: asyncio.sleep(0, "nuevo"))
+
+    assert run(scenario()) == "nuevo"
+
+
+def test_lru_bound():
+    cache = ReadCache(max_entries=2)
+
+    async def scenario():
+        for i in range(3):
+            await cache.get_or_load(("t", i), lambda: asyncio.sleep(0, i))
+
+    run(scenario())
+    assert len(cache) == 2
@@ -0,0 +1,123 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+import main
+
+T0 = datetime(2026, 1, 1, 0, 0, 0)
+
+
+@pytest.fixture
+def coverage(monkeypatch):
+    """
+    Simula la consulta de rollup_covers: {nivel: (primera cubeta, primera cruda)}.
+    """
+    answers = {}
+    calls = []
+
+    async def fetch_one(query, params=()):
+        level = next(level for level, _ in main.ROLLUP_LEVELS if f"rollup_{level} " in query)
+        calls.append(level)
+        rollup_start, raw_start = answers[level]
+        return {"rollup_start": rollup_start, "raw_start": raw_start}
+
+    monkeypatch.setattr(main, "fetch_one", fetch_one)
+    monkeypatch.setattr(main, "rollup_coverage", {})
+    monkeypatch.setattr(main, "ROLLUPS_ENABLED", True)
+    return answers, calls
+
+
+def covers(level, start):
+    return asyncio.run(main.rollup_covers("temperatura", level, start))
+
+
+def test_rollup_without_backfill_does_not_cover_older_range(coverage):
+    answers, _ = coverage
+    # Crudas desde el 1 de enero, rollup prendido el 10
+    answers["1h"] = (datetime(2026, 1, 10), T0)
+    assert not covers("1h", datetime(2026, 1, 5))
+    assert covers("1h", datetime(2026, 1, 10, 0, 30))
+
+
+def test_backfilled_rollup_covers_everything(coverage):
+    answers, _ = coverage
+    answers["1d"] = (T0, datetime(2026, 1, 1, 8, 15))
+    assert covers("1d", datetime(2025, 6, 1))
+
+
+def test_rollup_covers_when_raw_rows_are_gone(coverage):
+    answers, _ = coverage
+    answers["1d"] = (T0, None)
+    assert covers("1d", datetime(2025, 6, 1))
+    answers["1m"] = (None, T0)
+    assert not covers("1m", datetime(2026, 2, 1))
+
+
+def test_coverage_is_cached_per_level(coverage):
+    answers, calls = coverage
+    answers["1h"] = (T0, T0)
+    for _ in range(3):
+        covers("1h", datetime(2026, 2, 1))
+    assert calls == ["1h"]
+
+
+def test_bucket_width_picks_coarsest_exact_rollup(monkeypatch):
+    monkeypatch.setattr(main, "ROLLUPS_ENABLED", True)
+    assert main.rollup_level_for(30) is None
+    assert main.rollup_level_for(60) == ("1m", 60)
+    assert main.rollup_level_for(900) == ("1m", 60)
+    assert main.rollup_level_for(7200) == ("1h", 3600)
+    assert main.rollup_level_for(86400 * 7) == ("1d", 86400)
+    assert main.rollup_level_for(90) is None
+
+
+def test_bucket_query_uses_rollup_only_when_allowed(monkeypatch):
+    monkeypatch.setattr(main, "ROLLUPS_ENABLED", True)
+    end = datetime(2026, 1, 2)
+    query, _ = main.bucket_query("temperatura", T0, end, 3600)
+    assert "FROM rollup_1h" in query
+    query, _ = main.bucket_query("temperatura", T0, end, 3600, use_rollups=False)
+    assert "rollup_" not in query
+    query, _ = main.bucket_query("temperatura", T0, end, 45)
+    assert "rollup_" not in query
+
+
+def test_get_buckets_falls_back_to_raw_rows(coverage, monkeypatch):
+    answers, _ = coverage
+    answers["1h"] = (datetime(2026, 1, 10), T0)
+    queries = []
+
+    async def fetch_all(query, params=()):
+        queries.append(query)
+        return []
+
+    monkeypatch.setattr(main, "fetch_all", fetch_all)
+    asyncio.run(main.get_buckets("temperatura", datetime(2026, 1, 5), datetime(2026, 1, 12), 3600))
+    asyncio.run(main.get_buckets("temperatura", datetime(2026, 1, 10), datetime(2026, 1, 12), 3600))
+    assert "rollup_" not in queries[0]
+    assert "FROM rollup_1h" in queries[1]
+
+
+def test_stats_query_reads_edges_from_raw_rows():
+    start = datetime(2026, 1, 1, 10, 30)
+    end = datetime(2026, 1, 5, 14, 45)
+    query, params = main.stats_query("temperatura", start, end, ("1h", 3600))
+    assert "FROM rollup_1h" in query
+    full_start, full_end = datetime(2026, 1, 1, 11), datetime(2026, 1, 5, 14)
+    assert params[:3] == ("temperatura", full_start, full_end)
+    # Pedazos de cubeta de cada orilla: [start, 11:00) y [14:00, end)
+    assert params[-4:] == (start, full_start, full_end, end)
+
+
+def test_stats_query_aligned_range_has_empty_edges():
+    start, end = datetime(2026, 1, 1), datetime(2026, 3, 1)
+    _, params = main.stats_query("temperatura", start, end, ("1d", 86400))
+    assert params[1:3] == (start, end)
+    assert params[-4:] == (start, start, end, end)
+
+
+def test_stats_query_without_rollup_is_raw():
+    query, params = main.stats_query("temperatura", T0, datetime(2026, 1, 2))
+    assert "rollup_" not in query
+    assert params[-2:] == (T0, datetime(2026, 1, 2))
@@ -0,0 +1,463 @@
+"""
+Motor de alertas del lado del servidor (antes cada navegador revisaba los
+umbrales sobre sus 200 lecturas en alertas/page.tsx).
+
+Las reglas salen del bloque "alertas" de cada sensor en sensores.json:
+    "alertas": {
+        "warning_high": 28, "danger_high": 32,   # umbrales (cualquiera es opcional)
+        "warning_low": 18, "danger_low": 15,
+        "histeresis": 0.5,                       # margen para regresar de nivel
+        "sostenido_s": 10,                       # segundos fuera de rango antes de avisar
+        "cambio_max": 5, "ventana_s": 300        # cambio brusco dentro de la ventana
+    }
+
+Se evalúa cada lectura al llegar, con estado por (device, sensor) y costo
+O(1) (O(1) amortizado para la ventana de cambio). Solo se generan eventos
+en las transiciones: al abrir una alerta y al resolverla; no una fila por
+lectura fuera de rango.
+
+Con INGEST_WORKERS > 1 la suscripción compartida reparte los mensajes de
+un mismo dispositivo entre varios workers; si cada uno evaluara con su
+propio estado, abrirían copias de la misma alerta y el primero en ver un
+valor normal las cerraría todas. Por eso ahí los workers no evalúan: un
+AlertForwarder junta sus lecturas y las manda en lotes al supervisor,
+donde un solo AlertEvaluator (un solo AlertEngine) lleva el estado.
+"""
+import logging
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, NamedTuple, Optional
+
+from mysql.connector import Error, pooling
+
+log = logging.getLogger("iot.alertas")
+
+OK = "ok"
+WARNING = "warning"
+DANGER = "danger"
+SEVERITY_RANK = {OK: 0, WARNING: 1, DANGER: 2}
+
+RULE_THRESHOLD = "umbral"
+RULE_RATE = "cambio"
+
+# El cambio brusco se da por resuelto cuando baja de este % de `cambio_max`
+RATE_CLEAR_RATIO = 0.8
+
+ALERTAS_DDL = """
+    CREATE TABLE IF NOT EXISTS alertas (
+        id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        device VARCHAR(64) NOT NULL,
+        sensor_type VARCHAR(32) NOT NULL,
+        regla VARCHAR(16) NOT NULL,
+        severidad VARCHAR(16) NOT NULL,
+        mensaje VARCHAR(255) NOT NULL,
+        valor DOUBLE NOT NULL,
+        inicio DATETIME(3) NOT NULL,
+        fin DATETIME(3) NULL,
+        KEY idx_alertas_abiertas (fin, inicio),
+        KEY idx_alertas_sensor (sensor_type, inicio)
+    ) ENGINE=InnoDB;
+"""
+
+
+def create_alerts_table(cursor, close_stale: bool = False):
+    """
+    Con `close_stale`, cierra las alertas que quedaron abiertas de una
+    corrida anterior (el estado del motor arranca en "ok").
+    """
+    cursor.execute(ALERTAS_DDL)
+    if close_stale:
+        cursor.execute("UPDATE alertas SET fin = NOW(3) WHERE fin IS NULL")
+
+
+class AlertEvent(NamedTuple):
+    device: str
+    sensor_type: str
+    rule: str
+    severity: str
+    message: str
+    value: float
+    at: datetime
+    resolved: bool
+
+
+class SlidingExtremes:
+    """
+    Mínimo y máximo de los últimos `window` segundos con dos colas
+    monótonas: cada valor entra y sale una sola vez.
+    """
+
+    __slots__ = ("window", "_min", "_max")
+
+    def __init__(self, window: float):
+        self.window = window
+        self._min: deque = deque()
+        self._max: deque = deque()
+
+    def push(self, t: float, value: float):
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((t, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((t, value))
+
+        cutoff = t - self.window
+        while self._min[0][0] < cutoff:
+            self._min.popleft()
+        while self._max[0][0] < cutoff:
+            self._max.popleft()
+
+    @property
+    def min(self) -> float:
+        return self._min[0][1]
+
+    @property
+    def max(self) -> float:
+        return self._max[0][1]
+
+
+class SeriesState:
+    __slots__ = (
+        "level", "level_message", "level_high", "high", "warning_since", "danger_since",
+        "last_t", "window", "rate_active",
+    )
+
+    def __init__(self, rules: dict[str, Any]):
+        self.level = OK
+        self.level_message = ""
+        # Lado de la alerta abierta y lado de la excursión que se está
+        # cronometrando (True = por arriba)
+        self.level_high = False
+        self.high = False
+        # Desde cuándo la lectura está sin interrupción en warning o peor /
+        # en danger (None = ahora no lo está)
+        self.warning_since: Optional[float] = None
+        self.danger_since: Optional[float] = None
+        self.last_t = 0.0
+        self.window = SlidingExtremes(rules["ventana_s"]) if rules.get("cambio_max") else None
+        self.rate_active = False
+
+
+def threshold_level(
+    rules: dict[str, Any], value: float, margin: float = 0.0, side: Optional[bool] = None
+) -> tuple[str, bool]:
+    """
+    (nivel, True si es por arriba) de la lectura contra los umbrales; con
+    `margin` los umbrales se recorren hacia el rango normal (para la
+    histéresis), solo del lado `side` si se da (True = arriba).
+    """
+    danger_high = rules.get("danger_high")
+    warning_high = rules.get("warning_high")
+    danger_low = rules.get("danger_low")
+    warning_low = rules.get("warning_low")
+    high_margin = margin if side is not False else 0.0
+    low_margin = margin if side is not True else 0.0
+
+    if danger_high is not None and value >= danger_high - high_margin:
+        return DANGER, True
+    if warning_high is not None and value >= warning_high - high_margin:
+        return WARNING, True
+    if danger_low is not None and value <= danger_low + low_margin:
+        return DANGER, False
+    if warning_low is not None and value <= warning_low + low_margin:
+        return WARNING, False
+    return OK, False
+
+
+def threshold_message(sensor_type: str, severity: str, high: bool) -> str:
+    if severity == OK:
+        return ""
+    if severity == DANGER:
+        return f"{sensor_type.capitalize()} muy {'alta' if high else 'baja'}"
+    return f"{sensor_type.capitalize()} {'elevada' if high else 'fuera de rango'}"
+
+
+def classify(sensor_type: str, rules: dict[str, Any], value: float, margin: float = 0.0) -> tuple[str, str]:
+    severity, high = threshold_level(rules, value, margin)
+    return severity, threshold_message(sensor_type, severity, high)
+
+
+class AlertEngine:
+    def __init__(self, sensors: dict[str, dict[str, Any]]):
+        self._rules = {
+            name: cfg["alertas"] for name, cfg in sensors.items() if cfg.get("alertas")
+        }
+        self._state: dict[tuple[str, str], SeriesState] = {}
+
+    def evaluate(
+        self, sensor_type: str, value: float, measured_at: datetime, device: str
+    ) -> list[AlertEvent]:
+        rules = self._rules.get(sensor_type)
+        if rules is None:
+            return []
+
+        key = (device, sensor_type)
+        state = self._state.get(key)
+        if state is None:
+            state = self._state[key] = SeriesState(rules)
+
+        # Lecturas fuera de orden no hacen retroceder el reloj de la serie
+        t = max(measured_at.timestamp(), state.last_t)
+        state.last_t = t
+
+        events: list[AlertEvent] = []
+        self._check_threshold(sensor_type, rules, state, value, t, measured_at, device, events)
+        if state.window is not None:
+            self._check_rate(sensor_type, rules, state, value, t, measured_at, device, events)
+        return events
+
+    def _check_threshold(self, sensor_type, rules, state, value, t, measured_at, device, events):
+        severity, high = threshold_level(rules, value)
+        rank = SEVERITY_RANK[severity]
+        if rank and high != state.high:
+            # Cruzó al otro lado (de alta a baja o al revés): lo sostenido
+            # del lado anterior no cuenta para este
+            state.warning_since = state.danger_since = None
+            state.high = high
+        # Se cuenta cuánto lleva en cada nivel "o peor", no en un mismo
+        # (nivel, mensaje): 29 -> 33 -> 29 sigue siendo warning sostenido
+        if rank < SEVERITY_RANK[WARNING]:
+            state.warning_since = None
+        elif state.warning_since is None:
+            state.warning_since = t
+        if rank < SEVERITY_RANK[DANGER]:
+            state.danger_since = None
+        elif state.danger_since is None:
+            state.danger_since = t
+
+        if state.level != OK and rank and high != state.level_high:
+            # La alerta abierta es del otro lado: se cierra, y la de este
+            # lado tiene que sostenerse como cualquier otra
+            new = (OK, "")
+        elif rank > SEVERITY_RANK[state.level]:
+            # Sube de nivel: al más alto que ya se sostuvo `sostenido_s`
+            hold = rules.get("sostenido_s", 0)
+            if state.danger_since is not None and t - state.danger_since >= hold:
+                target = DANGER
+            elif t - state.warning_since >= hold:
+                target = WARNING
+            else:
+                return
+            if SEVERITY_RANK[target] <= SEVERITY_RANK[state.level]:
+                return
+            new = (target, threshold_message(sensor_type, target, high))
+        else:
+            # Baja (o se queda): con histéresis, para no parpadear en el
+            # umbral. Solo del lado de la alerta abierta: del otro lado la
+            # histéresis convertiría un valor normal en alerta
+            side = state.level_high if state.level != OK else None
+            sticky, _ = threshold_level(rules, value, rules.get("histeresis", 0), side)
+            if SEVERITY_RANK[sticky] <= SEVERITY_RANK[state.level]:
+                severity = sticky
+            high = state.level_high
+            new = (severity, threshold_message(sensor_type, severity, high))
+
+        if new == (state.level, state.level_message):
+            return
+        if state.level != OK:
+            events.append(AlertEvent(
+                device, sensor_type, RULE_THRESHOLD, state.level, state.level_message,
+                value, measured_at, True,
+            ))
+        state.level, state.level_message = new
+        state.level_high = high
+        if state.level != OK:
+            events.append(AlertEvent(
+                device, sensor_type, RULE_THRESHOLD, state.level, state.level_message,
+                value, measured_at, False,
+            ))
+
+    def _check_rate(self, sensor_type, rules, state, value, t, measured_at, device, events):
+        state.window.push(t, value)
+        delta = max(value - state.window.min, state.window.max - value)
+        limit = rules["cambio_max"]
+
+        if not state.rate_active and delta > limit:
+            state.rate_active = True
+            events.append(AlertEvent(
+                device, sensor_type, RULE_RATE, WARNING,
+                f"{sensor_type.capitalize()} cambio brusco ({delta:g} en {rules['ventana_s']}s)",
+                value, measured_at, False,
+            ))
+        elif state.rate_active and delta <= limit * RATE_CLEAR_RATIO:
+            state.rate_active = False
+            events.append(AlertEvent(
+                device, sensor_type, RULE_RATE, WARNING, f"{sensor_type.capitalize()} cambio brusco",
+                value, measured_at, True,
+            ))
+
+
+class AlertWriter:
+    """
+    Guarda los eventos en la tabla `alertas` desde su propio hilo, para no
+    tocar MySQL desde el hilo de paho. Son pocos (solo transiciones).
+    Se conecta de forma perezosa: el listener arranca aunque MySQL esté caído.
+    """
+
+    def __init__(self, db_config: dict[str, Any], close_stale: bool = False, queue_size: int = 1000):
+        self.close_stale = close_stale
+        self._db_config = db_config
+        self._pool = None
+        self._queue: "queue.Queue[Optional[AlertEvent]]" = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="alert-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, events: list[AlertEvent]):
+        for event in events:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                log.warning("Cola llena, evento descartado: %s", event.message)
+
+    def close(self, timeout: float = 5.0):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _connect(self):
+        if self._pool is None:
+            pool = pooling.MySQLConnectionPool(
+                pool_name="iot_alerts", pool_size=1, use_pure=True, **self._db_config
+            )
+            conn = pool.get_connection()
+            try:
+                cursor = conn.cursor()
+                create_alerts_table(cursor, self.close_stale)
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+            self._pool = pool
+        return self._pool.get_connection()
+
+    def _run(self):
+        try:
+            self._connect().close()
+        except Error as e:
+            log.warning("MySQL no disponible todavía: %s", e)
+
+        while True:
+            event = self._queue.get()
+            if event is None:
+                return
+            conn = None
+            try:
+                conn = self._connect()
+                cursor = conn.cursor()
+                if event.resolved:
+                    cursor.execute(
+                        "UPDATE alertas SET fin = %s "
+                        "WHERE fin IS NULL AND device = %s AND sensor_type = %s AND regla = %s",
+                        (event.at, event.device, event.sensor_type, event.rule),
+                    )
+                else:
+                    cursor.execute(
+                        "INSERT INTO alertas (device, sensor_type, regla, severidad, mensaje, valor, inicio) "
+                        "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                        (
+                            event.device, event.sensor_type, event.rule, event.severity,
+                            event.message, event.value, event.at,
+                        ),
+                    )
+                conn.commit()
+                cursor.close()
+            except Error as e:
+                log.error("No se pudo guardar el evento (%s): %s", event.message, e)
+            finally:
+                if conn:
+                    conn.close()
+
+
+class AlertForwarder:
+    """
+    Lado worker (INGEST_WORKERS > 1): junta las lecturas de los sensores con
+    reglas y cada `flush_interval` las manda en un solo lote a la
+    multiprocessing.Queue del supervisor. Nunca bloquea al hilo de paho: si
+    el supervisor no alcanza a leer, se descartan (y se cuentan).
+    """
+
+    def __init__(
+        self,
+        out_queue,
+        sensors: dict[str, dict[str, Any]],
+        flush_interval: float = 0.1,
+        max_pending: int = 10000,
+    ):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._queue = out_queue
+        self._sensor_types = frozenset(name for name, cfg in sensors.items() if cfg.get("alertas"))
+        self._pending: list[tuple[str, float, float, str]] = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="alert-forwarder", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, sensor_type: str, value: float, measured_at: datetime, device: str):
+        if sensor_type not in self._sensor_types:
+            return
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append((sensor_type, value, measured_at.timestamp(), device))
+
+    def close(self, timeout: float = 5.0):
+        self._stop.set()
+        self._thread.join(timeout)
+        self._flush()
+
+    def _flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            self._queue.put_nowait(batch)
+        except queue.Full:
+            self.dropped += len(batch)
+            log.warning("Cola de alertas del supervisor llena, %d lecturas sin evaluar", len(batch))
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self._flush()
+
+
+class AlertEvaluator:
+    """
+    Lado supervisor: evalúa con un solo AlertEngine los lotes que mandan
+    los AlertForwarder de todos los workers.
+    """
+
+    def __init__(self, engine: AlertEngine, in_queue, on_events: Callable[[list[AlertEvent]], None]):
+        self._engine = engine
+        self._queue = in_queue
+        self._on_events = on_events
+        self._thread = threading.Thread(target=self._run, name="alert-evaluator", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self, timeout: float = 5.0):
+        """
+        Llamar cuando los workers ya terminaron (y mandaron su último lote).
+        """
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            for sensor_type, value, epoch, device in batch:
+                events = self._engine.evaluate(sensor_type, value, datetime.fromtimestamp(epoch), device)
+                if events:
+                    self._on_events(events)
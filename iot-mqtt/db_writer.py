@@ -0,0 +1,306 @@
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Optional
+
+from mysql.connector import Error, PoolError, pooling
+
+from observabilidad import DB_CONNECTIONS_IN_USE, DB_ROWS, DB_WRITE_SECONDS
+from rollups import create_rollup_tables, upsert_rollups
+
+log = logging.getLogger("iot.db_writer")
+
+STORAGE_PER_TABLE = "per_table"
+STORAGE_NARROW = "narrow"
+STORAGE_MODES = {STORAGE_PER_TABLE, STORAGE_NARROW}
+
+
+def write_rows(cursor, storage_mode: str, pending: dict[str, list[tuple]], rollups: bool = True):
+    """
+    Inserta un lote ya agrupado por tabla: {sensor_type: [(valor, measured_at, device, unit), ...]}.
+    No hace commit; si algo falla la excepción sube y el que llama decide
+    (el BatchWriter descarta el lote, el drenador del spool lo reintenta).
+    """
+    # El conector reescribe cada executemany a un solo INSERT multi-fila
+    if storage_mode == STORAGE_NARROW:
+        cursor.executemany(
+            "INSERT INTO mediciones (device, sensor_type, ts, valor, unit) "
+            "VALUES (%s, %s, %s, %s, %s)",
+            [
+                (device, table, measured_at, value, unit)
+                for table, values in pending.items()
+                for value, measured_at, device, unit in values
+            ],
+        )
+    else:
+        for table, values in pending.items():
+            cursor.executemany(
+                f"INSERT INTO {table} (valor, hora_medicion) VALUES (%s, %s)",
+                [(value, measured_at) for value, measured_at, _, _ in values],
+            )
+    if rollups:
+        upsert_rollups(
+            cursor,
+            (
+                (table, value, measured_at)
+                for table, values in pending.items()
+                for value, measured_at, _, _ in values
+            ),
+        )
+
+
+class WriterStats:
+    """
+    Contadores del escritor (los lee el listener para reportar).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.dropped = 0
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.batches = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.flush_ms_total = 0.0
+        self.flush_ms_max = 0.0
+
+    def record_submit(self, accepted: bool):
+        with self._lock:
+            if accepted:
+                self.submitted += 1
+            else:
+                self.dropped += 1
+
+    def record_flush(self, rows: int, elapsed_ms: float, ok: bool):
+        with self._lock:
+            self.batches += 1
+            self.last_batch_size = rows
+            self.max_batch_size = max(self.max_batch_size, rows)
+            self.flush_ms_total += elapsed_ms
+            self.flush_ms_max = max(self.flush_ms_max, elapsed_ms)
+            if ok:
+                self.rows_written += rows
+            else:
+                self.rows_failed += rows
+
+    def snapshot(self) -> dict[str, Any]:
+        with self._lock:
+            avg_batch = self.rows_written / self.batches if self.batches else 0.0
+            avg_flush = self.flush_ms_total / self.batches if self.batches else 0.0
+            return {
+                "submitted": self.submitted,
+                "dropped": self.dropped,
+                "rows_written": self.rows_written,
+                "rows_failed": self.rows_failed,
+                "batches": self.batches,
+                "last_batch_size": self.last_batch_size,
+                "max_batch_size": self.max_batch_size,
+                "avg_batch_size": round(avg_batch, 1),
+                "avg_flush_ms": round(avg_flush, 2),
+                "max_flush_ms": round(self.flush_ms_max, 2),
+            }
+
+
+class BatchWriter:
+    """
+    Etapa de escritura a MySQL desacoplada del hilo de red de paho.
+
+    on_message solo encola la lectura; uno o más hilos sacan de la cola,
+    agrupan por tabla y hacen un `executemany` por tabla cuando se junta
+    `batch_size` filas o pasa `flush_interval` segundos.
+    La cola es acotada: si se llena, `submit` bloquea hasta `put_timeout`
+    (backpressure hacia el broker) y después descarta la lectura.
+
+    storage_mode:
+      - "per_table": una tabla por tipo de sensor (valor, hora_medicion)
+      - "narrow": todo va a la tabla `mediciones` (device, sensor_type, ts, ...)
+
+    Con `rollups=True` cada lote también actualiza rollup_1m/1h/1d
+    (ver rollups.py) en la misma transacción.
+
+    El pool se crea de forma perezosa desde los hilos de escritura: el
+    listener arranca aunque MySQL esté caído. Mientras no haya conexión los
+    lotes se descartan (como cualquier lote que falla) y el pool se vuelve
+    a intentar con backoff hasta `max_backoff`.
+    """
+
+    def __init__(
+        self,
+        db_config: dict[str, Any],
+        storage_mode: str = STORAGE_PER_TABLE,
+        pool_size: int = 2,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        queue_size: int = 10000,
+        put_timeout: float = 0.5,
+        rollups: bool = True,
+        max_backoff: float = 30.0,
+    ):
+        if storage_mode not in STORAGE_MODES:
+            raise ValueError(f"STORAGE_MODE inválido: {storage_mode}")
+        self.storage_mode = storage_mode
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.rollups = rollups
+        self.max_backoff = max_backoff
+        self.stats = WriterStats()
+
+        self._queue: "queue.Queue[tuple]" = queue.Queue(maxsize=queue_size)
+        self._db_config = db_config
+        self._pool_size = pool_size
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._retry_at = 0.0
+        self._backoff = flush_interval
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._run, name=f"db-writer-{i}", daemon=True)
+            for i in range(pool_size)
+        ]
+
+    # -------------------------------
+    # API PÚBLICA
+    # -------------------------------
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+
+    def submit(
+        self,
+        sensor_type: str,
+        value: float,
+        measured_at: Optional[datetime] = None,
+        device: str = "default",
+        unit: Optional[str] = None,
+    ) -> bool:
+        """
+        Encola una lectura. Regresa False si se descartó por cola llena.
+        `measured_at` es la hora del dispositivo; si no viene se usa la del servidor.
+        """
+        item = (sensor_type, value, measured_at or datetime.now(), device, unit)
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+            self.stats.record_submit(True)
+            return True
+        except queue.Full:
+            self.stats.record_submit(False)
+            return False
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def close(self, timeout: float = 10.0):
+        """
+        Deja de aceptar trabajo, vacía lo pendiente y espera a los hilos.
+        """
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+    # -------------------------------
+    # CONEXIÓN
+    # -------------------------------
+
+    def _create_pool(self):
+        pool = pooling.MySQLConnectionPool(
+            pool_name="iot_ingest",
+            pool_size=self._pool_size,
+            use_pure=True,
+            **self._db_config,
+        )
+        if self.rollups:
+            conn = pool.get_connection()
+            try:
+                cursor = conn.cursor()
+                create_rollup_tables(cursor)
+                conn.commit()
+                cursor.close()
+            finally:
+                conn.close()
+        return pool
+
+    def _get_connection(self):
+        with self._pool_lock:
+            if self._pool is None:
+                now = time.monotonic()
+                if now < self._retry_at:
+                    raise PoolError(msg=f"MySQL no disponible, reintento en {self._retry_at - now:.1f}s")
+                try:
+                    self._pool = self._create_pool()
+                except Error as e:
+                    self._retry_at = now + self._backoff
+                    log.warning("MySQL no disponible, reintento en %.1fs: %s", self._backoff, e)
+                    self._backoff = min(self._backoff * 2, self.max_backoff)
+                    raise
+                self._backoff = self.flush_interval
+        return self._pool.get_connection()
+
+    # -------------------------------
+    # HILOS DE ESCRITURA
+    # -------------------------------
+
+    def _run(self):
+        pending: dict[str, list[tuple]] = defaultdict(list)
+        pending_rows = 0
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            stopping = self._stop.is_set()
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                sensor_type, *row = self._queue.get(timeout=0 if stopping else timeout)
+                pending[sensor_type].append(tuple(row))
+                pending_rows += 1
+            except queue.Empty:
+                if stopping:
+                    # Cola vacía y nos pidieron parar: último flush y salimos
+                    if pending_rows:
+                        self._flush(pending)
+                    return
+
+            if pending_rows >= self.batch_size or time.monotonic() >= deadline:
+                if pending_rows:
+                    self._flush(pending)
+                    pending = defaultdict(list)
+                    pending_rows = 0
+                deadline = time.monotonic() + self.flush_interval
+
+    def _flush(self, pending: dict[str, list[tuple]]):
+        conn = None
+        cursor = None
+        rows = sum(len(v) for v in pending.values())
+        started = time.perf_counter()
+        ok = False
+        try:
+            conn = self._get_connection()
+            DB_CONNECTIONS_IN_USE.labels("writer").inc()
+            cursor = conn.cursor()
+            write_rows(cursor, self.storage_mode, pending, self.rollups)
+            conn.commit()
+            ok = True
+        except Error as e:
+            log.error("Lote de %d filas descartado: %s", rows, e)
+            if conn:
+                try:
+                    conn.rollback()
+                except Error:
+                    pass
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                # Con pool, close() regresa la conexión al pool
+                conn.close()
+                DB_CONNECTIONS_IN_USE.labels("writer").dec()
+            elapsed = time.perf_counter() - started
+            self.stats.record_flush(rows, elapsed * 1000, ok)
+            DB_WRITE_SECONDS.labels("writer").observe(elapsed)
+            DB_ROWS.labels("writer", "ok" if ok else "failed").inc(rows)
@@ -0,0 +1,70 @@
+"""
+Formato binario compacto para mensajes dispositivo -> listener, alterno al
+JSON de siempre. Un mensaje puede llevar varias lecturas.
+
+Versión 1 (little-endian):
+    cabecera  <BBHQ   magic 0xA5, versión, número de lecturas, ts base en ms
+                      (epoch; 0 si el dispositivo no tiene reloj)
+              B + N   largo y bytes UTF-8 del device id
+    lecturas  <BIf    id de sensor (ver "id" en sensores.json),
+                      ms desde el ts base, valor float32
+
+9 bytes por lectura contra ~70 del JSON. El primer byte distingue el
+formato: un JSON siempre empieza con "{" o espacio, nunca con 0xA5.
+"""
+import struct
+from typing import Iterable, Iterator
+
+MAGIC = 0xA5
+VERSION = 1
+HEADER = struct.Struct("<BBHQ")
+RECORD = struct.Struct("<BIf")
+
+
+class BinaryFormatError(ValueError):
+    pass
+
+
+def is_binary(payload: bytes) -> bool:
+    return len(payload) > 0 and payload[0] == MAGIC
+
+
+def encode(device: str, readings: Iterable[tuple[int, int, float]], base_ts_ms: int = 0) -> bytes:
+    """
+    `readings`: (id de sensor, ms desde `base_ts_ms`, valor).
+    """
+    readings = list(readings)
+    device_bytes = device.encode()
+    parts = [
+        HEADER.pack(MAGIC, VERSION, len(readings), base_ts_ms),
+        bytes((len(device_bytes),)),
+        device_bytes,
+    ]
+    parts.extend(RECORD.pack(*r) for r in readings)
+    return b"".join(parts)
+
+
+def decode(payload: bytes) -> tuple[str, int, Iterator[tuple[int, int, float]]]:
+    """
+    Regresa (device, ts base en ms, iterador de (id, offset ms, valor)).
+    Todas las lecturas se desempacan de una vez con `iter_unpack`, sin
+    copiar el buffer.
+    """
+    if len(payload) < HEADER.size + 1:
+        raise BinaryFormatError("mensaje binario demasiado corto")
+    magic, version, count, base_ts_ms = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise BinaryFormatError("no es un mensaje binario")
+    if version != VERSION:
+        raise BinaryFormatError(f"versión de formato no soportada: {version}")
+
+    device_len = payload[HEADER.size]
+    start = HEADER.size + 1 + device_len
+    device = bytes(payload[HEADER.size + 1: start]).decode(errors="replace")
+
+    body = memoryview(payload)[start:]
+    if len(body) != count * RECORD.size:
+        raise BinaryFormatError(
+            f"se esperaban {count} lecturas ({count * RECORD.size} bytes), llegaron {len(body)} bytes"
+        )
+    return device, base_ts_ms, RECORD.iter_unpack(body)
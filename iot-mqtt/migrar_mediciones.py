@@ -0,0 +1,150 @@
+"""
+Crea la tabla única `mediciones` y copia (backfill) las tablas por tipo
+(temperatura, humedad, ...) hacia ella.
+
+Uso:
+    python migrar_mediciones.py               # crea tabla + backfill
+    python migrar_mediciones.py --solo-crear  # solo crea las tablas
+    python migrar_mediciones.py --chunk 20000 --device arduino-sensores-casa-1
+
+El avance se guarda en `mediciones_migracion` dentro de la misma
+transacción que cada bloque, así que se puede cortar y volver a correr
+sin duplicar filas.
+"""
+import argparse
+import os
+import time
+
+import mysql.connector
+from mysql.connector import Error
+from dotenv import load_dotenv
+
+from sensores import load_sensor_registry
+
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": int(os.getenv("DB_PORT", 3306)),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD"),
+    "database": os.getenv("DB_NAME"),
+}
+
+# Tablas por tipo -> unidad con la que se guardan en `mediciones`
+LEGACY_TABLES = {name: cfg.get("unit") for name, cfg in load_sensor_registry().items()}
+
+# La llave primaria agrupa físicamente (InnoDB) por dispositivo/sensor/tiempo,
+# así los rangos de tiempo de una serie son lecturas contiguas.
+# `id` va al final solo para desempatar lecturas con el mismo ts.
+MEDICIONES_DDL = """
+    CREATE TABLE IF NOT EXISTS mediciones (
+        id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        device VARCHAR(64) NOT NULL,
+        sensor_type VARCHAR(32) NOT NULL,
+        ts DATETIME(3) NOT NULL,
+        valor DOUBLE NOT NULL,
+        unit VARCHAR(16) NULL,
+        PRIMARY KEY (device, sensor_type, ts, id),
+        KEY idx_mediciones_id (id),
+        KEY idx_mediciones_tipo_ts (sensor_type, ts)
+    ) ENGINE=InnoDB;
+"""
+
+CHECKPOINT_DDL = """
+    CREATE TABLE IF NOT EXISTS mediciones_migracion (
+        tabla VARCHAR(32) NOT NULL PRIMARY KEY,
+        ultimo_id BIGINT UNSIGNED NOT NULL
+    ) ENGINE=InnoDB;
+"""
+
+
+def get_connection():
+    return mysql.connector.connect(**DB_CONFIG, use_pure=True)
+
+
+def create_tables(conn):
+    cursor = conn.cursor()
+    cursor.execute(MEDICIONES_DDL)
+    cursor.execute(CHECKPOINT_DDL)
+    conn.commit()
+    cursor.close()
+    print("[MIGRACION] Tablas `mediciones` y `mediciones_migracion` listas")
+
+
+def backfill_table(conn, table: str, unit: str, device: str, chunk: int):
+    cursor = conn.cursor()
+
+    cursor.execute("SELECT ultimo_id FROM mediciones_migracion WHERE tabla = %s", (table,))
+    row = cursor.fetchone()
+    last_id = row[0] if row else 0
+
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+    max_id = cursor.fetchone()[0]
+    conn.commit()
+
+    if last_id >= max_id:
+        print(f"[MIGRACION] '{table}' ya estaba migrada (id {last_id})")
+        cursor.close()
+        return
+
+    print(f"[MIGRACION] '{table}': ids {last_id + 1}..{max_id}")
+    copied = 0
+    started = time.perf_counter()
+
+    while last_id < max_id:
+        upper = min(last_id + chunk, max_id)
+        # Rango por llave primaria: cada bloque es un range scan corto
+        cursor.execute(
+            f"""
+            INSERT INTO mediciones (device, sensor_type, ts, valor, unit)
+            SELECT %s, %s, hora_medicion, valor, %s
+            FROM {table}
+            WHERE id > %s AND id <= %s;
+            """,
+            (device, table, unit, last_id, upper),
+        )
+        copied += cursor.rowcount
+        cursor.execute(
+            """
+            INSERT INTO mediciones_migracion (tabla, ultimo_id) VALUES (%s, %s)
+            ON DUPLICATE KEY UPDATE ultimo_id = VALUES(ultimo_id);
+            """,
+            (table, upper),
+        )
+        conn.commit()
+        last_id = upper
+
+    elapsed = time.perf_counter() - started
+    print(f"[MIGRACION] '{table}': {copied} filas copiadas en {elapsed:.1f}s")
+    cursor.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra las tablas por sensor a `mediciones`")
+    parser.add_argument("--chunk", type=int, default=10000, help="ids por transacción")
+    parser.add_argument(
+        "--device",
+        default=os.getenv("DEFAULT_DEVICE", "default"),
+        help="device que se asigna a las filas viejas",
+    )
+    parser.add_argument("--solo-crear", action="store_true", help="solo crea las tablas")
+    args = parser.parse_args()
+
+    conn = None
+    try:
+        conn = get_connection()
+        create_tables(conn)
+        if args.solo_crear:
+            return
+        for table, unit in LEGACY_TABLES.items():
+            backfill_table(conn, table, unit, args.device, args.chunk)
+    except Error as e:
+        print(f"[MySQL ERROR] {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,31 @@
 from datetime import datetime
+import logging
+import multiprocessing as mp
 import os
 import json
-import mysql.connector
-from mysql.connector import Error
+import signal
+import threading
+import time
 from dotenv import load_dotenv
+from mysql.connector import pooling
 from paho.mqtt import client as mqtt
 
+from alertas import AlertEngine, AlertEvaluator, AlertForwarder, AlertWriter
+from db_writer import BatchWriter, STORAGE_PER_TABLE
+from formato_binario import BinaryFormatError, decode as decode_binary, is_binary
+from observabilidad import (
+    ALERT_EVENTS, MESSAGES, PARSE_FAILURES, READINGS, REJECTED, SPOOL_BYTES,
+    WRITER_QUEUE_DEPTH, SamplingProfiler, install_profiler_toggle, setup_logging,
+    start_metrics_server,
+)
+from retencion import RetentionWorker
+from sensores import is_valid_reading, load_sensor_registry
+from spool import Spool, SpoolDrainer
+
 load_dotenv()
 
+log = logging.getLogger("iot.listener")
+
 DB_CONFIG = {
     "host": os.getenv("DB_HOST", "localhost"),
     "port": int(os.getenv("DB_PORT", 3306)),
@@ -16,91 +34,488 @@ DB_CONFIG = {
     "database": os.getenv("DB_NAME"),
 }
 
-BROKER = "test.mosquitto.org"
-PORT = 1883
-TOPIC = "umisumi/test/message"
+BROKER = os.getenv("MQTT_BROKER", "test.mosquitto.org")
+PORT = int(os.getenv("MQTT_PORT", 1883))
+TOPIC = os.getenv("MQTT_TOPIC", "umisumi/test/message")
+
+# Procesos de ingesta. Con más de uno, el supervisor levanta N workers que
+# se suscriben a `$share/<grupo>/<tópico>` (suscripción compartida MQTT v5):
+# el broker reparte los mensajes entre ellos y cada uno decodifica y
+# escribe por su cuenta, con su propio BatchWriter.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 1))
+SHARE_GROUP = os.getenv("MQTT_SHARE_GROUP", "iot-ingest")
+
+# Sensores conocidos (ver sensores.json); en modo per_table cada uno es una tabla
+SENSORS = load_sensor_registry()
+ALLOWED_TABLES = set(SENSORS)
+# Id numérico -> sensor, para el formato binario (ver formato_binario.py)
+SENSOR_IDS = {cfg["id"]: name for name, cfg in SENSORS.items() if "id" in cfg}
+
+# "per_table" (una tabla por sensor) o "narrow" (tabla única `mediciones`)
+STORAGE_MODE = os.getenv("STORAGE_MODE", STORAGE_PER_TABLE)
+
+# Dispositivo por defecto cuando el mensaje no trae "device"
+DEFAULT_DEVICE = os.getenv("DEFAULT_DEVICE", "default")
+
+# Largos de las columnas device/unit de `mediciones` y `alertas`: una
+# lectura que no cabe tumbaría el INSERT de todo su lote
+MAX_DEVICE_LEN = 64
+MAX_UNIT_LEN = 16
+
+# Si el `ts` del dispositivo está más de esto en el futuro, se usa la hora del servidor
+MAX_FUTURE_SKEW_S = float(os.getenv("MAX_FUTURE_SKEW_S", 300))
+
+# Escritura por lotes (ver db_writer.py)
+WRITER_CONFIG = {
+    "storage_mode": STORAGE_MODE,
+    "pool_size": int(os.getenv("DB_POOL_SIZE", 2)),
+    "batch_size": int(os.getenv("WRITER_BATCH_SIZE", 500)),
+    "flush_interval": float(os.getenv("WRITER_FLUSH_INTERVAL", 1.0)),
+    "queue_size": int(os.getenv("WRITER_QUEUE_SIZE", 10000)),
+    "put_timeout": float(os.getenv("WRITER_PUT_TIMEOUT", 0.5)),
+    "rollups": os.getenv("ROLLUPS_ENABLED", "1") == "1",
+}
+
+# Días a conservar por tabla (0 = no borrar nunca)
+RETENTION_DAYS = {
+    "raw": int(os.getenv("RAW_RETENTION_DAYS", 0)),
+    "1m": int(os.getenv("ROLLUP_1M_RETENTION_DAYS", 0)),
+    "1h": int(os.getenv("ROLLUP_1H_RETENTION_DAYS", 0)),
+    "1d": int(os.getenv("ROLLUP_1D_RETENTION_DAYS", 0)),
+}
+# Spool local en disco (ver spool.py). Vacío = las lecturas van directo
+# a la cola en memoria del BatchWriter, como antes.
+SPOOL_DIR = os.getenv("SPOOL_DIR", "")
+SPOOL_CONFIG = {
+    "segment_bytes": int(os.getenv("SPOOL_SEGMENT_MB", 64)) * 1024 * 1024,
+    "fsync_interval": float(os.getenv("SPOOL_FSYNC_INTERVAL", 0.2)),
+    "max_bytes": int(os.getenv("SPOOL_MAX_MB", 0)) * 1024 * 1024,
+}
+SPOOL_DRAIN_BATCH = int(os.getenv("SPOOL_DRAIN_BATCH", 5000))
+
+# Motor de alertas (reglas en el bloque "alertas" de sensores.json)
+ALERTS_ENABLED = os.getenv("ALERTS_ENABLED", "1") == "1"
+
+RETENTION_INTERVAL = float(os.getenv("RETENTION_INTERVAL", 3600))
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", 30))
+# Tiempo total que tiene un proceso de ingesta para vaciar writer, spool y
+# alertas al detenerse; el supervisor espera esto más un margen antes de kill()
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 15))
+
+# Métricas Prometheus (0 = sin exporter); en modo supervisor, worker n usa el
+# puerto + n y el supervisor (alertas) el puerto + INGEST_WORKERS
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+# Perfilador por muestreo, se prende/apaga con SIGUSR1 (ver observabilidad.py)
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "perfiles")
+
+writer: BatchWriter = None
+spool: Spool = None
+drainer: SpoolDrainer = None
+alert_engine: AlertEngine = None
+alert_writer: AlertWriter = None
+alert_forwarder: AlertForwarder = None
+worker_name = "main"
+
+# Hijos de las métricas que se tocan en cada mensaje, resueltos una vez
+MESSAGES_JSON = MESSAGES.labels("json")
+MESSAGES_BINARY = MESSAGES.labels("binary")
+PARSE_FAILURES_JSON = PARSE_FAILURES.labels("json")
+PARSE_FAILURES_BINARY = PARSE_FAILURES.labels("binary")
+
+_last_stats = (time.monotonic(), 0)
+
+
+def parse_device_ts(ts) -> datetime:
+    """
+    Convierte el `ts` del dispositivo (epoch en segundos o milisegundos)
+    a datetime local. Si no viene o no es creíble, usa la hora del servidor.
+    """
+    now = time.time()
+    try:
+        ts = float(ts)
+    except (TypeError, ValueError):
+        return datetime.fromtimestamp(now)
 
-# Tablas permitidas (deben existir en tu BD)
-ALLOWED_TABLES = {"humedad", "temperatura", "presion", "luz", "gas"}
+    if ts > 1e12:  # viene en milisegundos
+        ts /= 1000.0
 
+    # Sin RTC (p. ej. millis() del Arduino) o reloj adelantado
+    if ts < 946684800 or ts > now + MAX_FUTURE_SKEW_S:
+        return datetime.fromtimestamp(now)
 
-def get_connection():
-    return mysql.connector.connect(**DB_CONFIG, use_pure=True)
+    return datetime.fromtimestamp(ts)
 
 
-def insert_measurement(sensor_type: str, value: float):
+def insert_measurement(
+    sensor_type: str,
+    value: float,
+    measured_at: datetime = None,
+    device: str = DEFAULT_DEVICE,
+    unit: str = None,
+):
     """
-    Inserta en la tabla correspondiente (temperatura, humedad, etc.)
-    usando columnas: valor, hora_medicion.
+    Encola la lectura para la tabla correspondiente (temperatura, humedad, etc.).
+    El INSERT real lo hace el BatchWriter (o el drenador del spool) en lotes,
+    fuera del hilo de MQTT.
     """
     if sensor_type not in ALLOWED_TABLES:
-        print(f"[WARN] Tipo de sensor no permitido: {sensor_type}")
+        REJECTED.labels("unknown_sensor").inc()
+        log.warning("Tipo de sensor no permitido: %s", sensor_type)
         return
 
-    conn = None
-    cursor = None
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
+    cfg = SENSORS[sensor_type]
+    if not is_valid_reading(cfg, value):
+        REJECTED.labels("out_of_range").inc()
+        log.warning("Valor fuera de rango para '%s': %s", sensor_type, value)
+        return
 
-        query = f"""
-            INSERT INTO {sensor_type} (valor, hora_medicion)
-            VALUES (%s, NOW());
-        """
+    if not isinstance(device, str) or not 0 < len(device) <= MAX_DEVICE_LEN:
+        REJECTED.labels("invalid_device").inc()
+        log.warning("Device inválido (máx. %d caracteres): %.80r", MAX_DEVICE_LEN, device)
+        return
 
-        cursor.execute(query, (value,))
-        conn.commit()
+    if unit is not None and (not isinstance(unit, str) or len(unit) > MAX_UNIT_LEN):
+        REJECTED.labels("invalid_unit").inc()
+        log.warning("Unidad inválida para '%s' (máx. %d caracteres): %.80r", sensor_type, MAX_UNIT_LEN, unit)
+        return
 
-        print(f"[SQL] Insertado en tabla '{sensor_type}': {value}")
+    measured_at = measured_at or datetime.now()
+    if alert_engine:
+        events = alert_engine.evaluate(sensor_type, value, measured_at, device)
+        if events:
+            submit_alert_events(events)
+    elif alert_forwarder:
+        # Modo supervisor: evalúa el supervisor, con un solo estado
+        alert_forwarder.submit(sensor_type, value, measured_at, device)
 
-    except Error as e:
-        print(f"[MySQL ERROR] {e}")
+    if spool:
+        accepted = spool.append(sensor_type, value, measured_at, device, unit)
+    else:
+        accepted = writer.submit(sensor_type, value, measured_at, device, unit)
+
+    if accepted:
+        READINGS.inc()
+    else:
+        # Con la BD atorada esto puede pasar miles de veces por segundo:
+        # el contador es la señal, el log solo en DEBUG
+        REJECTED.labels("spool_full" if spool else "queue_full").inc()
+        log.debug("Lectura descartada (cola/spool lleno): %s=%s", sensor_type, value)
+
+
+def submit_alert_events(events):
+    for event in events:
+        ALERT_EVENTS.labels(event.rule, "resolved" if event.resolved else "open").inc()
+    alert_writer.submit(events)
 
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
+def print_stats():
+    global _last_stats
+    if spool:
+        stats = {
+            "spooled": spool.appended,
+            "dropped": spool.dropped,
+            "rows_written": drainer.rows_written,
+            "drain_errors": drainer.errors,
+            "dead_letters": drainer.dead_letters,
+            "spool_bytes": spool.pending_bytes(),
+        }
+    else:
+        stats = writer.stats.snapshot()
+        stats["queue_depth"] = writer.queue_depth()
 
-def on_connect(client, userdata, flags, rc):
-    print("[MQTT] Conectado al broker con código:", rc)
-    client.subscribe(TOPIC)
-    print(f"[MQTT] Suscrito al tópico: {TOPIC}")
+    # Filas/s desde el reporte anterior
+    now = time.monotonic()
+    last_time, last_rows = _last_stats
+    elapsed = now - last_time
+    stats["rows_per_s"] = round((stats["rows_written"] - last_rows) / elapsed, 1) if elapsed else 0.0
+    _last_stats = (now, stats["rows_written"])
+    if alert_forwarder:
+        stats["alerts_dropped"] = alert_forwarder.dropped
+
+    log.info("Stats", extra=stats)
+
+
+def subscription_topic() -> str:
+    if INGEST_WORKERS > 1:
+        return f"$share/{SHARE_GROUP}/{TOPIC}"
+    return TOPIC
+
+
+def on_connect(client, userdata, flags, rc, properties=None):
+    log.info("Conectado al broker con código: %s", rc)
+    topic = subscription_topic()
+    client.subscribe(topic)
+    log.info("Suscrito al tópico: %s", topic)
+
+
+def on_binary_message(payload: bytes):
+    """
+    Lote de lecturas en formato binario: un solo mensaje, N lecturas.
+    """
+    try:
+        device, base_ts_ms, readings = decode_binary(payload)
+    except BinaryFormatError as e:
+        PARSE_FAILURES_BINARY.inc()
+        log.warning("Mensaje binario inválido: %s", e)
+        return
+
+    device = device or DEFAULT_DEVICE
+    count = 0
+    for sensor_id, offset_ms, value in readings:
+        sensor_type = SENSOR_IDS.get(sensor_id)
+        if sensor_type is None:
+            REJECTED.labels("unknown_sensor").inc()
+            log.warning("Id de sensor desconocido: %s", sensor_id)
+            continue
+        insert_measurement(
+            sensor_type,
+            # float32 -> el decimal corto que mandó el dispositivo
+            float(f"{value:.7g}"),
+            measured_at=parse_device_ts(base_ts_ms + offset_ms if base_ts_ms else None),
+            device=device,
+            unit=SENSORS[sensor_type].get("unit"),
+        )
+        count += 1
+    log.debug("Mensaje binario de %s: %d lecturas", device, count)
 
 
 def on_message(client, userdata, msg):
-    payload = msg.payload.decode()
-    print(f"[MQTT] Mensaje recibido crudo: {payload}")
+    # El primer byte distingue el formato binario del JSON de siempre
+    if is_binary(msg.payload):
+        MESSAGES_BINARY.inc()
+        on_binary_message(msg.payload)
+        return
+
+    MESSAGES_JSON.inc()
+    payload = msg.payload.decode(errors="replace")
+    log.debug("Mensaje recibido crudo: %s", payload)
 
     try:
         data = json.loads(payload)
+        if not isinstance(data, dict):
+            # JSON válido pero no es un objeto (123, "x", [1]...)
+            PARSE_FAILURES_JSON.inc()
+            log.warning("El JSON no es un objeto: %.80s", payload)
+            return
 
         sensor_type = data.get("type")
         value = float(data.get("value"))
 
         if sensor_type is None:
-            print("[ERROR] No viene 'type' en el JSON")
+            PARSE_FAILURES_JSON.inc()
+            log.warning("No viene 'type' en el JSON")
             return
 
-        insert_measurement(sensor_type, value)
+        insert_measurement(
+            sensor_type,
+            value,
+            measured_at=parse_device_ts(data.get("ts")),
+            device=str(data.get("device") or DEFAULT_DEVICE),
+            unit=data.get("unit") or SENSORS.get(sensor_type, {}).get("unit"),
+        )
 
-    except (json.JSONDecodeError, TypeError, ValueError) as e:
-        print(f"[ERROR] Problema parseando JSON o valor: {e}")
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError) as e:
+        # Que una excepción no se escape: paho la relanza y tumba su hilo de red
+        PARSE_FAILURES_JSON.inc()
+        log.warning("Problema parseando JSON o valor: %s", e)
 
 
-def main():
-    client = mqtt.Client()
+def start_retention():
+    if not any(RETENTION_DAYS.values()):
+        return None
+    pool = pooling.MySQLConnectionPool(
+        pool_name="iot_retention", pool_size=1, use_pure=True, **DB_CONFIG
+    )
+    retention = RetentionWorker(
+        pool, STORAGE_MODE, ALLOWED_TABLES, RETENTION_DAYS, interval=RETENTION_INTERVAL
+    )
+    retention.start()
+    return retention
+
+
+def run_ingest(
+    name: str = "main", primary: bool = True, metrics_port: int = METRICS_PORT, alert_queue=None
+):
+    """
+    Un proceso de ingesta: cliente MQTT + BatchWriter (o spool) propios.
+    Termina con Ctrl+C o SIGTERM, vaciando la cola del writer antes de salir.
+    `primary`: además corre lo que va una sola vez (retención, cerrar alertas
+    viejas); en modo supervisor eso lo hace el supervisor.
+    `alert_queue`: en modo supervisor, las lecturas para las alertas se
+    mandan ahí en lugar de evaluarlas en el worker.
+    """
+    global writer, spool, drainer, alert_engine, alert_writer, alert_forwarder, worker_name
+    worker_name = name
+    log_listener = setup_logging(name)
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    if SPOOL_DIR:
+        # Cada worker con su propio directorio: un solo escritor por spool
+        spool = Spool(os.path.join(SPOOL_DIR, name), **SPOOL_CONFIG)
+        spool.start()
+        drainer = SpoolDrainer(
+            spool, DB_CONFIG, STORAGE_MODE, WRITER_CONFIG["rollups"], SPOOL_DRAIN_BATCH
+        )
+        drainer.start()
+        SPOOL_BYTES.set_function(spool.pending_bytes)
+    else:
+        writer = BatchWriter(DB_CONFIG, **WRITER_CONFIG)
+        writer.start()
+        WRITER_QUEUE_DEPTH.set_function(writer.queue_depth)
+
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    if PROFILER_ENABLED:
+        install_profiler_toggle(SamplingProfiler(), PROFILE_DIR, name)
+
+    if ALERTS_ENABLED and alert_queue is not None:
+        alert_forwarder = AlertForwarder(alert_queue, SENSORS)
+        alert_forwarder.start()
+    elif ALERTS_ENABLED:
+        alert_engine = AlertEngine(SENSORS)
+        alert_writer = AlertWriter(DB_CONFIG, close_stale=primary)
+        alert_writer.start()
+
+    retention = start_retention() if primary else None
+
+    # v5 para las suscripciones compartidas; cada worker con su client id
+    client = mqtt.Client(client_id=f"iot-ingest-{name}-{os.getpid()}", protocol=mqtt.MQTTv5)
 
     client.on_connect = on_connect
     client.on_message = on_message
 
-    print("[MQTT] Conectando al broker...")
+    log.info("Conectando al broker %s:%s...", BROKER, PORT)
     client.connect(BROKER, PORT, keepalive=60)
 
-    print("[MQTT] Escuchando mensajes...")
-    client.loop_forever()
+    log.info("Escuchando mensajes...")
+    client.loop_start()
+
+    try:
+        while not stop.wait(STATS_INTERVAL):
+            print_stats()
+        log.info("Deteniendo listener...")
+    finally:
+        # Primero dejar de recibir, después vaciar lo que quede en la cola.
+        # Todo comparte un solo plazo (SHUTDOWN_TIMEOUT)
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+
+        def remaining() -> float:
+            return max(0.0, deadline - time.monotonic())
+
+        client.loop_stop()
+        client.disconnect()
+        if retention:
+            retention.close()
+        if alert_writer:
+            alert_writer.close(remaining())
+        if alert_forwarder:
+            alert_forwarder.close(remaining())
+        if spool:
+            # fsync de lo último y un intento de drenarlo; lo que no alcance
+            # queda en disco para el próximo arranque
+            spool.close()
+            drainer.close(remaining())
+        else:
+            writer.close(remaining())
+        print_stats()
+        log_listener.stop()
+
+
+def supervise(workers: int):
+    """
+    Levanta `workers` procesos de ingesta sobre la misma suscripción
+    compartida y los reinicia si alguno se cae. Con Ctrl+C o SIGTERM les
+    manda SIGTERM a todos y espera a que vacíen sus colas.
+    La retención y la evaluación de alertas corren una sola vez, aquí en el
+    supervisor.
+    """
+    global alert_writer
+    log_listener = setup_logging("supervisor")
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    # "spawn" y no fork: para cuando se (re)lanza un worker el supervisor ya
+    # tiene hilos corriendo (logs, alertas, métricas, retención)
+    ctx = mp.get_context("spawn")
+    # Lotes de lecturas worker -> supervisor para el motor de alertas
+    alert_queue = ctx.Queue(maxsize=1000) if ALERTS_ENABLED else None
+
+    def spawn(i: int) -> mp.Process:
+        port = METRICS_PORT + i if METRICS_PORT else 0
+        proc = ctx.Process(
+            target=run_ingest, args=(f"w{i}", False, port, alert_queue), name=f"ingest-w{i}"
+        )
+        proc.start()
+        return proc
+
+    procs: list[mp.Process] = []
+    if PROFILER_ENABLED and hasattr(signal, "SIGUSR1"):
+        # El trabajo está en los workers: el USR1 al supervisor se les reenvía
+        def forward_profiler_toggle(signum, frame):
+            for proc in procs:
+                if proc.is_alive():
+                    os.kill(proc.pid, signal.SIGUSR1)
+
+        signal.signal(signal.SIGUSR1, forward_profiler_toggle)
+
+    log.info("%d workers en %s", workers, subscription_topic())
+    evaluator = None
+    if ALERTS_ENABLED:
+        alert_writer = AlertWriter(DB_CONFIG, close_stale=True)
+        alert_writer.start()
+        evaluator = AlertEvaluator(AlertEngine(SENSORS), alert_queue, submit_alert_events)
+        evaluator.start()
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT + workers)
+    procs = [spawn(i) for i in range(workers)]
+    retention = start_retention()
+
+    try:
+        while not stop.wait(1.0):
+            for i, proc in enumerate(procs):
+                if not proc.is_alive():
+                    log.warning("Worker w%d terminó (código %s), reiniciando", i, proc.exitcode)
+                    procs[i] = spawn(i)
+    finally:
+        log.info("Deteniendo workers...")
+        for proc in procs:
+            if proc.is_alive():
+                proc.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT + 5
+        for proc in procs:
+            # Cada worker se da SHUTDOWN_TIMEOUT para vaciar sus colas
+            proc.join(timeout=max(0.0, deadline - time.monotonic()))
+            if proc.is_alive():
+                log.warning("%s no terminó a tiempo, forzando salida", proc.name)
+                proc.kill()
+        if evaluator:
+            # Ya con los workers abajo: sus últimos lotes están en la cola
+            evaluator.close()
+            alert_writer.close()
+        if retention:
+            retention.close()
+        log_listener.stop()
+
+
+def main():
+    if INGEST_WORKERS > 1:
+        supervise(INGEST_WORKERS)
+    else:
+        run_ingest()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
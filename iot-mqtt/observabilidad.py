@@ -0,0 +1,79 @@
+"""
+Logs, métricas y perfilador del listener. Logs y perfilador vienen de
+comun/observabilidad_comun.py (compartido con el backend); aquí solo van
+las métricas del listener y el interruptor del perfilador.
+
+- Logs: ver observabilidad_comun.setup_logging. Nivel con LOG_LEVEL
+  (DEBUG muestra cada mensaje crudo) y formato con LOG_FORMAT=text|json.
+- Métricas: formato Prometheus en http://<host>:METRICS_PORT/metrics
+  (en modo supervisor, cada worker en METRICS_PORT + n).
+- Perfilador: con PROFILER_ENABLED=1, `kill -USR1 <pid>` lo prende y otro
+  USR1 lo apaga y escribe las pilas muestreadas (formato "collapsed",
+  para flamegraph.pl / speedscope) en PROFILE_DIR.
+"""
+import logging
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# Logs y perfilador son los mismos que en el backend: ../comun/
+sys.path.append(str(Path(__file__).resolve().parent.parent / "comun"))
+from observabilidad_comun import SamplingProfiler, setup_logging  # noqa: E402,F401
+
+# -------------------------------
+# MÉTRICAS
+# -------------------------------
+
+MESSAGES = Counter("iot_mqtt_messages_total", "Mensajes MQTT recibidos", ["format"])
+READINGS = Counter("iot_mqtt_readings_total", "Lecturas aceptadas para escribir")
+PARSE_FAILURES = Counter("iot_mqtt_parse_failures_total", "Mensajes que no se pudieron decodificar", ["format"])
+REJECTED = Counter("iot_mqtt_rejected_total", "Lecturas descartadas", ["reason"])
+
+DB_WRITE_SECONDS = Histogram(
+    "iot_db_write_seconds",
+    "Duración de cada lote escrito a MySQL (INSERT + rollups + commit)",
+    ["path"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_ROWS = Counter("iot_db_rows_total", "Filas escritas a MySQL", ["path", "status"])
+DB_CONNECTIONS_IN_USE = Gauge("iot_db_connections_in_use", "Conexiones del pool ocupadas", ["path"])
+
+WRITER_QUEUE_DEPTH = Gauge("iot_writer_queue_depth", "Lecturas en la cola del BatchWriter")
+SPOOL_BYTES = Gauge("iot_spool_bytes", "Bytes pendientes en el spool local")
+ALERT_EVENTS = Counter("iot_alert_events_total", "Eventos de alerta generados", ["rule", "state"])
+
+
+def start_metrics_server(port: int):
+    start_http_server(port)
+    logging.getLogger("iot.metrics").info("Métricas en :%d/metrics", port)
+
+
+# -------------------------------
+# PERFILADOR POR MUESTREO
+# -------------------------------
+
+def install_profiler_toggle(profiler: SamplingProfiler, out_dir: str, process_name: str):
+    """
+    SIGUSR1 prende/apaga el perfilador; al apagarlo escribe el resultado.
+    """
+    log = logging.getLogger("iot.profiler")
+    if not hasattr(signal, "SIGUSR1"):
+        log.warning("SIGUSR1 no existe en esta plataforma; perfilador deshabilitado")
+        return
+
+    def toggle(signum, frame):
+        if not profiler.running:
+            profiler.start()
+            log.info("Perfilador encendido")
+            return
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, f"perfil-{process_name}-{time.strftime('%Y%m%d-%H%M%S')}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.stop())
+        log.info("Perfilador apagado, %d muestras en %s", profiler.samples, path)
+
+    signal.signal(signal.SIGUSR1, toggle)
@@ -0,0 +1,196 @@
+"""
+Política de retención: borra lecturas crudas (y rollups finos) viejos en
+bloques pequeños, cada uno en su propia transacción, para no tener locks
+largos sobre tablas en las que el listener sigue insertando.
+
+El listener la corre en un hilo si alguna retención (*_RETENTION_DAYS) es
+mayor a 0. También se puede correr a mano:
+    python retencion.py --once
+
+Antes de activar RAW_RETENTION_DAYS sobre datos viejos conviene correr
+`python rollups.py --backfill` para que el histórico largo no se pierda.
+"""
+import argparse
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from mysql.connector import Error
+
+from db_writer import STORAGE_NARROW
+
+log = logging.getLogger("iot.retencion")
+
+
+class RetentionWorker:
+    """
+    `retention_days`: tabla -> días a conservar (0 = conservar todo).
+    Las tablas crudas se indican con la llave "raw".
+    """
+
+    def __init__(
+        self,
+        pool,
+        storage_mode: str,
+        sensor_tables: set[str],
+        retention_days: dict[str, int],
+        chunk_size: int = 5000,
+        pause: float = 0.2,
+        interval: float = 3600,
+    ):
+        self._pool = pool
+        self.storage_mode = storage_mode
+        self.sensor_tables = sorted(sensor_tables)
+        self.retention_days = retention_days
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Error as e:
+                log.error("Error de MySQL: %s", e)
+            self._stop.wait(self.interval)
+
+    def _targets(self) -> list[tuple[str, str, tuple[Any, ...], int, Optional[str]]]:
+        """
+        (descripción, DELETE con placeholders para cutoff y LIMIT, params, días,
+        SELECT del límite de id o None)
+
+        Cada DELETE recorre un rango de un índice que empieza por la columna
+        de tiempo, así cada bloque es barato y solo bloquea lo que borra.
+        Las tablas per_table no tienen índice sobre hora_medicion: un DELETE
+        por hora recorrería (y bloquearía) toda la PK, incluido el final
+        donde inserta el listener. Para ellas primero se busca, con una
+        lectura que no toma locks, el primer id que ya no se borra, y el
+        DELETE se limita al rango de PK anterior a ese id.
+        """
+        targets = []
+        raw_days = self.retention_days.get("raw", 0)
+        if raw_days:
+            if self.storage_mode == STORAGE_NARROW:
+                for sensor in self.sensor_tables:
+                    targets.append((
+                        f"mediciones[{sensor}]",
+                        "DELETE FROM mediciones WHERE sensor_type = %s AND ts < %s "
+                        "ORDER BY ts LIMIT %s",
+                        (sensor,),
+                        raw_days,
+                        None,
+                    ))
+            else:
+                for table in self.sensor_tables:
+                    # El id crece con la hora de llegada; sin filas recientes
+                    # el límite es MAX(id) + 1
+                    bound = (
+                        f"SELECT COALESCE("
+                        f"(SELECT id FROM {table} WHERE hora_medicion >= %s ORDER BY id LIMIT 1), "
+                        f"(SELECT MAX(id) + 1 FROM {table}))"
+                    )
+                    targets.append((
+                        table,
+                        f"DELETE FROM {table} WHERE id < %s AND hora_medicion < %s "
+                        "ORDER BY id LIMIT %s",
+                        (),
+                        raw_days,
+                        bound,
+                    ))
+        for level in ("1m", "1h", "1d"):
+            days = self.retention_days.get(level, 0)
+            if not days:
+                continue
+            # Por sensor para que cada bloque sea un rango de la PK (sensor_type, bucket)
+            for sensor in self.sensor_tables:
+                targets.append((
+                    f"rollup_{level}[{sensor}]",
+                    f"DELETE FROM rollup_{level} WHERE sensor_type = %s AND bucket < %s "
+                    "ORDER BY bucket LIMIT %s",
+                    (sensor,),
+                    days,
+                    None,
+                ))
+        return targets
+
+    def run_once(self) -> dict[str, int]:
+        deleted: dict[str, int] = {}
+        for name, query, params, days, bound_query in self._targets():
+            cutoff = datetime.now() - timedelta(days=days)
+            total = 0
+            if bound_query:
+                bound = self._fetch_bound(bound_query, cutoff)
+                if bound is None:
+                    # Tabla vacía
+                    deleted[name] = 0
+                    continue
+                params = params + (bound,)
+            while not self._stop.is_set():
+                conn = self._pool.get_connection()
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute(query, params + (cutoff, self.chunk_size))
+                    affected = cursor.rowcount
+                    conn.commit()
+                    cursor.close()
+                finally:
+                    conn.close()
+                total += affected
+                if affected < self.chunk_size:
+                    break
+                # Dejamos respirar a los escritores entre bloques
+                time.sleep(self.pause)
+            deleted[name] = total
+            if total:
+                log.info("%s: %d filas anteriores a %s borradas", name, total, cutoff.strftime("%Y-%m-%d %H:%M"))
+        return deleted
+
+    def _fetch_bound(self, query: str, cutoff: datetime) -> Optional[int]:
+        conn = self._pool.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, (cutoff,))
+            row = cursor.fetchone()
+            cursor.close()
+            # Cierra la transacción de la lectura
+            conn.commit()
+        finally:
+            conn.close()
+        return row[0] if row else None
+
+
+def main():
+    from mysql.connector import pooling
+    from mqtt_listener import ALLOWED_TABLES, DB_CONFIG, RETENTION_DAYS, STORAGE_MODE
+
+    parser = argparse.ArgumentParser(description="Borra lecturas viejas según la retención")
+    parser.add_argument("--once", action="store_true", help="una pasada y salir")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="[RETENCION] %(message)s")
+
+    pool = pooling.MySQLConnectionPool(pool_name="iot_retention", pool_size=1, use_pure=True, **DB_CONFIG)
+    worker = RetentionWorker(pool, STORAGE_MODE, ALLOWED_TABLES, RETENTION_DAYS)
+    if args.once:
+        worker.run_once()
+        return
+    worker.start()
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        worker.close()
+
+
+if __name__ == "__main__":
+    main()
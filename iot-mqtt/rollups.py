@@ -0,0 +1,187 @@
+"""
+Rollups pre-agregados por sensor (min, max, sum, count, last) a 1 minuto,
+1 hora y 1 día. El BatchWriter los actualiza en la misma transacción que
+las lecturas crudas, así nunca hay que recalcularlos escaneando las tablas.
+
+Para lecturas que ya existían antes de activar los rollups:
+    python rollups.py --backfill
+"""
+import argparse
+from datetime import datetime
+from typing import Iterable
+
+import mysql.connector
+from mysql.connector import Error
+
+# Nivel -> segundos por cubeta (el backend usa los mismos nombres de tabla)
+ROLLUP_LEVELS = {
+    "1m": 60,
+    "1h": 3600,
+    "1d": 86400,
+}
+
+# Cómo truncar una hora local al inicio de su cubeta, en Python y en SQL.
+# Se usan fechas locales (igual que hora_medicion) para que los días corten a medianoche.
+_TRUNCATE = {
+    "1m": lambda t: t.replace(second=0, microsecond=0),
+    "1h": lambda t: t.replace(minute=0, second=0, microsecond=0),
+    "1d": lambda t: t.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+_TRUNCATE_SQL = {
+    "1m": "%Y-%m-%d %H:%i:00",
+    "1h": "%Y-%m-%d %H:00:00",
+    "1d": "%Y-%m-%d 00:00:00",
+}
+
+ROLLUP_DDL = """
+    CREATE TABLE IF NOT EXISTS rollup_{level} (
+        sensor_type VARCHAR(32) NOT NULL,
+        bucket DATETIME NOT NULL,
+        min_valor DOUBLE NOT NULL,
+        max_valor DOUBLE NOT NULL,
+        sum_valor DOUBLE NOT NULL,
+        count_valor BIGINT UNSIGNED NOT NULL,
+        last_valor DOUBLE NOT NULL,
+        last_ts DATETIME(3) NOT NULL,
+        PRIMARY KEY (sensor_type, bucket)
+    ) ENGINE=InnoDB;
+"""
+
+# last_valor se asigna antes que last_ts: MySQL evalúa el UPDATE en orden
+# y aquí todavía compara contra el last_ts viejo.
+ROLLUP_UPSERT = """
+    INSERT INTO rollup_{level}
+        (sensor_type, bucket, min_valor, max_valor, sum_valor, count_valor, last_valor, last_ts)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        min_valor = LEAST(min_valor, VALUES(min_valor)),
+        max_valor = GREATEST(max_valor, VALUES(max_valor)),
+        sum_valor = sum_valor + VALUES(sum_valor),
+        count_valor = count_valor + VALUES(count_valor),
+        last_valor = IF(VALUES(last_ts) >= last_ts, VALUES(last_valor), last_valor),
+        last_ts = GREATEST(last_ts, VALUES(last_ts));
+"""
+
+
+def create_rollup_tables(cursor):
+    for level in ROLLUP_LEVELS:
+        cursor.execute(ROLLUP_DDL.format(level=level))
+
+
+def aggregate(readings: Iterable[tuple[str, float, datetime]]) -> dict[str, list[tuple]]:
+    """
+    Agrega un lote de (sensor_type, valor, hora) por nivel y cubeta.
+    Regresa, por nivel, las filas listas para ROLLUP_UPSERT.
+    """
+    per_level: dict[str, dict[tuple, list]] = {level: {} for level in ROLLUP_LEVELS}
+
+    for sensor_type, value, measured_at in readings:
+        for level, truncate in _TRUNCATE.items():
+            key = (sensor_type, truncate(measured_at))
+            acc = per_level[level].get(key)
+            if acc is None:
+                per_level[level][key] = [value, value, value, 1, value, measured_at]
+                continue
+            acc[0] = min(acc[0], value)
+            acc[1] = max(acc[1], value)
+            acc[2] += value
+            acc[3] += 1
+            if measured_at >= acc[5]:
+                acc[4] = value
+                acc[5] = measured_at
+
+    return {
+        level: [key + tuple(acc) for key, acc in buckets.items()]
+        for level, buckets in per_level.items()
+    }
+
+
+def upsert_rollups(cursor, readings: Iterable[tuple[str, float, datetime]]):
+    """
+    Suma un lote a los rollups. Debe ir en la misma transacción que el INSERT crudo.
+    """
+    for level, rows in aggregate(readings).items():
+        if rows:
+            # Orden fijo de llaves: dos hilos escribiendo a la vez toman los
+            # locks en el mismo orden y no se bloquean mutuamente (deadlock)
+            rows.sort(key=lambda r: (r[0], r[1]))
+            cursor.executemany(ROLLUP_UPSERT.format(level=level), rows)
+
+
+# -------------------------------
+# BACKFILL DESDE LAS TABLAS CRUDAS
+# -------------------------------
+
+def backfill(conn, sources: dict[str, tuple[str, str, tuple]]):
+    """
+    Calcula rollups de lecturas crudas anteriores al primer rollup de cada
+    sensor/nivel. Toda lectura previa a esa cubeta cae en cubetas anteriores,
+    así que no se cuenta nada dos veces.
+
+    `sources`: sensor -> (FROM ... WHERE filtro, columna de tiempo, params)
+    """
+    cursor = conn.cursor()
+    for level in ROLLUP_LEVELS:
+        fmt = _TRUNCATE_SQL[level]
+        for sensor_type, (source, time_col, params) in sources.items():
+            cursor.execute(
+                f"SELECT MIN(bucket) FROM rollup_{level} WHERE sensor_type = %s",
+                (sensor_type,),
+            )
+            first_bucket = cursor.fetchone()[0] or datetime.max.replace(microsecond=0)
+
+            # last_valor: el valor con la hora más reciente de la cubeta
+            # (GROUP_CONCAT se trunca al final, pero solo nos importa el primero)
+            cursor.execute(
+                f"""
+                INSERT INTO rollup_{level}
+                    (sensor_type, bucket, min_valor, max_valor, sum_valor,
+                     count_valor, last_valor, last_ts)
+                SELECT
+                    %s,
+                    DATE_FORMAT({time_col}, %s) AS b,
+                    MIN(valor), MAX(valor), SUM(valor), COUNT(*),
+                    SUBSTRING_INDEX(GROUP_CONCAT(valor ORDER BY {time_col} DESC), ',', 1) + 0,
+                    MAX({time_col})
+                FROM {source} AND {time_col} < %s
+                GROUP BY b;
+                """,
+                (sensor_type, fmt) + params + (first_bucket,),
+            )
+            conn.commit()
+            print(f"[ROLLUP] {level} '{sensor_type}': {cursor.rowcount} cubetas")
+    cursor.close()
+
+
+def main():
+    from db_writer import STORAGE_NARROW
+    from mqtt_listener import ALLOWED_TABLES, DB_CONFIG, STORAGE_MODE
+
+    parser = argparse.ArgumentParser(description="Tablas de rollups")
+    parser.add_argument("--backfill", action="store_true", help="calcula rollups de lecturas viejas")
+    args = parser.parse_args()
+
+    if STORAGE_MODE == STORAGE_NARROW:
+        sources = {t: ("mediciones WHERE sensor_type = %s", "ts", (t,)) for t in ALLOWED_TABLES}
+    else:
+        sources = {t: (f"{t} WHERE 1 = 1", "hora_medicion", ()) for t in ALLOWED_TABLES}
+
+    conn = None
+    try:
+        conn = mysql.connector.connect(**DB_CONFIG, use_pure=True)
+        cursor = conn.cursor()
+        create_rollup_tables(cursor)
+        conn.commit()
+        cursor.close()
+        print("[ROLLUP] Tablas listas")
+        if args.backfill:
+            backfill(conn, sources)
+    except Error as e:
+        print(f"[MySQL ERROR] {e}")
+    finally:
+        if conn:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+# Registro único de sensores (nombre, unidad, rango válido) compartido con
+# el backend y el simulador: ../sensores.json
+SENSORS_FILE = os.getenv(
+    "SENSORS_FILE", str(Path(__file__).resolve().parent.parent / "sensores.json")
+)
+
+
+def load_sensor_registry(path: str = SENSORS_FILE) -> dict[str, dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def is_valid_reading(cfg: dict[str, Any], value: float) -> bool:
+    """
+    Descarta NaN/inf y valores fuera del rango físico del sensor.
+    """
+    if value != value or value in (float("inf"), float("-inf")):
+        return False
+    low = cfg.get("min")
+    high = cfg.get("max")
+    return (low is None or value >= low) and (high is None or value <= high)
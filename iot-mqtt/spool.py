@@ -0,0 +1,558 @@
+"""
+Spool local (write-ahead) entre MQTT y MySQL.
+
+Con SPOOL_DIR configurado, el listener no encola las lecturas en memoria:
+las agrega a archivos de segmento append-only en disco y sigue. Un hilo
+drenador las lee de ahí y las inserta en la BD en lotes grandes; si MySQL
+está caído o lento, los datos se acumulan en disco y el drenador reintenta
+el mismo lote hasta que la BD responde.
+
+Un error de un registro (dato que no cabe en la columna, tipo inválido,
+...) no debe atorar el spool: el lote se parte en mitades hasta aislar los
+registros culpables, que se apartan a dead_letter.jsonl (una línea JSON
+por registro, con el error) y el resto se inserta. Los errores de todo el
+entorno (tabla o columna que no existe, permisos, fallas al crear las
+tablas) no se apartan: si las dos mitades fallan igual, el lote completo
+se reintenta con backoff hasta que alguien arregle la configuración.
+
+Formato de cada registro: `<II` (largo, crc32) + JSON
+[sensor_type, valor, epoch, device, unit]. Los segmentos se rotan por
+tamaño (`000...0001.seg`, `000...0002.seg`, ...) y se borran cuando el
+checkpoint (checkpoint.json: segmento + offset) los deja atrás.
+
+El fsync se hace en grupo cada `fsync_interval` segundos; el drenador solo
+lee hasta la última posición sincronizada. La entrega a la BD es
+at-least-once: si el proceso muere entre el commit y el checkpoint, el
+último lote se vuelve a insertar.
+
+Para drenar a mano un spool que quedó con datos:
+    python spool.py --drenar /var/lib/iot/spool/main
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Optional
+
+from mysql.connector import Error, InterfaceError, OperationalError, PoolError, pooling
+
+from db_writer import write_rows
+from observabilidad import DB_CONNECTIONS_IN_USE, DB_ROWS, DB_WRITE_SECONDS
+from rollups import create_rollup_tables
+
+log = logging.getLogger("iot.spool")
+
+HEADER = struct.Struct("<II")
+SEGMENT_SUFFIX = ".seg"
+CHECKPOINT_FILE = "checkpoint.json"
+DEAD_LETTER_FILE = "dead_letter.jsonl"
+
+
+class SetupError(Error):
+    """
+    No se pudo crear el pool o las tablas de rollup: no depende del lote.
+    """
+
+
+# Errores que no dependen del lote: conexión, locks, permisos, disco lleno,
+# servidor en solo lectura, esquema incompleto. Se reintenta el mismo lote
+# con backoff.
+RETRY_ERRORS = (InterfaceError, OperationalError, PoolError, SetupError)
+RETRY_ERRNOS = {
+    1021, 1114,        # disco / tabla llena
+    1044, 1045, 1049,  # permisos, base de datos inexistente
+    1142, 1143,        # INSERT/CREATE o columna sin permiso
+    1054, 1146,        # columna o tabla inexistente (esquema, no el registro)
+    1205, 1213,        # lock wait timeout, deadlock
+    1290, 1836,        # solo lectura
+    2003, 2006, 2013, 2055,  # conexión perdida
+}
+# Errores de un registro en particular: esos van directo a dead letter
+DATA_ERRNOS = {
+    1048,  # NULL en columna NOT NULL
+    1264,  # valor fuera de rango
+    1366,  # valor incorrecto para la columna
+    1406,  # dato demasiado largo
+}
+
+Position = tuple[int, int]  # (segmento, offset)
+
+
+def segment_name(segment: int) -> str:
+    return f"{segment:020d}{SEGMENT_SUFFIX}"
+
+
+def is_retryable(error: Error) -> bool:
+    return isinstance(error, RETRY_ERRORS) or error.errno in RETRY_ERRNOS
+
+
+def is_record_error(error: Exception) -> bool:
+    if isinstance(error, Error):
+        return error.errno in DATA_ERRNOS
+    return True  # ValueError & cía.: el registro no tiene la forma esperada
+
+
+class Spool:
+    """
+    Lado de escritura: `append` solo serializa y escribe al buffer del
+    archivo (rápido, sin tocar la red); un hilo hace flush + fsync en grupo.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 64 * 1024 * 1024,
+        fsync_interval: float = 0.2,
+        max_bytes: int = 0,
+    ):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.appended = 0
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment = 0
+        self._offset = 0
+        self._durable: Position = (0, 0)
+        self._bytes_on_disk = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="spool-fsync", daemon=True)
+
+    # -------------------------------
+    # API PÚBLICA
+    # -------------------------------
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        existing = self.segments()
+        self._bytes_on_disk = sum(
+            os.path.getsize(self.segment_path(s)) for s in existing
+        )
+        # Nunca se escribe sobre un segmento viejo: pudo quedar con un
+        # registro a medias si el proceso murió
+        self._open_segment((existing[-1] + 1) if existing else 1)
+        self._thread.start()
+
+    def append(
+        self,
+        sensor_type: str,
+        value: float,
+        measured_at: datetime,
+        device: str,
+        unit: Optional[str],
+    ) -> bool:
+        """
+        Agrega una lectura. Regresa False si no se pudo escribir
+        (disco lleno o se rebasó `max_bytes`).
+        """
+        payload = json.dumps(
+            [sensor_type, value, measured_at.timestamp(), device, unit],
+            separators=(",", ":"),
+        ).encode()
+        record = HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+        with self._lock:
+            if self.max_bytes and self._bytes_on_disk + len(record) > self.max_bytes:
+                self.dropped += 1
+                return False
+            try:
+                self._file.write(record)
+            except OSError as e:
+                log.error("No se pudo escribir: %s", e)
+                self.dropped += 1
+                return False
+            self._offset += len(record)
+            self._bytes_on_disk += len(record)
+            self.appended += 1
+            if self._offset >= self.segment_bytes:
+                self._rotate()
+        return True
+
+    def durable_position(self) -> Position:
+        """
+        Hasta dónde está en disco con fsync (siempre en límite de registro).
+        """
+        with self._lock:
+            return self._durable
+
+    def segments(self) -> list[int]:
+        return sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, segment_name(segment))
+
+    def remove_before(self, segment: int):
+        """
+        Borra los segmentos anteriores a `segment` (ya drenados).
+        """
+        for s in self.segments():
+            if s >= segment:
+                break
+            path = self.segment_path(s)
+            size = os.path.getsize(path)
+            os.remove(path)
+            with self._lock:
+                self._bytes_on_disk -= size
+
+    def pending_bytes(self) -> int:
+        with self._lock:
+            return self._bytes_on_disk
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            self._sync()
+            self._file.close()
+
+    # -------------------------------
+    # INTERNOS (con self._lock tomado)
+    # -------------------------------
+
+    def _open_segment(self, segment: int):
+        self._segment = segment
+        self._offset = 0
+        self._file = open(self.segment_path(segment), "ab", buffering=1024 * 1024)
+        self._durable = (segment, 0)
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        self._open_segment(self._segment + 1)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._durable = (self._segment, self._offset)
+
+    def _run(self):
+        while not self._stop.wait(self.fsync_interval):
+            with self._lock:
+                if self._durable == (self._segment, self._offset):
+                    continue
+                self._file.flush()
+                position = (self._segment, self._offset)
+                # fsync fuera del lock (sobre un dup del descriptor, por si
+                # mientras tanto se rota y se cierra el archivo) para no
+                # frenar a `append`
+                fd = os.dup(self._file.fileno())
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            with self._lock:
+                if position > self._durable:
+                    self._durable = position
+
+
+class SpoolDrainer:
+    """
+    Lado de lectura: lleva el spool a MySQL en lotes de hasta `batch_size`
+    filas, guardando el checkpoint después de cada commit.
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        db_config: dict[str, Any],
+        storage_mode: str,
+        rollups: bool = True,
+        batch_size: int = 5000,
+        poll_interval: float = 0.5,
+        max_backoff: float = 30.0,
+    ):
+        self.spool = spool
+        self.storage_mode = storage_mode
+        self.rollups = rollups
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.rows_written = 0
+        self.errors = 0
+        self.dead_letters = 0
+
+        self._db_config = db_config
+        self._pool = None
+        # El spool ya debe estar iniciado (directorio creado)
+        self._checkpoint_path = os.path.join(spool.directory, CHECKPOINT_FILE)
+        self._dead_letter_path = os.path.join(spool.directory, DEAD_LETTER_FILE)
+        self._position: Position = self._load_checkpoint()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="spool-drainer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def close(self, timeout: float = 10.0):
+        """
+        Intenta drenar lo que quede hasta `timeout`; lo que no alcance se
+        queda en disco para el próximo arranque.
+        """
+        self._stop.set()
+        self._thread.join(timeout)
+
+    # -------------------------------
+    # CHECKPOINT
+    # -------------------------------
+
+    def _load_checkpoint(self) -> Position:
+        try:
+            with open(self._checkpoint_path, encoding="utf-8") as f:
+                data = json.load(f)
+            return (int(data["segment"]), int(data["offset"]))
+        except FileNotFoundError:
+            existing = self.spool.segments()
+            return (existing[0], 0) if existing else (0, 0)
+
+    def _save_checkpoint(self, position: Position):
+        tmp = self._checkpoint_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"segment": position[0], "offset": position[1]}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._checkpoint_path)
+
+    # -------------------------------
+    # LECTURA
+    # -------------------------------
+
+    def read_batch(self, position: Position) -> tuple[list[list], Position]:
+        """
+        Lee hasta `batch_size` registros a partir de `position`, sin pasar
+        de la posición sincronizada. Regresa los registros y la posición
+        siguiente.
+        """
+        limit = self.spool.durable_position()
+        segment, offset = position
+        records: list[list] = []
+
+        while len(records) < self.batch_size and (segment, offset) < limit:
+            path = self.spool.segment_path(segment)
+            if not os.path.exists(path):
+                later = [s for s in self.spool.segments() if s > segment]
+                if not later:
+                    break
+                segment, offset = later[0], 0
+                continue
+
+            end = limit[1] if segment == limit[0] else os.path.getsize(path)
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read(max(0, end - offset))
+
+            pos = 0
+            corrupt = False
+            while len(records) < self.batch_size and pos + HEADER.size <= len(data):
+                length, crc = HEADER.unpack_from(data, pos)
+                payload = data[pos + HEADER.size: pos + HEADER.size + length]
+                if len(payload) < length:
+                    break
+                if zlib.crc32(payload) != crc:
+                    corrupt = True
+                    break
+                records.append(json.loads(payload))
+                pos += HEADER.size + length
+            offset += pos
+
+            if len(records) >= self.batch_size:
+                break
+            if corrupt or offset < end:
+                # Registro dañado o cortado (p. ej. el proceso murió a medio
+                # escribir): se salta el resto hasta `end`, que siempre es
+                # límite de registro
+                log.warning(
+                    "Registro inválido en %s@%d, se salta hasta %d", segment_name(segment), offset, end
+                )
+                offset = end
+            if segment < limit[0]:
+                segment, offset = segment + 1, 0
+            else:
+                break
+
+        return records, (segment, offset)
+
+    # -------------------------------
+    # ESCRITURA A LA BD
+    # -------------------------------
+
+    def _connect(self):
+        """
+        Perezoso: el listener arranca aunque MySQL esté caído. Cualquier
+        falla aquí es SetupError (reintentable), nunca culpa del lote.
+        """
+        if self._pool is not None:
+            return
+        try:
+            pool = pooling.MySQLConnectionPool(
+                pool_name="iot_spool", pool_size=1, use_pure=True, **self._db_config
+            )
+            if self.rollups:
+                conn = pool.get_connection()
+                try:
+                    cursor = conn.cursor()
+                    create_rollup_tables(cursor)
+                    conn.commit()
+                    cursor.close()
+                finally:
+                    conn.close()
+        except Error as e:
+            raise SetupError(msg=f"No se pudo preparar la BD: {e.msg}", errno=e.errno) from e
+        self._pool = pool
+
+    def _write(self, records: list[list]):
+        self._connect()
+        pending: dict[str, list[tuple]] = defaultdict(list)
+        for sensor_type, value, epoch, device, unit in records:
+            pending[sensor_type].append((value, datetime.fromtimestamp(epoch), device, unit))
+
+        started = time.perf_counter()
+        conn = self._pool.get_connection()
+        DB_CONNECTIONS_IN_USE.labels("spool").inc()
+        try:
+            cursor = conn.cursor()
+            try:
+                write_rows(cursor, self.storage_mode, pending, self.rollups)
+                conn.commit()
+            except Error:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        finally:
+            conn.close()
+            DB_CONNECTIONS_IN_USE.labels("spool").dec()
+            DB_WRITE_SECONDS.labels("spool").observe(time.perf_counter() - started)
+        DB_ROWS.labels("spool", "ok").inc(len(records))
+
+    def drain_once(self) -> int:
+        """
+        Un lote: lee, inserta, guarda checkpoint. Regresa las filas escritas.
+        """
+        records, next_position = self.read_batch(self._position)
+        if records:
+            self.rows_written += self._write_isolating(records)
+        if next_position != self._position:
+            self._save_checkpoint(next_position)
+            self._position = next_position
+            self.spool.remove_before(next_position[0])
+        return len(records)
+
+    def _write_isolating(self, records: list[list]) -> int:
+        """
+        Escribe `records`; si fallan por algo que no se arregla reintentando,
+        parte el lote en mitades hasta dar con los registros culpables y los
+        manda a dead letter. Regresa las filas escritas. Los errores
+        reintentables se propagan (las mitades ya escritas se vuelven a
+        insertar en el reintento: at-least-once, como siempre).
+        """
+        error = self._try_write(records)
+        if error is None:
+            return len(records)
+        return self._isolate(records, error, top=True)
+
+    def _isolate(self, records: list[list], error: Exception, top: bool = False) -> int:
+        if len(records) == 1:
+            self._dead_letter(records[0], error)
+            return 0
+        mid = len(records) // 2
+        halves = (records[:mid], records[mid:])
+        errors = [self._try_write(half) for half in halves]
+        if (
+            top
+            and all(e is not None for e in errors)
+            and not any(is_record_error(e) for e in errors)
+            and getattr(errors[0], "errno", None) == getattr(errors[1], "errno", None)
+        ):
+            # Fallan las dos mitades con el mismo error: no es un registro,
+            # es el entorno. Se reintenta el lote en lugar de vaciar el spool
+            raise errors[0]
+        return sum(
+            len(half) if e is None else self._isolate(half, e)
+            for half, e in zip(halves, errors)
+        )
+
+    def _try_write(self, records: list[list]) -> Optional[Exception]:
+        """
+        Regresa el error si el lote falló por algo que reintentar no arregla.
+        """
+        try:
+            self._write(records)
+            return None
+        except Error as e:
+            if is_retryable(e):
+                raise
+            return e
+        except (ValueError, TypeError, OverflowError) as e:
+            # Registro con forma o tipos inválidos (no llegó a la BD)
+            return e
+
+    def _dead_letter(self, record: list, error: Exception):
+        line = json.dumps({"record": record, "error": str(error), "at": time.time()}, default=str)
+        with open(self._dead_letter_path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+            f.flush()
+            # Antes de que el checkpoint deje atrás el registro
+            os.fsync(f.fileno())
+        self.dead_letters += 1
+        DB_ROWS.labels("spool", "dead_letter").inc()
+        log.error("Registro apartado a %s (%s): %r", DEAD_LETTER_FILE, error, record)
+
+    def _run(self):
+        backoff = self.poll_interval
+        while True:
+            try:
+                written = self.drain_once()
+                backoff = self.poll_interval
+            except Error as e:
+                # La BD no responde o el error es de todo el lote (esquema,
+                # permisos): el lote se queda en disco y se reintenta
+                self.errors += 1
+                log.warning("No se pudo escribir el lote, reintento en %.1fs: %s", backoff, e)
+                if self._stop.wait(backoff):
+                    return
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            if written < self.batch_size:
+                if self._stop.is_set():
+                    return
+                self._stop.wait(self.poll_interval)
+
+
+def main():
+    from mqtt_listener import DB_CONFIG, STORAGE_MODE, WRITER_CONFIG
+
+    parser = argparse.ArgumentParser(description="Drena un spool local hacia MySQL")
+    parser.add_argument("--drenar", required=True, help="directorio del spool")
+    parser.add_argument("--lote", type=int, default=5000, help="filas por transacción")
+    args = parser.parse_args()
+
+    spool = Spool(args.drenar)
+    spool.start()
+    drainer = SpoolDrainer(spool, DB_CONFIG, STORAGE_MODE, WRITER_CONFIG["rollups"], args.lote)
+
+    # Se drena en este hilo, sin arrancar el del drenador
+    started = time.perf_counter()
+    try:
+        while drainer.drain_once():
+            pass
+    finally:
+        spool.close()
+    print(f"[SPOOL] {drainer.rows_written} filas drenadas en {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
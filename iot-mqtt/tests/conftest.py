@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del listener son scripts sueltos en iot-mqtt/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,170 @@
+import queue
+from datetime import datetime, timedelta
+
+from alertas import (
+    DANGER,
+    RULE_RATE,
+    RULE_THRESHOLD,
+    WARNING,
+    AlertEngine,
+    AlertEvaluator,
+    AlertForwarder,
+)
+
+T0 = datetime(2026, 1, 1, 12, 0, 0)
+
+SENSORS = {
+    "temperatura": {
+        "alertas": {
+            "warning_high": 28, "danger_high": 32,
+            "warning_low": 18, "danger_low": 15,
+            "histeresis": 0.5, "sostenido_s": 10,
+            "cambio_max": 5, "ventana_s": 300,
+        },
+    },
+    "presion": {},
+}
+
+
+def feed(engine, readings, sensor="temperatura", device="dev-1", step=1.0):
+    """
+    Manda `readings` cada `step` segundos; regresa [(segundo, evento)].
+    """
+    out = []
+    for i, value in enumerate(readings):
+        at = T0 + timedelta(seconds=i * step)
+        for event in engine.evaluate(sensor, value, at, device):
+            out.append((i * step, event))
+    return out
+
+
+def threshold_events(events):
+    return [(t, e) for t, e in events if e.rule == RULE_THRESHOLD]
+
+
+def test_sustained_warning_opens_after_hold():
+    events = threshold_events(feed(AlertEngine(SENSORS), [29] * 15))
+    assert len(events) == 1
+    t, event = events[0]
+    assert t == 10
+    assert (event.severity, event.message, event.resolved) == (WARNING, "Temperatura elevada", False)
+
+
+def test_short_excursion_does_not_alert():
+    events = threshold_events(feed(AlertEngine(SENSORS), [29] * 5 + [25] * 10 + [29] * 5))
+    assert events == []
+
+
+def test_changing_level_above_threshold_keeps_sustained_timer():
+    # Regresión: 29 -> 33 -> 29 (siempre arriba de warning_high) por 30 s
+    readings = [29] * 3 + [33] * 3 + [29] * 3
+    events = threshold_events(feed(AlertEngine(SENSORS), readings * 4))
+    opened = [(t, e) for t, e in events if not e.resolved]
+    assert opened, "no se abrió ninguna alerta"
+    t, event = opened[0]
+    assert t == 10
+    assert event.severity == WARNING
+    assert event.message == "Temperatura elevada"
+
+
+def test_sustained_danger_escalates_from_warning():
+    events = threshold_events(feed(AlertEngine(SENSORS), [29] * 12 + [33] * 12))
+    opened = [(t, e.severity) for t, e in events if not e.resolved]
+    assert opened == [(10, WARNING), (22, DANGER)]
+    resolved = [(t, e.severity) for t, e in events if e.resolved]
+    assert resolved == [(22, WARNING)]
+
+
+def test_danger_sustained_from_start_opens_danger_directly():
+    events = threshold_events(feed(AlertEngine(SENSORS), [33] * 12))
+    assert [(t, e.severity, e.message) for t, e in events] == [(10, DANGER, "Temperatura muy alta")]
+
+
+def test_hysteresis_keeps_alert_open_near_threshold():
+    engine = AlertEngine(SENSORS)
+    events = threshold_events(feed(engine, [29] * 11 + [27.8] * 5 + [27.2]))
+    assert [(t, e.resolved) for t, e in events] == [(10, False), (16, True)]
+
+
+def test_low_side_message():
+    events = threshold_events(feed(AlertEngine(SENSORS), [17] * 11))
+    assert [e.message for _, e in events] == ["Temperatura fuera de rango"]
+
+
+def test_series_are_independent_per_device():
+    engine = AlertEngine(SENSORS)
+    for i in range(11):
+        at = T0 + timedelta(seconds=i)
+        engine.evaluate("temperatura", 29, at, "dev-1")
+        engine.evaluate("temperatura", 22, at, "dev-2")
+    events = engine.evaluate("temperatura", 29, T0 + timedelta(seconds=11), "dev-2")
+    assert [e for e in events if e.rule == RULE_THRESHOLD] == []
+
+
+def test_rate_rule_opens_and_clears():
+    readings = [20, 21, 27, 27, 27]
+    events = [(t, e) for t, e in feed(AlertEngine(SENSORS), readings) if e.rule == RULE_RATE]
+    assert [(t, e.resolved) for t, e in events] == [(2, False)]
+
+    # Pasada la ventana el cambio se "olvida" y la alerta se resuelve
+    engine = AlertEngine(SENSORS)
+    feed(engine, readings, step=100)
+    cleared = engine.evaluate("temperatura", 27, T0 + timedelta(seconds=900), "dev-1")
+    assert [(e.rule, e.resolved) for e in cleared] == [(RULE_RATE, True)]
+
+
+def test_sensor_without_rules_is_ignored():
+    assert feed(AlertEngine(SENSORS), [1e9] * 20, sensor="presion") == []
+
+
+def test_workers_share_one_engine_through_the_supervisor():
+    # Dos workers reciben lecturas alternadas del mismo dispositivo: con un
+    # motor por worker cada uno abriría su propia alerta
+    channel = queue.Queue()
+    events = []
+    evaluator = AlertEvaluator(AlertEngine(SENSORS), channel, events.extend)
+    evaluator.start()
+    workers = [AlertForwarder(channel, SENSORS, flush_interval=3600) for _ in range(2)]
+    for i in range(15):
+        workers[i % 2].submit("temperatura", 29, T0 + timedelta(seconds=i), "dev-1")
+        workers[i % 2].submit("presion", 1e9, T0 + timedelta(seconds=i), "dev-1")
+        workers[i % 2]._flush()
+    evaluator.close()
+
+    opened = [e for e in events if e.rule == RULE_THRESHOLD and not e.resolved]
+    assert [(e.severity, e.at) for e in opened] == [(WARNING, T0 + timedelta(seconds=10))]
+
+
+def test_forwarder_drops_instead_of_blocking():
+    channel = queue.Queue(maxsize=1)
+    forwarder = AlertForwarder(channel, SENSORS, flush_interval=3600, max_pending=3)
+    for i in range(5):
+        forwarder.submit("temperatura", 29, T0 + timedelta(seconds=i), "dev-1")
+    forwarder._flush()
+    forwarder.submit("temperatura", 29, T0, "dev-1")
+    forwarder._flush()
+    assert forwarder.dropped == 2 + 1
+    assert len(channel.get_nowait()) == 3
+
+
+def test_hysteresis_does_not_turn_normal_value_into_low_alert():
+    # 18.3 es normal, pero está dentro de la histéresis del umbral bajo (18)
+    events = threshold_events(feed(AlertEngine(SENSORS), [29] * 11 + [18.3] * 5))
+    assert [(t, e.message, e.resolved) for t, e in events] == [
+        (10, "Temperatura elevada", False),
+        (11, "Temperatura elevada", True),
+    ]
+
+
+def test_direction_flip_closes_alert_and_restarts_hold():
+    events = threshold_events(feed(AlertEngine(SENSORS), [29] * 11 + [17] * 12))
+    assert [(t, e.message, e.resolved) for t, e in events] == [
+        (10, "Temperatura elevada", False),
+        (11, "Temperatura elevada", True),
+        (21, "Temperatura fuera de rango", False),
+    ]
+
+
+def test_short_flip_to_other_side_does_not_alert():
+    events = threshold_events(feed(AlertEngine(SENSORS), [29] * 11 + [17] * 5 + [22] * 10))
+    assert [e for _, e in events if e.message == "Temperatura fuera de rango"] == []
@@ -0,0 +1,69 @@
+import struct
+
+import pytest
+
+from formato_binario import HEADER, MAGIC, RECORD, BinaryFormatError, decode, encode, is_binary
+
+
+def test_round_trip():
+    readings = [(1, 0, 21.5), (2, 250, 55.25), (5, 1000, 300.0)]
+    payload = encode("arduino-sensores-casa-1", readings, base_ts_ms=1_767_268_800_000)
+
+    assert is_binary(payload)
+    assert len(payload) == HEADER.size + 1 + len("arduino-sensores-casa-1") + 3 * RECORD.size
+
+    device, base_ts_ms, decoded = decode(payload)
+    assert device == "arduino-sensores-casa-1"
+    assert base_ts_ms == 1_767_268_800_000
+    assert list(decoded) == readings
+
+
+def test_float32_values_round_trip_to_nearest_float32():
+    device, _, decoded = decode(encode("d", [(1, 0, 21.3)]))
+    (_, _, value), = decoded
+    assert value == struct.unpack("<f", struct.pack("<f", 21.3))[0]
+    assert float(f"{value:.7g}") == 21.3
+
+
+def test_empty_device_and_no_readings():
+    device, base_ts_ms, decoded = decode(encode("", []))
+    assert device == ""
+    assert base_ts_ms == 0
+    assert list(decoded) == []
+
+
+def test_json_is_not_binary():
+    assert not is_binary(b'{"type":"temperatura","value":21.5}')
+    assert not is_binary(b"")
+
+
+def test_too_short():
+    with pytest.raises(BinaryFormatError, match="corto"):
+        decode(bytes([MAGIC, 1, 0]))
+
+
+def test_wrong_magic():
+    payload = bytearray(encode("d", [(1, 0, 1.0)]))
+    payload[0] = 0x00
+    with pytest.raises(BinaryFormatError, match="no es un mensaje binario"):
+        decode(bytes(payload))
+
+
+def test_unsupported_version():
+    payload = bytearray(encode("d", [(1, 0, 1.0)]))
+    payload[1] = 2
+    with pytest.raises(BinaryFormatError, match="versión"):
+        decode(bytes(payload))
+
+
+@pytest.mark.parametrize("cut", [1, RECORD.size - 1, RECORD.size])
+def test_truncated_body(cut):
+    payload = encode("d", [(1, 0, 1.0), (2, 0, 2.0)])
+    with pytest.raises(BinaryFormatError, match="se esperaban 2 lecturas"):
+        decode(payload[:-cut])
+
+
+def test_trailing_bytes():
+    payload = encode("d", [(1, 0, 1.0)]) + b"\x00"
+    with pytest.raises(BinaryFormatError, match="se esperaban 1 lecturas"):
+        decode(payload)
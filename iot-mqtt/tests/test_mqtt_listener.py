@@ -0,0 +1,15 @@
+from types import SimpleNamespace
+
+import pytest
+
+import mqtt_listener
+from observabilidad import PARSE_FAILURES
+
+
+@pytest.mark.parametrize("payload", [b"123", b'"x"', b"[1]", b"null", b"{no es json", b'{"type": "t", "value": [1]}'])
+def test_bad_json_is_counted_and_does_not_raise(payload):
+    failures = PARSE_FAILURES.labels("json")
+    before = failures._value.get()
+    # Una excepción aquí la relanza paho y mata su hilo de red
+    mqtt_listener.on_message(None, None, SimpleNamespace(payload=payload))
+    assert failures._value.get() == before + 1
@@ -0,0 +1,262 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+from mysql.connector import DatabaseError, OperationalError, ProgrammingError
+
+from spool import DEAD_LETTER_FILE, HEADER, SetupError, Spool, SpoolDrainer
+
+AT = datetime(2026, 1, 1, 12, 0, 0)
+
+
+def make_spool(directory, **kwargs) -> Spool:
+    kwargs.setdefault("fsync_interval", 0.01)
+    spool = Spool(str(directory), **kwargs)
+    spool.start()
+    return spool
+
+
+def make_drainer(spool, written, batch_size=100) -> SpoolDrainer:
+    drainer = SpoolDrainer(spool, {}, "narrow", rollups=False, batch_size=batch_size)
+    drainer._write = written.extend
+    return drainer
+
+
+def append_values(spool, values):
+    for v in values:
+        assert spool.append("temperatura", float(v), AT, "dev-1", "C")
+
+
+def drain_all(drainer) -> int:
+    """
+    Registros leídos (escritos o apartados) hasta vaciar el spool.
+    """
+    total = 0
+    while True:
+        n = drainer.drain_once()
+        total += n
+        if n == 0:
+            return total
+
+
+def values(records):
+    return [r[1] for r in records]
+
+
+def test_drain_round_trip_and_checkpoint(tmp_path):
+    spool = make_spool(tmp_path)
+    append_values(spool, range(10))
+    spool.close()
+
+    written = []
+    drainer = make_drainer(spool, written)
+    assert drain_all(drainer) == 10
+    assert values(written) == [float(v) for v in range(10)]
+    assert written[0] == ["temperatura", 0.0, AT.timestamp(), "dev-1", "C"]
+
+    # Otro drenador sobre el mismo directorio arranca desde el checkpoint
+    again = []
+    assert drain_all(make_drainer(spool, again)) == 0
+    assert again == []
+
+
+def test_read_stops_at_durable_position(tmp_path):
+    spool = make_spool(tmp_path, fsync_interval=3600)
+    append_values(spool, range(5))
+    written = []
+    drainer = make_drainer(spool, written)
+    # Sin fsync todavía: no hay nada que leer
+    assert drainer.drain_once() == 0
+    spool.close()
+    assert drain_all(drainer) == 5
+
+
+def test_rotation_removes_drained_segments(tmp_path):
+    spool = make_spool(tmp_path, segment_bytes=200)
+    append_values(spool, range(50))
+    spool.close()
+    assert len(spool.segments()) > 5
+
+    written = []
+    drainer = make_drainer(spool, written, batch_size=7)
+    assert drain_all(drainer) == 50
+    assert values(written) == [float(v) for v in range(50)]
+    # Solo queda el segmento donde está el checkpoint
+    assert len(spool.segments()) <= 1
+
+
+def test_restart_mid_segment_resumes_without_duplicates(tmp_path):
+    spool = make_spool(tmp_path)
+    append_values(spool, range(20))
+    spool.close()
+
+    first = []
+    drainer = make_drainer(spool, first, batch_size=8)
+    assert drainer.drain_once() == 8
+
+    # "Reinicio": spool y drenador nuevos sobre el mismo directorio
+    spool = make_spool(tmp_path)
+    append_values(spool, range(20, 25))
+    spool.close()
+    rest = []
+    assert drain_all(make_drainer(spool, rest, batch_size=8)) == 17
+    assert values(first + rest) == [float(v) for v in range(25)]
+
+
+def test_torn_tail_is_skipped_and_next_segment_is_read(tmp_path):
+    spool = make_spool(tmp_path)
+    append_values(spool, range(3))
+    spool.close()
+
+    # El proceso murió a medio escribir un registro: cabecera completa,
+    # payload cortado
+    path = spool.segment_path(spool.segments()[-1])
+    with open(path, "ab") as f:
+        f.write(HEADER.pack(100, 0) + b'["temperatura", 9')
+
+    spool = make_spool(tmp_path)
+    append_values(spool, [3, 4])
+    spool.close()
+
+    written = []
+    assert drain_all(make_drainer(spool, written)) == 5
+    assert values(written) == [0.0, 1.0, 2.0, 3.0, 4.0]
+
+
+def test_corrupt_record_skips_rest_of_segment(tmp_path):
+    spool = make_spool(tmp_path)
+    append_values(spool, range(3))
+    spool.close()
+
+    # Se daña el payload del segundo registro (el crc ya no coincide)
+    path = spool.segment_path(spool.segments()[-1])
+    with open(path, "r+b") as f:
+        data = f.read()
+        first_len = HEADER.unpack_from(data)[0]
+        f.seek(HEADER.size + first_len + HEADER.size + 2)
+        f.write(b"X")
+
+    spool = make_spool(tmp_path)
+    append_values(spool, [7])
+    spool.close()
+
+    written = []
+    assert drain_all(make_drainer(spool, written)) == 2
+    assert values(written) == [0.0, 7.0]
+
+
+def test_retryable_error_keeps_batch_on_disk(tmp_path):
+    spool = make_spool(tmp_path)
+    append_values(spool, range(4))
+    spool.close()
+
+    written = []
+    drainer = make_drainer(spool, written)
+
+    def down(records):
+        raise OperationalError(msg="Lost connection", errno=2013)
+
+    drainer._write = down
+    with pytest.raises(OperationalError):
+        drainer.drain_once()
+
+    drainer._write = written.extend
+    assert drain_all(drainer) == 4
+    assert values(written) == [0.0, 1.0, 2.0, 3.0]
+
+
+def test_permanent_error_isolates_bad_record_to_dead_letter(tmp_path):
+    spool = make_spool(tmp_path)
+    append_values(spool, range(10))
+    spool.append("temperatura", 1.0, AT, "x" * 500, None)
+    append_values(spool, range(10, 15))
+    spool.close()
+
+    written = []
+    drainer = make_drainer(spool, written)
+
+    def write(records):
+        if any(len(r[3]) > 64 for r in records):
+            raise DatabaseError(msg="Data too long for column 'device'", errno=1406)
+        written.extend(records)
+
+    drainer._write = write
+    drain_all(drainer)
+    assert drainer.rows_written == 15
+    assert sorted(values(written)) == [float(v) for v in range(15)]
+    assert drainer.dead_letters == 1
+
+    with open(os.path.join(str(tmp_path), DEAD_LETTER_FILE), encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    assert [len(line["record"][3]) for line in lines] == [500]
+    assert "Data too long" in lines[0]["error"]
+
+
+def test_config_error_is_not_dead_lettered(tmp_path):
+    spool = make_spool(tmp_path)
+    append_values(spool, range(4))
+    spool.close()
+
+    drainer = make_drainer(spool, [])
+
+    def denied(records):
+        raise ProgrammingError(msg="Access denied", errno=1045)
+
+    drainer._write = denied
+    with pytest.raises(ProgrammingError):
+        drainer.drain_once()
+    assert drainer.dead_letters == 0
+    assert not os.path.exists(os.path.join(str(tmp_path), DEAD_LETTER_FILE))
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        ProgrammingError(msg="Table 'iot.mediciones' doesn't exist", errno=1146),
+        ProgrammingError(msg="INSERT command denied", errno=1142),
+        ProgrammingError(msg="Unknown column 'unit'", errno=1054),
+        SetupError(msg="No se pudo preparar la BD", errno=1142),
+    ],
+)
+def test_environment_error_on_every_record_is_retried(tmp_path, error):
+    spool = make_spool(tmp_path)
+    append_values(spool, range(8))
+    spool.close()
+
+    drainer = make_drainer(spool, [])
+
+    def broken(records):
+        raise error
+
+    drainer._write = broken
+    with pytest.raises(type(error)):
+        drainer.drain_once()
+    assert drainer.dead_letters == 0
+    assert not os.path.exists(os.path.join(str(tmp_path), DEAD_LETTER_FILE))
+
+    # Arreglada la configuración, el lote sale completo
+    written = []
+    drainer._write = written.extend
+    assert drain_all(drainer) == 8
+    assert values(written) == [float(v) for v in range(8)]
+
+
+def test_unknown_error_on_both_halves_is_not_dead_lettered(tmp_path):
+    spool = make_spool(tmp_path)
+    append_values(spool, range(8))
+    spool.close()
+
+    calls = []
+    drainer = make_drainer(spool, [])
+
+    def broken(records):
+        calls.append(len(records))
+        raise DatabaseError(msg="Unknown error", errno=1105)
+
+    drainer._write = broken
+    with pytest.raises(DatabaseError):
+        drainer.drain_once()
+    assert drainer.dead_letters == 0
+    # El lote y sus dos mitades, no una escritura por registro
+    assert calls == [8, 4, 4]
@@ -21,18 +21,34 @@ type ChartPoint = {
   isoTime: string
 }
 
+// Alerta generada por el motor del listener (GET /alerts y "alertas" en /ws)
+type ServerAlert = {
+  id: number
+  device: string
+  sensor: SensorKey
+  rule: string
+  severity: "warning" | "danger"
+  message: string
+  value: number
+  start: string
+  end: string | null
+}
+
 type WsPayload = {
   temperatura?: ApiPoint | null
   humedad?: ApiPoint | null
   presion?: ApiPoint | null
   luz?: ApiPoint | null
   gas?: ApiPoint | null
+  alertas?: ServerAlert[]
 }
 
 const API_BASE =
   process.env.NEXT_PUBLIC_API_BASE_URL || "http://127.0.0.1:8000"
 
-const MAX_POINTS = 200
+// Aquí solo se muestra el último valor; los umbrales se evalúan en el servidor
+const MAX_POINTS = 1
+const MAX_RECENT_ALERTS = 50
 
 const normalizePoint = (point: ApiPoint): ChartPoint => {
   const rawTime = point.time ?? ""
@@ -61,103 +77,54 @@ const getLatest = (data: ChartPoint[]) =>
   data.length > 0 ? data[data.length - 1] : null
 
 // --------------------------
-// Umbrales de alerta
+// Sensores y severidad
+// (los umbrales viven en sensores.json y los evalúa el listener)
 // --------------------------
 
 type Severity = "ok" | "warning" | "danger"
 
 type SensorKey = "temperatura" | "humedad" | "presion" | "luz" | "gas"
 
-type SensorConfig = {
-  key: SensorKey
-  label: string
-  unit: string
-  warningHigh?: number
-  dangerHigh?: number
-  warningLow?: number
-  dangerLow?: number
-}
-
-const SENSOR_CONFIGS: SensorConfig[] = [
-  {
-    key: "temperatura",
-    label: "Temperatura",
-    unit: "°C",
-    warningHigh: 28,
-    dangerHigh: 32,
-    warningLow: 18,
-    dangerLow: 15,
-  },
-  {
-    key: "humedad",
-    label: "Humedad",
-    unit: "%",
-    warningLow: 30,
-    dangerLow: 20,
-    warningHigh: 70,
-    dangerHigh: 85,
-  },
-  {
-    key: "presion",
-    label: "Presión",
-    unit: "hPa",
-    // aquí podría haber umbrales, pero por ahora la consideramos siempre ok
-  },
-  {
-    key: "luz",
-    label: "Luz",
-    unit: "%",
-    warningHigh: 80,
-    dangerHigh: 95,
-  },
-  {
-    key: "gas",
-    label: "Gas",
-    unit: "%",
-    warningHigh: 150,
-    dangerHigh: 300,
-  },
-]
-
 type Evaluation = {
   severity: Severity
   message: string
 }
 
-function evaluateValue(config: SensorConfig, value: number): Evaluation {
-  const { warningHigh, dangerHigh, warningLow, dangerLow, label } = config
+const SEVERITY_RANK: Record<Severity, number> = { ok: 0, warning: 1, danger: 2 }
 
-  // Altos
-  if (dangerHigh !== undefined && value >= dangerHigh) {
-    return {
-      severity: "danger",
-      message: `${label} muy alta`,
-    }
-  }
-  if (warningHigh !== undefined && value >= warningHigh) {
-    return {
-      severity: "warning",
-      message: `${label} elevada`,
+// La alerta abierta más grave del sensor, o "Dentro de rango"
+function evaluateSensor(sensor: SensorKey, active: ServerAlert[]): Evaluation {
+  let worst: Evaluation = { severity: "ok", message: "Dentro de rango" }
+  for (const alert of active) {
+    if (alert.sensor !== sensor) continue
+    if (SEVERITY_RANK[alert.severity] > SEVERITY_RANK[worst.severity]) {
+      worst = { severity: alert.severity, message: alert.message }
     }
   }
+  return worst
+}
 
-  // Bajos
-  if (dangerLow !== undefined && value <= dangerLow) {
-    return {
-      severity: "danger",
-      message: `${label} muy baja`,
-    }
-  }
-  if (warningLow !== undefined && value <= warningLow) {
-    return {
-      severity: "warning",
-      message: `${label} fuera de rango`,
+const formatAlertTime = (iso: string) =>
+  new Date(iso).toLocaleString("es-MX", {
+    day: "2-digit",
+    month: "2-digit",
+    hour: "2-digit",
+    minute: "2-digit",
+    hour12: false,
+  })
+
+async function fetchAlerts(): Promise<ServerAlert[]> {
+  const path = `/alerts?limit=${MAX_RECENT_ALERTS}`
+  try {
+    const res = await fetch(`${API_BASE}${path}`)
+    if (!res.ok) {
+      console.error("Error al hacer fetch de", path, res.status)
+      return []
     }
-  }
-
-  return {
-    severity: "ok",
-    message: "Dentro de rango",
+    return await res.json()
+  } catch (err) {
+    console.error("Error haciendo fetch de", path, err)
+    return []
   }
 }
 
@@ -165,19 +132,22 @@ function evaluateValue(config: SensorConfig, value: number): Evaluation {
 // Helpers de datos
 // --------------------------
 
-async function fetchHistory(
-  path: string,
-  setter: (data: ChartPoint[]) => void,
+async function fetchAllHistory(
+  setters: Record<string, (data: ChartPoint[]) => void>,
 ) {
+  const types = Object.keys(setters).join(",")
+  const path = `/measurements?types=${types}&limit=${MAX_POINTS}`
   try {
     const res = await fetch(`${API_BASE}${path}`)
     if (!res.ok) {
       console.error("Error al hacer fetch de", path, res.status)
       return
     }
-    const json: ApiPoint[] = await res.json()
-    const normalized = json.map(normalizePoint)
-    setter(normalized.slice(-MAX_POINTS))
+    const json: Record<string, ApiPoint[]> = await res.json()
+    for (const [key, setter] of Object.entries(setters)) {
+      const normalized = (json[key] ?? []).map(normalizePoint)
+      setter(normalized.slice(-MAX_POINTS))
+    }
   } catch (err) {
     console.error("Error haciendo fetch de", path, err)
   }
@@ -267,16 +237,6 @@ function SensorStatusCard({
   )
 }
 
-type AlertItem = {
-  id: string
-  sensorLabel: string
-  time: string
-  value: number
-  unit: string
-  severity: Severity
-  message: string
-}
-
 export default function AlertasPage() {
   const [tempData, setTempData] = useState<ChartPoint[]>([])
   const [humData, setHumData] = useState<ChartPoint[]>([])
@@ -284,16 +244,31 @@ export default function AlertasPage() {
   const [luzData, setLuzData] = useState<ChartPoint[]>([])
   const [gasData, setGasData] = useState<ChartPoint[]>([])
   const [isOnline, setIsOnline] = useState(false)
+  const [activeAlerts, setActiveAlerts] = useState<ServerAlert[]>([])
+  const [recentAlerts, setRecentAlerts] = useState<ServerAlert[]>([])
 
   // carga histórica
   useEffect(() => {
-    fetchHistory("/temperatura?limit=200", setTempData)
-    fetchHistory("/humedad?limit=200", setHumData)
-    fetchHistory("/presion?limit=200", setPresData)
-    fetchHistory("/luz?limit=200", setLuzData)
-    fetchHistory("/gas?limit=200", setGasData)
+    // Un solo request para las 5 series
+    fetchAllHistory({
+      temperatura: setTempData,
+      humedad: setHumData,
+      presion: setPresData,
+      luz: setLuzData,
+      gas: setGasData,
+    })
   }, [])
 
+  // Las alertas abiertas llegan con cada snapshot del WS; el historial se
+  // vuelve a pedir solo cuando cambia el conjunto de abiertas
+  const activeIds = useMemo(
+    () => activeAlerts.map((a) => a.id).join(","),
+    [activeAlerts],
+  )
+  useEffect(() => {
+    fetchAlerts().then(setRecentAlerts)
+  }, [activeIds])
+
   // WebSocket para datos nuevos
   useEffect(() => {
     const wsUrl = API_BASE.replace("http", "ws") + "/ws"
@@ -327,6 +302,9 @@ export default function AlertasPage() {
           const p = normalizePoint(data.gas)
           setGasData((prev) => insertById(prev, p))
         }
+        if (data.alertas) {
+          setActiveAlerts(data.alertas)
+        }
       } catch (err) {
         console.error("[Alertas] Error parseando WS:", err)
       }
@@ -341,75 +319,11 @@ export default function AlertasPage() {
   const latestLuz = getLatest(luzData)
   const latestGas = getLatest(gasData)
 
-  const tempEval = latestTemp
-    ? evaluateValue(
-        SENSOR_CONFIGS.find((c) => c.key === "temperatura")!,
-        latestTemp.value,
-      )
-    : null
-
-  const humEval = latestHum
-    ? evaluateValue(
-        SENSOR_CONFIGS.find((c) => c.key === "humedad")!,
-        latestHum.value,
-      )
-    : null
-
-  const presEval = latestPres
-    ? evaluateValue(
-        SENSOR_CONFIGS.find((c) => c.key === "presion")!,
-        latestPres.value,
-      )
-    : null
-
-  const luzEval = latestLuz
-    ? evaluateValue(
-        SENSOR_CONFIGS.find((c) => c.key === "luz")!,
-        latestLuz.value,
-      )
-    : null
-
-  const gasEval = latestGas
-    ? evaluateValue(
-        SENSOR_CONFIGS.find((c) => c.key === "gas")!,
-        latestGas.value,
-      )
-    : null
-
-  // construir lista de alertas recientes (no solo el último valor)
-    const items: AlertItem[] = []
-
-    const pushFromData = (
-      config: SensorConfig,
-      data: ChartPoint[],
-    ) => {
-      data.forEach((p) => {
-        const evalRes = evaluateValue(config, p.value)
-        if (evalRes.severity === "ok") return
-        items.push({
-          id: `${config.key}-${p.id}`,
-          sensorLabel: config.label,
-          time: p.time,
-          value: p.value,
-          unit: config.unit,
-          severity: evalRes.severity,
-          message: evalRes.message,
-        })
-      })
-    }
-
-    const cfgTemp = SENSOR_CONFIGS.find((c) => c.key === "temperatura")!
-    const cfgHum = SENSOR_CONFIGS.find((c) => c.key === "humedad")!
-    const cfgLuz = SENSOR_CONFIGS.find((c) => c.key === "luz")!
-    const cfgGas = SENSOR_CONFIGS.find((c) => c.key === "gas")!
-
-    pushFromData(cfgTemp, tempData.slice(-80))
-    pushFromData(cfgHum, humData.slice(-80))
-    pushFromData(cfgLuz, luzData.slice(-80))
-    pushFromData(cfgGas, gasData.slice(-80))
-
-    // ordenamos por "reciente" usando el id (asumiendo autoincremental)
-    items.sort((a, b) => (a.id < b.id ? 1 : -1))
+  const tempEval = latestTemp ? evaluateSensor("temperatura", activeAlerts) : null
+  const humEval = latestHum ? evaluateSensor("humedad", activeAlerts) : null
+  const presEval = latestPres ? evaluateSensor("presion", activeAlerts) : null
+  const luzEval = latestLuz ? evaluateSensor("luz", activeAlerts) : null
+  const gasEval = latestGas ? evaluateSensor("gas", activeAlerts) : null
 
   return (
     <main className="min-h-screen bg-sky-100 p-10">
@@ -475,6 +389,36 @@ export default function AlertasPage() {
           />
         </div>
       </section>
+
+      {/* Historial de alertas (las genera el servidor) */}
+      <section className="pt-7">
+        <Card className="bg-slate-900/70 border-slate-800 shadow-lg">
+          <CardHeader>
+            <CardTitle className="text-sm text-slate-200">Alertas recientes</CardTitle>
+          </CardHeader>
+          <CardContent className="flex flex-col gap-2">
+            {recentAlerts.length === 0 && (
+              <span className="text-xs text-slate-400">Sin alertas registradas</span>
+            )}
+            {recentAlerts.map((alert) => (
+              <div
+                key={alert.id}
+                className="flex items-center justify-between gap-2 text-xs text-slate-300"
+              >
+                <div className="flex items-center gap-2">
+                  <SeverityBadge severity={alert.end === null ? alert.severity : "ok"} />
+                  <span>{alert.message}</span>
+                  <span className="text-slate-500">({alert.value.toFixed(1)})</span>
+                </div>
+                <span className="text-slate-400">
+                  {formatAlertTime(alert.start)}
+                  {alert.end ? ` – ${formatAlertTime(alert.end)}` : " · abierta"}
+                </span>
+              </div>
+            ))}
+          </CardContent>
+        </Card>
+      </section>
     </main>
   )
 }
\ No newline at end of file
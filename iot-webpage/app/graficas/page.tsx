@@ -33,18 +33,25 @@ const normalizePoint = (point: ApiPoint): ChartPoint => {
   }
 }
 
-async function fetchHistory(
-    path: string, 
-    setter: (data: ChartPoint[]) => void,
+async function fetchAllHistory(
+  setters: Record<string, (data: ChartPoint[]) => void>,
 ) {
-    try{
-        const res = await fetch(`${API_BASE}${path}`)
-        const json: ApiPoint[] = await res.json()
-        const normilized = json.map(normalizePoint)
-        setter(normilized.slice(-MAX_POINTS))
-    } catch (err) {
-        console.error("Error haciendo fetch de", path, err)
+  const types = Object.keys(setters).join(",")
+  const path = `/measurements?types=${types}&limit=${MAX_POINTS}`
+  try {
+    const res = await fetch(`${API_BASE}${path}`)
+    if (!res.ok) {
+      console.error("Error al hacer fetch de", path, res.status)
+      return
     }
+    const json: Record<string, ApiPoint[]> = await res.json()
+    for (const [key, setter] of Object.entries(setters)) {
+      const normalized = (json[key] ?? []).map(normalizePoint)
+      setter(normalized.slice(-MAX_POINTS))
+    }
+  } catch (err) {
+    console.error("Error haciendo fetch de", path, err)
+  }
 }
 
 export default function GraficasPage() {
@@ -102,11 +109,14 @@ export default function GraficasPage() {
   }, [])
 
   useEffect(() => {
-    fetchHistory("/temperatura?limit=200", setTempData)
-    fetchHistory("/humedad?limit=200", setHumData)
-    fetchHistory("/presion?limit=200", setPresData)
-    fetchHistory("/luz?limit=200", setLuzData)
-    fetchHistory("/gas?limit=200", setGasData)
+    // Un solo request para las 5 series
+    fetchAllHistory({
+      temperatura: setTempData,
+      humedad: setHumData,
+      presion: setPresData,
+      luz: setLuzData,
+      gas: setGasData,
+    })
   }, [])
 
   return (